@@ -0,0 +1,531 @@
+"""
+Microbenchmarks of the canonicalizers and their canonicalization networks on synthetic inputs.
+
+`run` times the forward pass (in eval mode, without gradients) and the forward and backward pass (in train mode,
+through the canonicalized data and the prior regularization loss) of every canonicalizer over a grid of batch
+sizes, image resolutions, numbers of points or particles and group sizes. It also measures the peak memory of both
+passes and writes everything to a JSON file. `compare` flags the cases of a new JSON file that are slower or use
+more memory than in a baseline JSON file by more than a relative threshold, and exits with status 1 if there are any.
+
+Every case runs in a fresh process, so the cases do not share caches or allocator state. On CUDA the peak memory
+is the peak allocated by PyTorch. On CPU it is the growth of the peak resident set size of the process, and the
+forward and backward pass is measured after the forward pass, so its peak is at least the forward one.
+
+Examples:
+    python benchmarks/run_benchmarks.py run --output baseline.json
+    python benchmarks/run_benchmarks.py run --output new.json --canonicalizers EquivariantPointcloudCanonicalization
+    python benchmarks/run_benchmarks.py compare baseline.json new.json --threshold 0.1
+"""
+
+import argparse
+import importlib.metadata
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+METRICS = [
+    "forward_ms",
+    "forward_backward_ms",
+    "forward_peak_memory_mb",
+    "forward_backward_peak_memory_mb",
+]
+
+IMAGE_CANONICALIZERS = [
+    "GroupEquivariantImageCanonicalization",
+    "OptimizedGroupEquivariantImageCanonicalization",
+    "SteerableImageCanonicalization",
+    "OptimizedSteerableImageCanonicalization",
+]
+CANONICALIZERS = IMAGE_CANONICALIZERS + [
+    "EquivariantPointcloudCanonicalization",
+    "EuclideanGroupNBody",
+]
+
+
+def get_cases(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Builds the grid of benchmark cases.
+
+    Args:
+        args (argparse.Namespace): The arguments of the `run` command.
+
+    Returns:
+        List[Dict[str, Any]]: The parameters of every case, including the name of the canonicalizer.
+    """
+    cases = []
+    for canonicalizer in args.canonicalizers:
+        if canonicalizer in IMAGE_CANONICALIZERS:
+            # the steerable networks of e2cnn only support rotations
+            group_types = (
+                ["rotation"]
+                if canonicalizer == "SteerableImageCanonicalization"
+                else args.group_types
+            )
+            # the number of rotations only sets the size of the discrete groups
+            num_rotations = (
+                args.num_rotations if "GroupEquivariant" in canonicalizer else [None]
+            )
+            grid = itertools.product(
+                args.batch_sizes, args.resolutions, group_types, num_rotations
+            )
+            cases += [
+                {
+                    "canonicalizer": canonicalizer,
+                    "batch_size": batch_size,
+                    "resolution": resolution,
+                    "group_type": group_type,
+                    **({} if rotations is None else {"num_rotations": rotations}),
+                }
+                for batch_size, resolution, group_type, rotations in grid
+            ]
+        elif canonicalizer == "EquivariantPointcloudCanonicalization":
+            cases += [
+                {
+                    "canonicalizer": canonicalizer,
+                    "batch_size": batch_size,
+                    "num_points": num_points,
+                }
+                for batch_size, num_points in itertools.product(
+                    args.batch_sizes, args.num_points
+                )
+            ]
+        elif canonicalizer == "EuclideanGroupNBody":
+            cases += [
+                {
+                    "canonicalizer": canonicalizer,
+                    "batch_size": batch_size,
+                    "num_particles": num_particles,
+                }
+                for batch_size, num_particles in itertools.product(
+                    args.batch_sizes, args.num_particles
+                )
+            ]
+        else:
+            raise ValueError(f"{canonicalizer} is not a known canonicalizer")
+    return cases
+
+
+def get_case_name(case: Dict[str, Any]) -> str:
+    """
+    Returns the name of a case, used to match the cases of two result files.
+
+    Args:
+        case (Dict[str, Any]): The parameters of the case.
+
+    Returns:
+        str: The name of the canonicalizer followed by the other parameters.
+    """
+    params = [f"{key}={value}" for key, value in case.items() if key != "canonicalizer"]
+    return "/".join([case["canonicalizer"]] + params)
+
+
+def build_image_case(
+    case: Dict[str, Any], device: Any
+) -> Tuple[Any, Callable[[], Tuple]]:
+    """
+    Builds an image canonicalizer and its forward function on random images.
+
+    Args:
+        case (Dict[str, Any]): The parameters of the case.
+        device (torch.device): The device of the canonicalizer and the inputs.
+
+    Returns:
+        Tuple[BaseCanonicalization, Callable[[], Tuple]]: The canonicalizer and a function returning its outputs.
+    """
+    import torch
+    from omegaconf import DictConfig
+
+    from equiadapt import (
+        ConvNetwork,
+        CustomEquivariantNetwork,
+        ESCNNSteerableNetwork,
+        GroupEquivariantImageCanonicalization,
+        OptimizedGroupEquivariantImageCanonicalization,
+        OptimizedSteerableImageCanonicalization,
+        SteerableImageCanonicalization,
+    )
+
+    resolution = case["resolution"]
+    in_shape = (3, resolution, resolution)
+    canonicalization_hyperparams = DictConfig(
+        {
+            "beta": 1.0,
+            "group_type": case["group_type"],
+            "num_rotations": case.get("num_rotations", 4),
+            "artifact_err_wt": 0.0,
+            "input_crop_ratio": 0.8,
+            "resize_shape": resolution,
+            "learn_ref_vec": False,
+        }
+    )
+    if case["canonicalizer"] == "GroupEquivariantImageCanonicalization":
+        canonicalizer = GroupEquivariantImageCanonicalization(
+            CustomEquivariantNetwork(
+                in_shape,
+                out_channels=16,
+                kernel_size=5,
+                group_type=case["group_type"],
+                num_rotations=case["num_rotations"],
+                num_layers=3,
+                device=str(device),
+            ),
+            canonicalization_hyperparams,
+            in_shape,
+        )
+    elif case["canonicalizer"] == "OptimizedGroupEquivariantImageCanonicalization":
+        canonicalizer = OptimizedGroupEquivariantImageCanonicalization(
+            ConvNetwork(in_shape, out_channels=16, kernel_size=5, num_layers=3),
+            canonicalization_hyperparams,
+            in_shape,
+        )
+    elif case["canonicalizer"] == "SteerableImageCanonicalization":
+        canonicalizer = SteerableImageCanonicalization(
+            ESCNNSteerableNetwork(
+                in_shape, out_channels=16, kernel_size=7, num_layers=3
+            ),
+            canonicalization_hyperparams,
+            in_shape,
+        )
+    else:
+        canonicalizer = OptimizedSteerableImageCanonicalization(
+            ConvNetwork(
+                in_shape,
+                out_channels=16,
+                kernel_size=5,
+                num_layers=3,
+                out_vector_size=4,
+            ),
+            canonicalization_hyperparams,
+            in_shape,
+        )
+    canonicalizer = canonicalizer.to(device)
+    x = torch.rand(case["batch_size"], *in_shape, device=device)
+    return canonicalizer, lambda: (canonicalizer(x),)
+
+
+def build_pointcloud_case(
+    case: Dict[str, Any], device: Any
+) -> Tuple[Any, Callable[[], Tuple]]:
+    """
+    Builds a pointcloud canonicalizer and its forward function on random point clouds.
+
+    Args:
+        case (Dict[str, Any]): The parameters of the case.
+        device (torch.device): The device of the canonicalizer and the inputs.
+
+    Returns:
+        Tuple[BaseCanonicalization, Callable[[], Tuple]]: The canonicalizer and a function returning its outputs.
+    """
+    import torch
+    from omegaconf import DictConfig
+
+    from equiadapt import EquivariantPointcloudCanonicalization, VNSmall
+
+    canonicalizer = EquivariantPointcloudCanonicalization(
+        canonicalization_network=VNSmall(DictConfig({"n_knn": 20, "pooling": "mean"})),
+        canonicalization_hyperparams=DictConfig({}),
+    ).to(device)
+    x = torch.randn(case["batch_size"], 3, case["num_points"], device=device)
+    return canonicalizer, lambda: (canonicalizer(x),)
+
+
+def build_nbody_case(
+    case: Dict[str, Any], device: Any
+) -> Tuple[Any, Callable[[], Tuple]]:
+    """
+    Builds an N-body canonicalizer and its forward function on random fully connected systems.
+
+    Args:
+        case (Dict[str, Any]): The parameters of the case.
+        device (torch.device): The device of the canonicalizer and the inputs.
+
+    Returns:
+        Tuple[BaseCanonicalization, Callable[[], Tuple]]: The canonicalizer and a function returning its outputs.
+    """
+    import torch
+    from omegaconf import DictConfig
+
+    from equiadapt.nbody.canonicalization.euclidean_group import EuclideanGroupNBody
+    from equiadapt.nbody.canonicalization_networks.custom_equivariant_networks import (
+        VNDeepSets,
+    )
+
+    batch_size, num_particles = case["batch_size"], case["num_particles"]
+    canonicalization_network = VNDeepSets(
+        DictConfig(
+            {
+                "num_layers": 4,
+                "hidden_dim": 16,
+                "layer_pooling": "mean",
+                "final_pooling": "mean",
+                "out_dim": 4,
+                "batch_size": batch_size,
+                "nonlinearity": "relu",
+                "canon_feature": "pv",
+                "canon_translation": False,
+                "angular_feature": "pv",
+                "dropout": 0.0,
+            }
+        ),
+        device=str(device),
+    )
+    canonicalizer = EuclideanGroupNBody(canonicalization_network).to(device)
+
+    # every particle is connected to the other particles of its system
+    particles = torch.arange(num_particles, device=device)
+    rows, cols = torch.meshgrid(particles, particles, indexing="ij")
+    is_edge = rows != cols
+    offsets = (torch.arange(batch_size, device=device) * num_particles)[:, None]
+    edges = [
+        (rows[is_edge][None] + offsets).reshape(-1),
+        (cols[is_edge][None] + offsets).reshape(-1),
+    ]
+    loc = torch.randn(batch_size * num_particles, 3, device=device)
+    vel = torch.randn(batch_size * num_particles, 3, device=device)
+    charges = torch.randint(0, 2, (batch_size * num_particles, 1), device=device)
+    charges = charges * 2.0 - 1.0
+    edge_attr = torch.randn(edges[0].shape[0], 2, device=device)
+    nodes = torch.norm(vel, dim=1, keepdim=True)
+
+    def forward() -> Tuple:
+        return canonicalizer(
+            x=nodes,
+            targets=None,
+            loc=loc,
+            edges=edges,
+            vel=vel,
+            edge_attr=edge_attr,
+            charges=charges,
+        )
+
+    return canonicalizer, forward
+
+
+def get_peak_rss_mb() -> float:
+    """Returns the peak resident set size of the process in megabytes (ru_maxrss is in kilobytes on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(case: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one benchmark case. It is called in a fresh process.
+
+    Args:
+        case (Dict[str, Any]): The parameters of the case.
+        options (Dict[str, Any]): The device, number of threads, warmup iterations and minimum run time.
+
+    Returns:
+        Dict[str, Any]: The parameters and the metrics of the case.
+    """
+    import torch
+    import torch.utils.benchmark as benchmark
+
+    torch.manual_seed(0)
+    torch.set_num_threads(options["num_threads"])
+    device = torch.device(options["device"])
+    if case["canonicalizer"] in IMAGE_CANONICALIZERS:
+        canonicalizer, forward = build_image_case(case, device)
+    elif case["canonicalizer"] == "EquivariantPointcloudCanonicalization":
+        canonicalizer, forward = build_pointcloud_case(case, device)
+    else:
+        canonicalizer, forward = build_nbody_case(case, device)
+
+    def inference_step() -> None:
+        with torch.no_grad():
+            forward()
+
+    def training_step() -> None:
+        canonicalizer.zero_grad(set_to_none=True)
+        loss = sum(output.sum() for output in forward())
+        loss = loss + canonicalizer.get_prior_regularization_loss()
+        loss.backward()
+
+    result = dict(case)
+    baseline_rss = get_peak_rss_mb()
+    for mode, step, training in (
+        ("forward", inference_step, False),
+        ("forward_backward", training_step, True),
+    ):
+        canonicalizer.train(training)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            allocated = torch.cuda.memory_allocated(device)
+        step()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            peak_memory = (torch.cuda.max_memory_allocated(device) - allocated) / 2**20
+        else:
+            peak_memory = get_peak_rss_mb() - baseline_rss
+
+        for _ in range(options["warmup"]):
+            step()
+        # Timer synchronizes CUDA and defaults to a single thread
+        measurement = benchmark.Timer(
+            stmt="step()", globals={"step": step}, num_threads=torch.get_num_threads()
+        ).blocked_autorange(min_run_time=options["min_run_time"])
+        result[f"{mode}_ms"] = measurement.median * 1000
+        result[f"{mode}_iqr_ms"] = measurement.iqr * 1000
+        result[f"{mode}_peak_memory_mb"] = peak_memory
+    return result
+
+
+def get_equiadapt_version() -> str:
+    """Returns the installed version of equiadapt, or "unknown" if it is not installed."""
+    try:
+        return importlib.metadata.version("equiadapt")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Runs the benchmark cases and writes their results to a JSON file.
+
+    Args:
+        args (argparse.Namespace): The arguments of the `run` command.
+    """
+    import torch
+
+    options = {
+        "device": args.device,
+        "num_threads": args.num_threads or torch.get_num_threads(),
+        "warmup": args.warmup,
+        "min_run_time": args.min_run_time,
+    }
+    metadata = {
+        "equiadapt_version": get_equiadapt_version(),
+        "torch_version": torch.__version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        **options,
+    }
+    results = []
+    # spawn, since forking a process that already used the intra-op thread pool can hang
+    context = multiprocessing.get_context("spawn")
+    for case in get_cases(args):
+        name = get_case_name(case)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                result = executor.submit(run_case, case, options).result()
+            except Exception as error:
+                print(f"{name}: failed with {error!r}")
+                results.append({"name": name, **case, "error": repr(error)})
+                continue
+        print(
+            f"{name}: forward {result['forward_ms']:.2f} ms, "
+            f"forward+backward {result['forward_backward_ms']:.2f} ms, "
+            f"peak memory {result['forward_backward_peak_memory_mb']:.1f} MB"
+        )
+        results.append({"name": name, **result})
+
+    with open(args.output, "w") as output_file:
+        json.dump({"metadata": metadata, "results": results}, output_file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+def compare(args: argparse.Namespace) -> int:
+    """
+    Compares the results of two JSON files and reports the regressions.
+
+    Args:
+        args (argparse.Namespace): The arguments of the `compare` command.
+
+    Returns:
+        int: 1 if a metric regressed by more than the threshold, 0 otherwise.
+    """
+    with open(args.baseline) as baseline_file:
+        baseline = {
+            result["name"]: result for result in json.load(baseline_file)["results"]
+        }
+    with open(args.new) as new_file:
+        new = {result["name"]: result for result in json.load(new_file)["results"]}
+
+    regressions = []
+    print(f"{'case':<100} {'metric':<32} {'baseline':>10} {'new':>10} {'change':>8}")
+    for name in sorted(baseline.keys() & new.keys()):
+        for metric in METRICS:
+            old_value, new_value = baseline[name].get(metric), new[name].get(metric)
+            if old_value is None or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value if old_value > 0 else 0.0
+            # small memory differences are page and allocator noise
+            is_regression = change > args.threshold and (
+                "memory" not in metric
+                or new_value - old_value > args.memory_tolerance_mb
+            )
+            if is_regression:
+                regressions.append((name, metric))
+            print(
+                f"{name:<100} {metric:<32} {old_value:>10.2f} {new_value:>10.2f} "
+                f"{change:>+8.1%}{'  REGRESSION' if is_regression else ''}"
+            )
+
+    for name in sorted(baseline.keys() ^ new.keys()):
+        source = "the baseline" if name in baseline else "the new results"
+        print(f"{name}: only in {source}")
+    print(
+        f"{len(regressions)} regressions beyond {args.threshold:.0%}"
+        + "".join(f"\n  {name} {metric}" for name, metric in regressions)
+    )
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    """Parses the command line and runs the `run` or `compare` command."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument(
+        "--canonicalizers", nargs="+", choices=CANONICALIZERS, default=CANONICALIZERS
+    )
+    run_parser.add_argument("--batch-sizes", nargs="+", type=int, default=[8, 32])
+    run_parser.add_argument("--resolutions", nargs="+", type=int, default=[32, 64])
+    run_parser.add_argument("--num-points", nargs="+", type=int, default=[256, 1024])
+    run_parser.add_argument("--num-particles", nargs="+", type=int, default=[5, 20])
+    run_parser.add_argument("--num-rotations", nargs="+", type=int, default=[4, 8])
+    run_parser.add_argument(
+        "--group-types",
+        nargs="+",
+        choices=["rotation", "roto-reflection"],
+        default=["rotation", "roto-reflection"],
+    )
+    run_parser.add_argument("--device", default="cpu")
+    run_parser.add_argument(
+        "--num-threads", type=int, default=None, help="defaults to the torch default"
+    )
+    run_parser.add_argument("--warmup", type=int, default=2)
+    run_parser.add_argument(
+        "--min-run-time", type=float, default=0.5, help="in seconds, per measurement"
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="flag the regressions of new results against a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative increase above which a metric is a regression",
+    )
+    compare_parser.add_argument("--memory-tolerance-mb", type=float, default=1.0)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,55 +1,67 @@
-from equiadapt.common import (
-    BaseCanonicalization,
-    ContinuousGroupCanonicalization,
-    DiscreteGroupCanonicalization,
-    IdentityCanonicalization,
-    LieParameterization,
-    basecanonicalization,
-    gram_schmidt,
-)
-from equiadapt.images import (
-    ContinuousGroupImageCanonicalization,
-    ConvNetwork,
-    CustomEquivariantNetwork,
-    DiscreteGroupImageCanonicalization,
-    ESCNNEquivariantNetwork,
-    ESCNNSteerableNetwork,
-    ESCNNWideBasic,
-    ESCNNWideBottleneck,
-    ESCNNWRNEquivariantNetwork,
-    GroupEquivariantImageCanonicalization,
-    OptimizedGroupEquivariantImageCanonicalization,
-    OptimizedSteerableImageCanonicalization,
-    ResNet18Network,
-    RotationEquivariantConv,
-    RotationEquivariantConvLift,
-    RotoReflectionEquivariantConv,
-    RotoReflectionEquivariantConvLift,
-    SteerableImageCanonicalization,
-    custom_equivariant_networks,
-    custom_group_equivariant_layers,
-    custom_nonequivariant_networks,
-    escnn_networks,
-    get_action_on_image_features,
-)
-from equiadapt.pointcloud import (
-    ContinuousGroupPointcloudCanonicalization,
-    EquivariantPointcloudCanonicalization,
-    VNBatchNorm,
-    VNBilinear,
-    VNLeakyReLU,
-    VNLinear,
-    VNLinearLeakyReLU,
-    VNMaxPool,
-    VNSmall,
-    VNSoftplus,
-    VNStdFeature,
-    equivariant_networks,
-    get_graph_feature_cross,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.common import (
+        BaseCanonicalization,
+        CanonicalizationResult,
+        CanonicalizedModel,
+        ContinuousGroupCanonicalization,
+        DiscreteGroupCanonicalization,
+        DynamicBatchingServer,
+        IdentityCanonicalization,
+        LieParameterization,
+        basecanonicalization,
+        export_onnx,
+        gram_schmidt,
+        orthonormalize,
+    )
+    from equiadapt.images import (
+        ContinuousGroupImageCanonicalization,
+        ConvNetwork,
+        CustomEquivariantNetwork,
+        DiscreteGroupImageCanonicalization,
+        ESCNNEquivariantNetwork,
+        ESCNNSteerableNetwork,
+        ESCNNWideBasic,
+        ESCNNWideBottleneck,
+        ESCNNWRNEquivariantNetwork,
+        GroupEquivariantImageCanonicalization,
+        OptimizedGroupEquivariantImageCanonicalization,
+        OptimizedSteerableImageCanonicalization,
+        ResNet18Network,
+        RotationEquivariantConv,
+        RotationEquivariantConvLift,
+        RotoReflectionEquivariantConv,
+        RotoReflectionEquivariantConvLift,
+        SteerableImageCanonicalization,
+        custom_equivariant_networks,
+        custom_group_equivariant_layers,
+        custom_nonequivariant_networks,
+        escnn_networks,
+        get_action_on_image_features,
+    )
+    from equiadapt.pointcloud import (
+        ContinuousGroupPointcloudCanonicalization,
+        EquivariantPointcloudCanonicalization,
+        VNBatchNorm,
+        VNBilinear,
+        VNLeakyReLU,
+        VNLinear,
+        VNLinearLeakyReLU,
+        VNMaxPool,
+        VNSmall,
+        VNSoftplus,
+        VNStdFeature,
+        equivariant_networks,
+        get_graph_feature_cross,
+    )
 
 __all__ = [
     "BaseCanonicalization",
+    "CanonicalizationResult",
+    "CanonicalizedModel",
     "ContinuousGroupCanonicalization",
     "ContinuousGroupImageCanonicalization",
     "ContinuousGroupPointcloudCanonicalization",
@@ -57,6 +69,7 @@ __all__ = [
     "CustomEquivariantNetwork",
     "DiscreteGroupCanonicalization",
     "DiscreteGroupImageCanonicalization",
+    "DynamicBatchingServer",
     "ESCNNEquivariantNetwork",
     "ESCNNSteerableNetwork",
     "ESCNNWRNEquivariantNetwork",
@@ -89,7 +102,64 @@ __all__ = [
     "custom_nonequivariant_networks",
     "equivariant_networks",
     "escnn_networks",
+    "export_onnx",
     "get_action_on_image_features",
     "get_graph_feature_cross",
     "gram_schmidt",
+    "orthonormalize",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=[],
+    attributes={
+        "BaseCanonicalization": "equiadapt.common",
+        "CanonicalizationResult": "equiadapt.common",
+        "CanonicalizedModel": "equiadapt.common",
+        "ContinuousGroupCanonicalization": "equiadapt.common",
+        "DiscreteGroupCanonicalization": "equiadapt.common",
+        "DynamicBatchingServer": "equiadapt.common",
+        "IdentityCanonicalization": "equiadapt.common",
+        "LieParameterization": "equiadapt.common",
+        "basecanonicalization": "equiadapt.common",
+        "export_onnx": "equiadapt.common",
+        "gram_schmidt": "equiadapt.common",
+        "orthonormalize": "equiadapt.common",
+        "ContinuousGroupImageCanonicalization": "equiadapt.images",
+        "ConvNetwork": "equiadapt.images",
+        "CustomEquivariantNetwork": "equiadapt.images",
+        "DiscreteGroupImageCanonicalization": "equiadapt.images",
+        "ESCNNEquivariantNetwork": "equiadapt.images",
+        "ESCNNSteerableNetwork": "equiadapt.images",
+        "ESCNNWideBasic": "equiadapt.images",
+        "ESCNNWideBottleneck": "equiadapt.images",
+        "ESCNNWRNEquivariantNetwork": "equiadapt.images",
+        "GroupEquivariantImageCanonicalization": "equiadapt.images",
+        "OptimizedGroupEquivariantImageCanonicalization": "equiadapt.images",
+        "OptimizedSteerableImageCanonicalization": "equiadapt.images",
+        "ResNet18Network": "equiadapt.images",
+        "RotationEquivariantConv": "equiadapt.images",
+        "RotationEquivariantConvLift": "equiadapt.images",
+        "RotoReflectionEquivariantConv": "equiadapt.images",
+        "RotoReflectionEquivariantConvLift": "equiadapt.images",
+        "SteerableImageCanonicalization": "equiadapt.images",
+        "custom_equivariant_networks": "equiadapt.images",
+        "custom_group_equivariant_layers": "equiadapt.images",
+        "custom_nonequivariant_networks": "equiadapt.images",
+        "escnn_networks": "equiadapt.images",
+        "get_action_on_image_features": "equiadapt.images",
+        "ContinuousGroupPointcloudCanonicalization": "equiadapt.pointcloud",
+        "EquivariantPointcloudCanonicalization": "equiadapt.pointcloud",
+        "VNBatchNorm": "equiadapt.pointcloud",
+        "VNBilinear": "equiadapt.pointcloud",
+        "VNLeakyReLU": "equiadapt.pointcloud",
+        "VNLinear": "equiadapt.pointcloud",
+        "VNLinearLeakyReLU": "equiadapt.pointcloud",
+        "VNMaxPool": "equiadapt.pointcloud",
+        "VNSmall": "equiadapt.pointcloud",
+        "VNSoftplus": "equiadapt.pointcloud",
+        "VNStdFeature": "equiadapt.pointcloud",
+        "equivariant_networks": "equiadapt.pointcloud",
+        "get_graph_feature_cross": "equiadapt.pointcloud",
+    },
+)
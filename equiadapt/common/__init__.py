@@ -1,19 +1,70 @@
-from equiadapt.common import basecanonicalization, utils
-from equiadapt.common.basecanonicalization import (
-    BaseCanonicalization,
-    ContinuousGroupCanonicalization,
-    DiscreteGroupCanonicalization,
-    IdentityCanonicalization,
-)
-from equiadapt.common.utils import LieParameterization, gram_schmidt
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.common import (
+        basecanonicalization,
+        export,
+        instrumentation,
+        serving,
+        utils,
+    )
+    from equiadapt.common.basecanonicalization import (
+        BaseCanonicalization,
+        CanonicalizationResult,
+        ContinuousGroupCanonicalization,
+        DiscreteGroupCanonicalization,
+        IdentityCanonicalization,
+    )
+    from equiadapt.common.export import CanonicalizedModel, export_onnx
+    from equiadapt.common.instrumentation import StageProfiler
+    from equiadapt.common.serving import DynamicBatchingServer, ServingMetrics
+    from equiadapt.common.utils import LieParameterization, gram_schmidt, orthonormalize
 
 __all__ = [
     "BaseCanonicalization",
+    "CanonicalizationResult",
+    "CanonicalizedModel",
     "ContinuousGroupCanonicalization",
     "DiscreteGroupCanonicalization",
+    "DynamicBatchingServer",
     "IdentityCanonicalization",
     "LieParameterization",
+    "ServingMetrics",
+    "StageProfiler",
     "basecanonicalization",
+    "export",
+    "export_onnx",
     "gram_schmidt",
+    "instrumentation",
+    "orthonormalize",
+    "serving",
     "utils",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=[
+        "basecanonicalization",
+        "export",
+        "instrumentation",
+        "serving",
+        "utils",
+    ],
+    attributes={
+        "BaseCanonicalization": "equiadapt.common.basecanonicalization",
+        "CanonicalizationResult": "equiadapt.common.basecanonicalization",
+        "CanonicalizedModel": "equiadapt.common.export",
+        "ContinuousGroupCanonicalization": "equiadapt.common.basecanonicalization",
+        "DiscreteGroupCanonicalization": "equiadapt.common.basecanonicalization",
+        "DynamicBatchingServer": "equiadapt.common.serving",
+        "IdentityCanonicalization": "equiadapt.common.basecanonicalization",
+        "LieParameterization": "equiadapt.common.utils",
+        "ServingMetrics": "equiadapt.common.serving",
+        "StageProfiler": "equiadapt.common.instrumentation",
+        "export_onnx": "equiadapt.common.export",
+        "gram_schmidt": "equiadapt.common.utils",
+        "orthonormalize": "equiadapt.common.utils",
+    },
+)
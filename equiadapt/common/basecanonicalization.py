@@ -7,6 +7,8 @@ Canonicalizarion allows you to use any existing arcitecture (even pre-trained on
 
 The module contains the following classes:
 
+- `CanonicalizationResult`: This is a named tuple holding the output of a stateless canonicalization call.
+
 - `BaseCanonicalization`: This is an abstract base class that defines the interface for all canonicalization methods.
 
 - `IdentityCanonicalization`: This class represents an identity canonicalization method, which is a no-op; it doesn't change the input data.
@@ -18,10 +20,62 @@ The module contains the following classes:
 Each class has methods to perform the canonicalization, invert it, and calculate the prior regularization loss and identity metric.
 """
 
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import torch
 
+from equiadapt.common.instrumentation import StageProfiler
+from equiadapt.common.utils import is_compiling
+
+# the stages instrumented by `enable_instrumentation`, with the methods that run them.
+# The canonicalization network (and the prediction network) are instrumented too
+INSTRUMENTED_STAGES = (
+    (
+        "pre_network_transforms",
+        "transformations_before_canonicalization_network_forward",
+    ),
+    ("group_augment", "group_augment"),
+    ("group_element", "get_groupelement_and_info"),
+    ("group_element", "get_inference_group_activations"),
+    ("group_element", "get_inference_groupelement"),
+    ("warp", "apply_inverse_group_element"),
+    ("invert_canonicalization", "invert_canonicalization"),
+)
+
+
+class CanonicalizationResult(NamedTuple):
+    """
+    Output of a stateless canonicalization call.
+
+    It is returned by `BaseCanonicalization.canonicalize_stateless` and carries everything that the stateful API
+    otherwise stores in `canonicalization_info_dict`. Passing it back to `invert_canonicalization`,
+    `get_prior_regularization_loss` or `get_identity_metric` lets a single canonicalizer serve several
+    threads or batches at the same time. The fields cannot be reassigned, but `group_element` and
+    `canonicalization_info` are plain dicts that are shared, not copied, so they should not be modified.
+
+    Attributes:
+        canonicalized_x: The canonicalized input data.
+        group_element: The group element used to canonicalize each input of the batch.
+        canonicalization_info: The information about the canonicalization, with the same keys as `canonicalization_info_dict`.
+        targets: The canonicalized targets, if any were passed.
+    """
+
+    canonicalized_x: Any
+    group_element: Dict[str, torch.Tensor]
+    canonicalization_info: Dict[str, Any]
+    targets: Optional[List] = None
+
+    @property
+    def group_activations(self) -> Optional[torch.Tensor]:
+        """The activations for each group element (discrete groups only)."""
+        return self.canonicalization_info.get("group_activations")
+
+    @property
+    def group_element_matrix_representation(self) -> Optional[torch.Tensor]:
+        """The matrix representation of the group element (continuous groups only)."""
+        return self.canonicalization_info.get("group_element_matrix_representation")
+
+
 # Base skeleton for the canonicalization class
 # DiscreteGroupCanonicalization and ContinuousGroupCanonicalization will inherit from this class
 
@@ -32,6 +86,18 @@ class BaseCanonicalization(torch.nn.Module):
 
     This class is used as a base for all canonicalization methods.
     Subclasses should implement the canonicalize method to define the specific canonicalization process.
+    Subclasses can also implement canonicalize_stateless, which returns a `CanonicalizationResult` instead of
+    storing the information about the canonicalization on the module, and canonicalize_inference, which only
+    returns tensors so that the canonicalization can be compiled.
+
+    The time and memory spent in every stage of the canonicalization can be measured with `enable_instrumentation`.
+
+    Constant tensors used on every call (group angles, identity matrices, masks) are built once in `__init__` and
+    kept as non-persistent buffers, so they follow the module across devices without being saved.
+
+    Canonicalizers that set `identity_short_circuit` skip, at inference, the warp and the inversion of the samples
+    whose group element is the identity (within `identity_tolerance`), see `apply_to_non_identity`. The samples
+    that skipped the warp are counted by the stateful `canonicalize`, see `get_identity_short_circuit_rate`.
 
     """
 
@@ -39,6 +105,10 @@ class BaseCanonicalization(torch.nn.Module):
         super().__init__()
         self.canonicalization_network = canonicalization_network
         self.canonicalization_info_dict: Dict[str, torch.Tensor] = {}
+        self.instrumentation: Optional[StageProfiler] = None
+        self.identity_short_circuit = False
+        self.identity_tolerance = 1e-3
+        self.identity_short_circuit_stats = {"num_samples": 0, "num_short_circuited": 0}
 
     def forward(
         self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
@@ -76,6 +146,230 @@ class BaseCanonicalization(torch.nn.Module):
         """
         raise NotImplementedError()
 
+    def canonicalize_stateless(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> CanonicalizationResult:
+        """
+        This method canonicalizes the input data without storing anything on the module
+
+        Args:
+            x: input data
+            targets: (optional) additional targets that need to be canonicalized,
+                    such as boxes for promptable instance segmentation
+            **kwargs: additional arguments
+
+        Returns:
+            the canonicalized data, targets and information about the canonicalization
+        """
+        raise NotImplementedError()
+
+    def canonicalize_inference(self, x: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        """
+        This method canonicalizes the input data for inference, in a form that `torch.compile` can capture as a single graph
+
+        It only takes and returns tensors, stores nothing on the module and skips what is only needed for training,
+        so it can be compiled (or traced with `torch.jit.trace`) together with the prediction network.
+
+        Args:
+            x: input data
+
+        Returns:
+            the canonicalized data followed by the group element, as tensors
+        """
+        raise NotImplementedError()
+
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
+        """
+        This method maps the input data to the group element without storing anything on the module
+
+        Args:
+            x: input data
+
+        Returns:
+            the group element and the information about the canonicalization
+        """
+        raise NotImplementedError()
+
+    def get_groupelement(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """
+        This method maps the input data to the group element and stores its information in `canonicalization_info_dict`
+
+        Args:
+            x: input data
+
+        Returns:
+            the group element
+        """
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(x)
+        self.canonicalization_info_dict = canonicalization_info
+        return group_element_dict
+
+    def get_canonicalization_info_dict(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> Dict[str, Any]:
+        """
+        Returns the information about the canonicalization of the given result,
+        or the one stored by the last call to canonicalize if no result is given
+
+        Args:
+            canonicalization_result: (optional) result returned by canonicalize_stateless
+
+        Returns:
+            the information about the canonicalization
+        """
+        if canonicalization_result is not None:
+            return canonicalization_result.canonicalization_info
+        return self.canonicalization_info_dict
+
+    def enable_instrumentation(
+        self,
+        prediction_network: Optional[torch.nn.Module] = None,
+        cuda_events: bool = False,
+        track_memory: bool = True,
+    ) -> StageProfiler:
+        """
+        This method starts measuring the wall time, CUDA time and peak memory of every stage of the canonicalization
+
+        The stages are the transformations before the canonicalization network, the canonicalization network, the
+        extraction of the group element, the warp of the input, the inversion of the canonicalization and, if given,
+        the prediction network. They also appear as `equiadapt::<stage>` ranges in `torch.profiler` traces.
+        Instrumented methods break `torch.compile` graphs, so call `disable_instrumentation` before compiling.
+
+        Args:
+            prediction_network: (optional) the prediction network, to instrument its forward as well
+            cuda_events: whether to also record the CUDA time of the stages
+            track_memory: whether to track the peak CUDA memory of the stages
+
+        Returns:
+            the profiler accumulating the statistics, also available as `instrumentation`
+        """
+        self.disable_instrumentation()
+        profiler = StageProfiler(cuda_events=cuda_events, track_memory=track_memory)
+        profiler.wrap(
+            self.canonicalization_network, "forward", "canonicalization_network"
+        )
+        for stage, method_name in INSTRUMENTED_STAGES:
+            if hasattr(self, method_name):
+                profiler.wrap(self, method_name, stage)
+        if prediction_network is not None:
+            profiler.wrap(prediction_network, "forward", "prediction_network")
+        self.instrumentation = profiler
+        return profiler
+
+    def disable_instrumentation(self) -> None:
+        """
+        This method stops the instrumentation started by `enable_instrumentation` and restores the original methods
+        """
+        if self.instrumentation is not None:
+            self.instrumentation.unwrap()
+            self.instrumentation = None
+
+    def get_identity_mask(
+        self, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        This method returns which samples have the identity as group element, within `identity_tolerance`
+
+        Args:
+            group_element_dict: the group element of each sample
+
+        Returns:
+            boolean tensor of shape (batch_size,)
+        """
+        raise NotImplementedError()
+
+    def use_identity_short_circuit(self) -> bool:
+        """
+        This method returns whether the samples with the identity group element skip the warp and the inversion
+
+        It is only the case at inference: in training, skipping the warp would stop the gradient to the group element
+        of these samples. It is not the case while compiling or exporting either, since the number of warped samples
+        depends on the data.
+
+        Returns:
+            whether `apply_to_non_identity` should be used
+        """
+        return self.identity_short_circuit and not self.training and not is_compiling()
+
+    def apply_to_non_identity(
+        self,
+        action: Callable[[torch.Tensor, Dict[str, torch.Tensor]], torch.Tensor],
+        x: torch.Tensor,
+        group_element_dict: Dict[str, torch.Tensor],
+        identity_mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """
+        This method applies a group action only to the samples whose group element is not the identity
+
+        The other samples are copied unchanged, so the output must have the shape of the input.
+        Nothing is stored on the module, so it can run from several threads at once.
+
+        Args:
+            action: the group action, called with the non-identity samples and their group elements
+            x: the samples, with the batch as first dimension
+            group_element_dict: the group element of each sample, with the batch as first dimension
+            identity_mask: (optional) the output of `get_identity_mask`, computed if not given
+
+        Returns:
+            the output of the group action for every sample
+        """
+        if identity_mask is None:
+            identity_mask = self.get_identity_mask(group_element_dict)
+        # the only synchronization with the device: the number of samples to transform
+        indices = (~identity_mask).nonzero().squeeze(1)
+        if len(indices) == len(identity_mask):
+            return action(x, group_element_dict)
+
+        x_out = x.clone()
+        if len(indices) > 0:
+            x_out[indices] = action(
+                x[indices],
+                {key: value[indices] for key, value in group_element_dict.items()},
+            )
+        return x_out
+
+    def update_identity_short_circuit_stats(
+        self, canonicalization_info: Dict[str, Any]
+    ) -> None:
+        """
+        This method counts the samples of a stateful `canonicalize` call that skipped the warp
+
+        Nothing is counted if the short circuit was not used. Otherwise `apply_to_non_identity` waits for the
+        mask anyway to select the samples to warp, so counting them does not stall the device any further.
+
+        Args:
+            canonicalization_info: the information about the canonicalization, with the `identity_mask` of the samples
+        """
+        identity_mask = canonicalization_info.get("identity_mask")
+        if identity_mask is None:
+            return
+        stats = self.identity_short_circuit_stats
+        stats["num_samples"] += len(identity_mask)
+        stats["num_short_circuited"] += int(identity_mask.sum())
+
+    def get_identity_short_circuit_rate(self) -> Optional[float]:
+        """
+        This method returns the fraction of the canonicalized samples that skipped the warp since the last reset
+
+        Only the stateful `canonicalize` calls that used the short circuit are counted.
+        `canonicalize_stateless` returns the `identity_mask` of its samples in the canonicalization information instead.
+
+        Returns:
+            the short-circuit rate, or None if no sample was canonicalized with the short circuit
+        """
+        num_samples = self.identity_short_circuit_stats["num_samples"]
+        if num_samples == 0:
+            return None
+        return self.identity_short_circuit_stats["num_short_circuited"] / num_samples
+
+    def reset_identity_short_circuit_stats(self) -> None:
+        """
+        This method resets the counters of `get_identity_short_circuit_rate`
+        """
+        self.identity_short_circuit_stats = {"num_samples": 0, "num_short_circuited": 0}
+
     def invert_canonicalization(
         self, x_canonicalized_out: torch.Tensor, **kwargs: Any
     ) -> torch.Tensor:
@@ -84,6 +378,7 @@ class BaseCanonicalization(torch.nn.Module):
 
         Args:
             canonicalized_outputs: output of the prediction network for canonicalized data
+            **kwargs: additional arguments, such as `canonicalization_result` returned by canonicalize_stateless
 
         Returns:
             outputs: output of the prediction network for the original data orientation,
@@ -106,6 +401,7 @@ class IdentityCanonicalization(BaseCanonicalization):
     Methods:
         __init__: Initializes the IdentityCanonicalization instance.
         canonicalize: Canonicalizes the input data. In this class, it returns the input data unchanged.
+        canonicalize_stateless: Returns the input data unchanged wrapped in a CanonicalizationResult.
     """
 
     def __init__(self, canonicalization_network: torch.nn.Module = torch.nn.Identity()):
@@ -139,6 +435,27 @@ class IdentityCanonicalization(BaseCanonicalization):
             return x, targets
         return x
 
+    def canonicalize_stateless(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> CanonicalizationResult:
+        """
+        Canonicalize the input data without storing anything on the module.
+
+        Args:
+            x: The input data.
+            targets: (Optional) Additional targets that need to be canonicalized.
+            **kwargs: Additional arguments.
+
+        Returns:
+            CanonicalizationResult: The unchanged input data and targets, with an empty group element.
+        """
+        return CanonicalizationResult(
+            canonicalized_x=x,
+            group_element={},
+            canonicalization_info={"group_element": {}},
+            targets=targets,
+        )
+
     def invert_canonicalization(
         self, x_canonicalized_out: torch.Tensor, **kwargs: Any
     ) -> torch.Tensor:
@@ -156,23 +473,33 @@ class IdentityCanonicalization(BaseCanonicalization):
         """
         return x_canonicalized_out
 
-    def get_prior_regularization_loss(self) -> torch.Tensor:
+    def get_prior_regularization_loss(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the prior regularization loss.
 
         For the IdentityCanonicalization class, this is always 0.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+
         Returns:
             torch.Tensor: A tensor containing the value 0.
         """
         return torch.tensor(0.0)
 
-    def get_identity_metric(self) -> torch.Tensor:
+    def get_identity_metric(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the identity metric.
 
         For the IdentityCanonicalization class, this is always 1.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+
         Returns:
             torch.Tensor: A tensor containing the value 1.
         """
@@ -194,6 +521,7 @@ class DiscreteGroupCanonicalization(BaseCanonicalization):
         __init__: Initializes the DiscreteGroupCanonicalization instance.
         groupactivations_to_groupelementonehot: Converts group activations to one-hot encoded group elements in a differentiable manner.
         canonicalize: Canonicalizes the input data.
+        canonicalize_stateless: Canonicalizes the input data and returns a CanonicalizationResult instead of storing it on the module.
         invert_canonicalization: Inverts the canonicalization.
         get_prior_regularization_loss: Gets the prior regularization loss.
         get_identity_metric: Gets the identity metric.
@@ -287,27 +615,42 @@ class DiscreteGroupCanonicalization(BaseCanonicalization):
         """
         raise NotImplementedError()
 
-    def get_prior_regularization_loss(self) -> torch.Tensor:
+    def get_prior_regularization_loss(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the prior regularization loss.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+                If not given, the information stored by the last call to canonicalize is used.
+
         Returns:
             torch.Tensor: The prior regularization loss.
         """
-        group_activations = self.canonicalization_info_dict["group_activations"]
-        dataset_prior = torch.zeros((group_activations.shape[0],), dtype=torch.long).to(
-            self.device
-        )
-        return torch.nn.CrossEntropyLoss()(group_activations, dataset_prior)
+        group_activations = self.get_canonicalization_info_dict(
+            canonicalization_result
+        )["group_activations"]
+        # cross entropy with the identity (index 0) as target for every input,
+        # without building a tensor of targets
+        return -torch.log_softmax(group_activations, dim=-1)[:, 0].mean()
 
-    def get_identity_metric(self) -> torch.Tensor:
+    def get_identity_metric(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the identity metric.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+                If not given, the information stored by the last call to canonicalize is used.
+
         Returns:
             torch.Tensor: The identity metric.
         """
-        group_activations = self.canonicalization_info_dict["group_activations"]
+        group_activations = self.get_canonicalization_info_dict(
+            canonicalization_result
+        )["group_activations"]
         return (group_activations.argmax(dim=-1) == 0).float().mean()
 
 
@@ -320,26 +663,40 @@ class ContinuousGroupCanonicalization(BaseCanonicalization):
     Attributes:
         canonicalization_network (torch.nn.Module): The network used for canonicalization.
         beta (float): A parameter for the softmax function. Defaults to 1.0.
+        identity_matrix (torch.Tensor): The identity matrix of the group representation, if its size was given.
 
     Methods:
         __init__: Initializes the ContinuousGroupCanonicalization instance.
         canonicalizationnetworkout_to_groupelement: Converts the output of the canonicalization network to a group element in a differentiable manner.
         canonicalize: Canonicalizes the input data.
+        canonicalize_stateless: Canonicalizes the input data and returns a CanonicalizationResult instead of storing it on the module.
         invert_canonicalization: Inverts the canonicalization.
+        get_identity_matrix: Gets the identity matrix of the group representation.
         get_prior_regularization_loss: Gets the prior regularization loss.
         get_identity_metric: Gets the identity metric.
     """
 
-    def __init__(self, canonicalization_network: torch.nn.Module, beta: float = 1.0):
+    def __init__(
+        self,
+        canonicalization_network: torch.nn.Module,
+        beta: float = 1.0,
+        group_rep_dim: Optional[int] = None,
+    ):
         """
         Initializes the ContinuousGroupCanonicalization instance.
 
         Args:
             canonicalization_network (torch.nn.Module): The network used for canonicalization.
             beta (float, optional): A parameter for the softmax function. Defaults to 1.0.
+            group_rep_dim (Optional[int], optional): The size of the group element matrix representation.
+                If given, its identity matrix is kept as a non-persistent buffer. Defaults to None.
         """
         super().__init__(canonicalization_network)
         self.beta = beta
+        if group_rep_dim is not None:
+            self.register_buffer(
+                "identity_matrix", torch.eye(group_rep_dim), persistent=False
+            )
 
     def canonicalizationnetworkout_to_groupelement(
         self, group_activations: torch.Tensor
@@ -387,42 +744,76 @@ class ContinuousGroupCanonicalization(BaseCanonicalization):
         """
         raise NotImplementedError()
 
-    def get_prior_regularization_loss(self) -> torch.Tensor:
+    def get_identity_matrix(self, group_elements_rep: torch.Tensor) -> torch.Tensor:
+        """
+        Gets the identity matrix of the size of the group element matrix representation.
+
+        The `identity_matrix` buffer is used when it has the right size, otherwise the matrix is built on the device.
+
+        Args:
+            group_elements_rep (torch.Tensor): The group element matrix representation, of shape (batch_size, group_rep_dim, group_rep_dim).
+
+        Returns:
+            torch.Tensor: The identity matrix of shape (group_rep_dim, group_rep_dim).
+        """
+        group_rep_dim = group_elements_rep.shape[-1]
+        identity_matrix = getattr(self, "identity_matrix", None)
+        if identity_matrix is None or identity_matrix.shape[-1] != group_rep_dim:
+            return torch.eye(
+                group_rep_dim,
+                device=group_elements_rep.device,
+                dtype=group_elements_rep.dtype,
+            )
+        return identity_matrix.to(
+            device=group_elements_rep.device, dtype=group_elements_rep.dtype
+        )
+
+    def get_prior_regularization_loss(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the prior regularization loss.
 
         The prior regularization loss is calculated as the mean squared error between the group element matrix representation and the identity matrix.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+                If not given, the information stored by the last call to canonicalize is used.
+
         Returns:
             torch.Tensor: The prior regularization loss.
         """
-        group_elements_rep = self.canonicalization_info_dict[
+        group_elements_rep = self.get_canonicalization_info_dict(
+            canonicalization_result
+        )[
             "group_element_matrix_representation"
         ]  # shape: (batch_size, group_rep_dim, group_rep_dim)
-        # Set the dataset prior to identity matrix of size group_rep_dim and repeat it for batch_size
-        dataset_prior = (
-            torch.eye(group_elements_rep.shape[-1])
-            .repeat(group_elements_rep.shape[0], 1, 1)
-            .to(self.device)
+        # Set the dataset prior to identity matrix of size group_rep_dim, broadcast over the batch
+        dataset_prior = self.get_identity_matrix(group_elements_rep)
+        return torch.nn.functional.mse_loss(
+            group_elements_rep, dataset_prior.expand_as(group_elements_rep)
         )
-        return torch.nn.MSELoss()(group_elements_rep, dataset_prior)
 
-    def get_identity_metric(self) -> torch.Tensor:
+    def get_identity_metric(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the identity metric.
 
         The identity metric is calculated as 1 minus the mean of the mean squared error between the group element matrix representation and the identity matrix.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+                If not given, the information stored by the last call to canonicalize is used.
+
         Returns:
             torch.Tensor: The identity metric.
         """
-        group_elements_rep = self.canonicalization_info_dict[
-            "group_element_matrix_representation"
-        ]
-        identity_element = (
-            torch.eye(group_elements_rep.shape[-1])
-            .repeat(group_elements_rep.shape[0], 1, 1)
-            .to(self.device)
+        group_elements_rep = self.get_canonicalization_info_dict(
+            canonicalization_result
+        )["group_element_matrix_representation"]
+        identity_element = self.get_identity_matrix(group_elements_rep).expand_as(
+            group_elements_rep
         )
         return (
             1.0
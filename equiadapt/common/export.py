@@ -0,0 +1,136 @@
+"""
+This module contains the utilities to deploy a canonicalizer together with a prediction network as a single graph.
+
+`CanonicalizedModel` chains `canonicalize_inference`, the prediction network and, optionally, the inversion of the
+canonicalization in a module whose forward only takes and returns tensors. `export_onnx` traces it into one ONNX
+graph, so that the canonicalization network, the group element extraction and the warp of the input run in the
+same runtime as the prediction network, without any Python in between.
+
+The discrete image canonicalizers export the pixel permutation path (C2/C4 and D2/D4 on square images), the
+continuous image canonicalizers sample the canonicalized image with a GridSample node (opset 16 or later).
+
+Classes:
+    CanonicalizedModel
+
+Functions:
+    export_onnx(canonicalizer, prediction_network, example_input, path, invert_canonicalization, opset_version,
+        dynamic_batch) -> CanonicalizedModel
+"""
+
+import os
+from typing import Tuple, Union
+
+import torch
+
+from equiadapt.common.basecanonicalization import (
+    BaseCanonicalization,
+    DiscreteGroupCanonicalization,
+)
+
+
+class CanonicalizedModel(torch.nn.Module):
+    """
+    A prediction network that runs on canonicalized inputs, with a forward that only uses tensors.
+
+    Args:
+        canonicalizer (BaseCanonicalization): The canonicalizer, which must implement `canonicalize_inference`.
+        prediction_network (torch.nn.Module): The network that predicts from the canonicalized inputs.
+        invert_canonicalization (bool): Whether to map the predictions back to the frame of the inputs.
+            The predictions must be vectors along the last dimension, which are multiplied by the matrix
+            representation of the group element. Only supported for continuous groups. Defaults to False.
+
+    Methods:
+        forward: Canonicalizes the inputs, predicts and maybe inverts the canonicalization.
+    """
+
+    def __init__(
+        self,
+        canonicalizer: BaseCanonicalization,
+        prediction_network: torch.nn.Module,
+        invert_canonicalization: bool = False,
+    ):
+        super().__init__()
+        if invert_canonicalization and isinstance(
+            canonicalizer, DiscreteGroupCanonicalization
+        ):
+            raise ValueError(
+                "invert_canonicalization requires a canonicalizer that returns "
+                "the matrix representation of the group element"
+            )
+        self.canonicalizer = canonicalizer
+        self.prediction_network = prediction_network
+        self.invert_canonicalization = invert_canonicalization
+
+    def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Canonicalizes the inputs, predicts and maybe inverts the canonicalization.
+
+        Args:
+            x (torch.Tensor): The input data.
+
+        Returns:
+            torch.Tensor: The predictions.
+            torch.Tensor: The group element returned by `canonicalize_inference`.
+        """
+        x_canonicalized, group_element = self.canonicalizer.canonicalize_inference(x)
+        prediction = self.prediction_network(x_canonicalized)
+
+        if self.invert_canonicalization:
+            # the canonicalization maps a row vector v to v R^T, so its inverse is v R
+            batch_size, vector_dim = prediction.shape[0], prediction.shape[-1]
+            prediction = torch.matmul(
+                prediction.reshape(batch_size, -1, vector_dim), group_element
+            ).reshape(prediction.shape)
+
+        return prediction, group_element
+
+
+def export_onnx(
+    canonicalizer: BaseCanonicalization,
+    prediction_network: torch.nn.Module,
+    example_input: torch.Tensor,
+    path: Union[str, os.PathLike],
+    invert_canonicalization: bool = False,
+    opset_version: int = 17,
+    dynamic_batch: bool = True,
+) -> CanonicalizedModel:
+    """
+    Exports a canonicalizer and a prediction network as a single ONNX graph.
+
+    The graph has one input, "input", and two outputs, "output" (the predictions) and "group_element".
+    The modules are put in eval mode before tracing.
+
+    Args:
+        canonicalizer (BaseCanonicalization): The canonicalizer, which must implement `canonicalize_inference`.
+        prediction_network (torch.nn.Module): The network that predicts from the canonicalized inputs.
+        example_input (torch.Tensor): An input used to trace the model.
+        path (Union[str, os.PathLike]): The path of the ONNX file.
+        invert_canonicalization (bool, optional): Whether to map the predictions back to the frame of the inputs.
+            Defaults to False.
+        opset_version (int, optional): The ONNX opset, at least 16 for GridSample. Defaults to 17.
+        dynamic_batch (bool, optional): Whether the batch size of the graph is dynamic. Defaults to True.
+
+    Returns:
+        CanonicalizedModel: The exported module, to compare the outputs of the ONNX graph with.
+    """
+    model = CanonicalizedModel(
+        canonicalizer, prediction_network, invert_canonicalization
+    ).eval()
+    output_names = ["output", "group_element"]
+    dynamic_axes = (
+        {name: {0: "batch_size"} for name in ["input"] + output_names}
+        if dynamic_batch
+        else None
+    )
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (example_input,),
+            path,
+            input_names=["input"],
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+        )
+    return model
@@ -0,0 +1,221 @@
+"""
+This module contains the opt-in instrumentation of the stages of a canonicalization pipeline.
+
+`StageProfiler` times named stages with the host clock, marks them with `torch.profiler.record_function`
+ranges (so they show up in `torch.profiler` traces) and tracks the peak CUDA memory allocated during each stage.
+Nothing forces a host sync while the model runs: CUDA timings are recorded with events that are only resolved
+when the statistics are exported.
+
+`BaseCanonicalization.enable_instrumentation` wraps the stages of a canonicalizer (and, optionally, of the
+prediction network) with a `StageProfiler`. The time of a stage includes the stages it calls, its self time
+does not.
+
+Classes:
+    StageStats
+    StageProfiler
+"""
+
+import contextlib
+import csv
+import functools
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import torch
+
+
+class StageStats:
+    """
+    The counters of one stage.
+
+    Attributes:
+        count (int): The number of times the stage ran.
+        total_time (float): The total host time in seconds, including the nested stages.
+        self_time (float): The total host time in seconds, excluding the nested stages.
+        max_time (float): The longest host time of a single run, in seconds.
+        peak_memory (int): The peak CUDA memory allocated during the stage, in bytes.
+        cuda_events (List[Tuple[torch.cuda.Event, torch.cuda.Event]]): The start and end events not resolved yet.
+        cuda_time (float): The total CUDA time of the resolved events, in seconds.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.max_time = 0.0
+        self.peak_memory = 0
+        self.cuda_events: List[Tuple[Any, Any]] = []
+        self.cuda_time = 0.0
+
+
+class StageProfiler:
+    """
+    Accumulates the wall time, CUDA time and peak CUDA memory of named stages.
+
+    Args:
+        cuda_events (bool): Whether to also record the CUDA time of the stages with CUDA events. Defaults to False.
+        track_memory (bool): Whether to track the peak CUDA memory of the stages. It resets the peak memory
+            statistics of `torch.cuda`. Defaults to True.
+
+    Attributes:
+        stats (Dict[str, StageStats]): The counters of every stage, in the order the stages first ran.
+
+    Methods:
+        stage: Context manager that instruments a stage.
+        wrap: Instruments a method of an object until `unwrap` is called.
+        unwrap: Restores the methods instrumented with `wrap`.
+        reset: Clears the counters.
+        to_dict: Returns the statistics of every stage.
+        get_metrics: Returns the statistics of every stage as a flat dictionary, e.g. for `LightningModule.log_dict`.
+        to_csv: Writes the statistics of every stage to a CSV file.
+    """
+
+    def __init__(self, cuda_events: bool = False, track_memory: bool = True):
+        self.cuda_events = cuda_events
+        self.track_memory = track_memory
+        self.stats: Dict[str, StageStats] = {}
+        # host time spent in the nested stages, and peak memory, of every running stage
+        self._stack: List[List[Union[float, int]]] = []
+        self._wrapped: List[Tuple[Any, str]] = []
+
+    def _use_cuda(self) -> bool:
+        return torch.cuda.is_available() and torch.cuda.is_initialized()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Instruments a stage.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        stats = self.stats.setdefault(name, StageStats())
+        use_cuda = self._use_cuda()
+        track_memory = self.track_memory and use_cuda
+        if track_memory:
+            # fold the peak of the parent stage so far before measuring this one
+            if self._stack:
+                self._stack[-1][1] = max(
+                    self._stack[-1][1], torch.cuda.max_memory_allocated()
+                )
+            torch.cuda.reset_peak_memory_stats()
+        if self.cuda_events and use_cuda:
+            start_event = torch.cuda.Event(enable_timing=True)
+            start_event.record()
+
+        self._stack.append([0.0, 0])
+        start_time = time.perf_counter()
+        try:
+            with torch.profiler.record_function(f"equiadapt::{name}"):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            child_time, peak_memory = self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += elapsed
+
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.self_time += elapsed - child_time
+            stats.max_time = max(stats.max_time, elapsed)
+            if self.cuda_events and use_cuda:
+                end_event = torch.cuda.Event(enable_timing=True)
+                end_event.record()
+                stats.cuda_events.append((start_event, end_event))
+            if track_memory:
+                peak_memory = max(peak_memory, torch.cuda.max_memory_allocated())
+                stats.peak_memory = max(stats.peak_memory, int(peak_memory))
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak_memory)
+
+    def wrap(self, obj: Any, method_name: str, name: Optional[str] = None) -> None:
+        """
+        Instruments a method of an object, by shadowing it with an instance attribute, until `unwrap` is called.
+
+        Args:
+            obj (Any): The object, e.g. a canonicalizer or a `torch.nn.Module` (for its `forward`).
+            method_name (str): The name of the method.
+            name (Optional[str]): The name of the stage. Defaults to the name of the method.
+        """
+        method: Callable = getattr(obj, method_name)
+
+        @functools.wraps(method)
+        def instrumented(*args: Any, **kwargs: Any) -> Any:
+            with self.stage(name or method_name):
+                return method(*args, **kwargs)
+
+        setattr(obj, method_name, instrumented)
+        self._wrapped.append((obj, method_name))
+
+    def unwrap(self) -> None:
+        """Restores the methods instrumented with `wrap`."""
+        for obj, method_name in reversed(self._wrapped):
+            delattr(obj, method_name)
+        self._wrapped = []
+
+    def reset(self) -> None:
+        """Clears the counters."""
+        self.stats = {}
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the statistics of every stage. Pending CUDA events are resolved, which synchronizes once.
+
+        Returns:
+            Dict[str, Dict[str, float]]: For every stage, its count, total, self, mean and max host time in
+            milliseconds, its CUDA time in milliseconds (if CUDA events are recorded) and its peak memory
+            in megabytes (if it is tracked).
+        """
+        if any(stats.cuda_events for stats in self.stats.values()):
+            torch.cuda.synchronize()
+
+        stage_dict = {}
+        for name, stats in self.stats.items():
+            for start_event, end_event in stats.cuda_events:
+                stats.cuda_time += start_event.elapsed_time(end_event) / 1000
+            stats.cuda_events = []
+
+            stage_dict[name] = {
+                "count": stats.count,
+                "total_ms": stats.total_time * 1000,
+                "self_ms": stats.self_time * 1000,
+                "mean_ms": stats.total_time * 1000 / max(stats.count, 1),
+                "max_ms": stats.max_time * 1000,
+            }
+            if self.cuda_events:
+                stage_dict[name]["cuda_total_ms"] = stats.cuda_time * 1000
+            if self.track_memory:
+                stage_dict[name]["peak_memory_mb"] = stats.peak_memory / 2**20
+        return stage_dict
+
+    def get_metrics(self, prefix: str = "instrumentation") -> Dict[str, float]:
+        """
+        Returns the statistics of every stage as a flat dictionary, e.g. for `LightningModule.log_dict`.
+
+        Args:
+            prefix (str): The prefix of the keys. Defaults to "instrumentation".
+
+        Returns:
+            Dict[str, float]: The statistics, with keys "<prefix>/<stage>/<statistic>".
+        """
+        return {
+            f"{prefix}/{stage}/{key}": float(value)
+            for stage, stage_stats in self.to_dict().items()
+            for key, value in stage_stats.items()
+        }
+
+    def to_csv(self, path: Union[str, os.PathLike]) -> None:
+        """
+        Writes the statistics of every stage to a CSV file, one row per stage.
+
+        Args:
+            path (Union[str, os.PathLike]): The path of the CSV file.
+        """
+        stage_dict = self.to_dict()
+        columns = ["stage"] + list(next(iter(stage_dict.values()), {}))
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=columns)
+            writer.writeheader()
+            for name, stage_stats in stage_dict.items():
+                writer.writerow({"stage": name, **stage_stats})
@@ -0,0 +1,60 @@
+"""
+This module contains the helper used by the equiadapt packages to load their public names lazily (PEP 562).
+
+Importing a package only runs this module. The submodule defining a name, and the heavy dependencies it needs
+(e2cnn, kornia, torchvision, ...), are imported the first time the name is accessed.
+
+Functions:
+    attach(package_name: str, submodules: List[str], attributes: Dict[str, str]) -> Tuple[Callable, Callable]
+"""
+
+import importlib
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def attach(
+    package_name: str, submodules: List[str], attributes: Dict[str, str]
+) -> Tuple[Callable[[str], Any], Callable[[], List[str]]]:
+    """
+    Builds the module level `__getattr__` and `__dir__` functions of a lazily loaded package.
+
+    Args:
+        package_name (str): The name of the package, usually `__name__`.
+        submodules (List[str]): The submodules of the package, imported when they are accessed.
+        attributes (Dict[str, str]): For every public name, the module it is loaded from.
+
+    Returns:
+        Tuple[Callable[[str], Any], Callable[[], List[str]]]: The `__getattr__` and `__dir__` functions.
+
+    Examples:
+        >>> __getattr__, __dir__ = attach(__name__, ["utils"], {"gram_schmidt": "equiadapt.common.utils"})
+    """
+    public_names = sorted(set(submodules) | set(attributes))
+
+    def __getattr__(name: str) -> Any:
+        if name in submodules:
+            value = importlib.import_module(f"{package_name}.{name}")
+        elif name in attributes:
+            value = getattr(importlib.import_module(attributes[name]), name)
+        elif not name.startswith("__"):
+            # submodules that are not public are still importable as attributes
+            try:
+                value = importlib.import_module(f"{package_name}.{name}")
+            except ModuleNotFoundError as error:
+                if error.name != f"{package_name}.{name}":
+                    raise
+                raise AttributeError(
+                    f"module {package_name!r} has no attribute {name!r}"
+                ) from None
+        else:
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+
+        # later accesses find the name directly, without going through __getattr__
+        setattr(sys.modules[package_name], name, value)
+        return value
+
+    def __dir__() -> List[str]:
+        return public_names
+
+    return __getattr__, __dir__
@@ -0,0 +1,268 @@
+"""
+This module contains an asyncio server that batches single inference requests on the fly.
+
+Requests usually arrive one input at a time, and running the canonicalization and the prediction network at batch
+size 1 leaves most of the hardware idle. `DynamicBatchingServer` queues the requests, forms batches of up to
+`max_batch_size` inputs (waiting at most `max_wait_ms` for a batch to fill), runs the model once per batch in a
+worker thread and returns to every caller its own slice of the outputs. The model is typically a
+`CanonicalizedModel`, which runs the canonicalization, the prediction and the optional inversion in one pass.
+
+Classes:
+    ServingMetrics
+    DynamicBatchingServer
+"""
+
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+import torch
+
+Outputs = Union[torch.Tensor, Tuple[torch.Tensor, ...]]
+
+
+class ServingMetrics:
+    """
+    Collects the metrics of a `DynamicBatchingServer`.
+
+    Args:
+        latency_window (int): The number of most recent request latencies kept for the percentiles. Defaults to 10000.
+
+    Attributes:
+        batch_size_histogram (Counter): The number of batches run for every batch size.
+        latencies (Deque[float]): The most recent latencies in seconds, from submission to result.
+        num_requests (int): The number of requests served.
+
+    Methods:
+        record_batch: Records a batch and the latencies of its requests.
+        get_latency_percentile: Returns a percentile of the recent latencies.
+        get_summary: Returns all the metrics in a dictionary.
+    """
+
+    def __init__(self, latency_window: int = 10000):
+        self.batch_size_histogram: Counter = Counter()
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        self.num_requests = 0
+
+    def record_batch(self, latencies: List[float]) -> None:
+        """
+        Records a batch and the latencies of its requests.
+
+        Args:
+            latencies (List[float]): The latency in seconds of every request of the batch.
+        """
+        self.batch_size_histogram[len(latencies)] += 1
+        self.latencies.extend(latencies)
+        self.num_requests += len(latencies)
+
+    def get_latency_percentile(self, percentile: float) -> Optional[float]:
+        """
+        Returns a percentile of the recent latencies (nearest rank).
+
+        Args:
+            percentile (float): The percentile, between 0 and 100.
+
+        Returns:
+            Optional[float]: The latency in seconds, or None if no request was served yet.
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        rank = max(math.ceil(percentile / 100 * len(latencies)), 1)
+        return latencies[rank - 1]
+
+    def get_summary(self, queue_depth: int = 0) -> Dict[str, Any]:
+        """
+        Returns all the metrics in a dictionary.
+
+        Args:
+            queue_depth (int): The number of requests waiting for a batch. Defaults to 0.
+
+        Returns:
+            Dict[str, Any]: The queue depth, the number of requests and batches, the batch size histogram
+            and the p50 and p99 latencies in seconds.
+        """
+        return {
+            "queue_depth": queue_depth,
+            "num_requests": self.num_requests,
+            "num_batches": sum(self.batch_size_histogram.values()),
+            "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            "latency_p50": self.get_latency_percentile(50),
+            "latency_p99": self.get_latency_percentile(99),
+        }
+
+
+class DynamicBatchingServer:
+    """
+    An asyncio server that batches single inference requests on the fly.
+
+    Every request is one input without the batch dimension. The inputs of a batch are stacked, the model is run
+    once under `torch.no_grad` in a worker thread (so the event loop keeps accepting requests) and every output
+    of the model is split back along the batch dimension.
+
+    Args:
+        model (torch.nn.Module): The model, e.g. a `CanonicalizedModel`. It returns a tensor or a tuple of tensors
+            whose first dimension is the batch.
+        max_batch_size (int): The maximum number of inputs per batch. Defaults to 32.
+        max_wait_ms (float): How long the first request of a batch waits for more requests. Defaults to 5 ms.
+        latency_window (int): The number of most recent latencies kept for the percentiles. Defaults to 10000.
+
+    Attributes:
+        metrics (ServingMetrics): The metrics of the server.
+
+    Methods:
+        start: Starts the batching loop.
+        stop: Serves the queued requests and stops the batching loop.
+        infer: Submits one input and waits for its outputs.
+        get_metrics: Returns the queue depth, batch size histogram and latency percentiles.
+
+    Examples:
+        >>> async with DynamicBatchingServer(CanonicalizedModel(canonicalizer, prediction_network)) as server:
+        ...     prediction, group_element = await server.infer(image)
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        latency_window: int = 10000,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model.eval()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = ServingMetrics(latency_window)
+        self._queue: Optional[asyncio.Queue] = None
+        self._batching_task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def __aenter__(self) -> "DynamicBatchingServer":
+        """Starts the server when entering an `async with` block."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Stops the server when leaving an `async with` block."""
+        await self.stop()
+
+    async def start(self) -> None:
+        """Starts the batching loop on the running event loop."""
+        if self._batching_task is not None:
+            raise RuntimeError("the server is already running")
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batching_task = asyncio.get_running_loop().create_task(
+            self._batching_loop()
+        )
+
+    async def stop(self) -> None:
+        """Serves the requests that are already queued and stops the batching loop."""
+        if self._batching_task is None:
+            return
+        assert self._queue is not None and self._executor is not None
+        # the batching loop stops when it reaches this sentinel
+        await self._queue.put(None)
+        await self._batching_task
+        self._executor.shutdown()
+        self._queue, self._batching_task, self._executor = None, None, None
+
+    async def infer(self, x: torch.Tensor) -> Outputs:
+        """
+        Submits one input and waits for its outputs.
+
+        Args:
+            x (torch.Tensor): The input, without the batch dimension.
+
+        Returns:
+            Union[torch.Tensor, Tuple[torch.Tensor, ...]]: The outputs of the model for this input,
+            without the batch dimension.
+        """
+        if self._queue is None:
+            raise RuntimeError("the server is not running, call start() first")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, future, time.perf_counter()))
+        return await future
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Returns the queue depth, batch size histogram and latency percentiles of the server.
+
+        Returns:
+            Dict[str, Any]: The metrics, see `ServingMetrics.get_summary`.
+        """
+        return self.metrics.get_summary(
+            queue_depth=self._queue.qsize() if self._queue is not None else 0
+        )
+
+    async def _batching_loop(self) -> None:
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        # before Python 3.11, cancelling a queue.get() that times out can lose the request it has
+        # just dequeued, so a single pending get is kept across the waits and the batches
+        pending_get: Optional[asyncio.Task] = None
+        try:
+            stopping = False
+            while not stopping:
+                if pending_get is None:
+                    pending_get = loop.create_task(self._queue.get())
+                request = await pending_get
+                pending_get = None
+                if request is None:
+                    break
+                batch = [request]
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    if pending_get is None and not self._queue.empty():
+                        request = self._queue.get_nowait()
+                    else:
+                        if pending_get is None:
+                            pending_get = loop.create_task(self._queue.get())
+                        done, _ = await asyncio.wait(
+                            {pending_get}, timeout=deadline - loop.time()
+                        )
+                        if not done:
+                            break
+                        request = pending_get.result()
+                        pending_get = None
+                    if request is None:
+                        stopping = True
+                        break
+                    batch.append(request)
+                await self._run_batch(batch)
+        finally:
+            if pending_get is not None:
+                pending_get.cancel()
+
+    async def _run_batch(
+        self, batch: List[Tuple[torch.Tensor, asyncio.Future, float]]
+    ) -> None:
+        inputs = [x for x, _, _ in batch]
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._forward, inputs
+            )
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        end_time = time.perf_counter()
+        for i, (_, future, start_time) in enumerate(batch):
+            if not future.done():
+                future.set_result(
+                    tuple(output[i] for output in outputs)
+                    if isinstance(outputs, tuple)
+                    else outputs[i]
+                )
+        self.metrics.record_batch([end_time - start_time for _, _, start_time in batch])
+
+    def _forward(self, inputs: List[torch.Tensor]) -> Outputs:
+        # grad mode is thread local, so it is disabled in the worker thread
+        with torch.no_grad():
+            return self.model(torch.stack(inputs))
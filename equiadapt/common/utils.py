@@ -3,7 +3,7 @@ import torch
 """
 This module contains utility functions and classes that are used for operations on Lie groups.
 
-The module includes a function for the Gram-Schmidt process, which is used to orthogonalize a set of vectors. This function is implemented in a batch-wise manner, meaning it can process multiple sets of vectors at once.
+The module includes functions for the Gram-Schmidt process and other orthonormalizations, which are used to orthogonalize a set of vectors. These functions are implemented in a batch-wise manner, meaning they can process multiple sets of vectors at once.
 
 The module also includes a class for parameterizing Lie groups and their representations.
 This class supports several types of Lie groups, including the special orthogonal group (SO(n)),
@@ -12,20 +12,96 @@ The class provides methods for generating the basis of the Lie group, as well as
 group representation given a set of parameters.
 
 Functions:
+    orthonormalize(vectors: torch.Tensor, method: str, eps: float, special: bool) -> torch.Tensor
     gram_schmidt(vectors: torch.Tensor) -> torch.Tensor
+    is_compiling() -> bool
 
 Classes:
     LieParameterization
 """
 
 
+# "gram_schmidt" runs the modified Gram-Schmidt process, "qr" takes the Q factor of a
+# Householder QR decomposition with the same signs as Gram-Schmidt, and "svd" returns the
+# closest orthonormal frame (orthogonal Procrustes), which treats all the vectors alike
+ORTHONORMALIZATION_METHODS = ("gram_schmidt", "qr", "svd")
+
+
+def orthonormalize(
+    vectors: torch.Tensor,
+    method: str = "gram_schmidt",
+    eps: float = 1e-8,
+    special: bool = False,
+) -> torch.Tensor:
+    """
+    Orthonormalizes a batch of sets of k vectors of dimension n, with k <= n.
+
+    Args:
+        vectors (torch.Tensor): A batch of vectors of shape (..., n_vectors, vector_dim).
+        method (str, optional): One of "gram_schmidt", "qr" or "svd". Defaults to "gram_schmidt".
+        eps (float, optional): Lower bound of the norms divided by, which guards against degenerate vectors.
+            Defaults to 1e-8.
+        special (bool, optional): Whether to flip the last vector of frames with a negative determinant,
+            so that square outputs are in SO(n) instead of O(n). Defaults to False.
+
+    Returns:
+        torch.Tensor: The orthonormal vectors of the same shape as the input.
+
+    Raises:
+        ValueError: If the method is not supported or there are more vectors than dimensions.
+    """
+    if method not in ORTHONORMALIZATION_METHODS:
+        raise ValueError(
+            f"orthonormalization method must be one of {ORTHONORMALIZATION_METHODS}"
+        )
+    n_vectors, vector_dim = vectors.shape[-2:]
+    if n_vectors > vector_dim:
+        raise ValueError(
+            f"cannot orthonormalize {n_vectors} vectors of dimension {vector_dim}"
+        )
+
+    if method == "gram_schmidt":
+        # every step removes the projection on the new basis vector from all the
+        # remaining vectors at once
+        basis = []
+        remaining = vectors
+        for _ in range(n_vectors):
+            vector = remaining[..., 0, :]
+            vector = vector / torch.norm(vector, dim=-1, keepdim=True).clamp_min(eps)
+            basis.append(vector)
+            remaining = remaining[..., 1:, :]
+            remaining = remaining - torch.sum(
+                remaining * vector.unsqueeze(-2), dim=-1, keepdim=True
+            ) * vector.unsqueeze(-2)
+        orthonormal_vectors = torch.stack(basis, dim=-2)
+    elif method == "qr":
+        Q, R = torch.linalg.qr(vectors.transpose(-2, -1))
+        # Householder QR only determines the vectors up to sign, match Gram-Schmidt
+        signs = 1 - 2 * (torch.diagonal(R, dim1=-2, dim2=-1) < 0).to(Q)
+        orthonormal_vectors = Q.transpose(-2, -1) * signs.unsqueeze(-1)
+    else:
+        U, _, Vh = torch.linalg.svd(vectors, full_matrices=False)
+        orthonormal_vectors = torch.matmul(U, Vh)
+
+    if special and n_vectors == vector_dim:
+        determinant = torch.linalg.det(orthonormal_vectors)
+        flip = torch.ones_like(orthonormal_vectors[..., :, :1])
+        flip[..., -1, :] = 1 - 2 * (determinant < 0).to(flip).unsqueeze(-1)
+        if method == "svd":
+            # the closest rotation flips the direction of the smallest singular value
+            orthonormal_vectors = torch.matmul(U * flip.transpose(-2, -1), Vh)
+        else:
+            orthonormal_vectors = orthonormal_vectors * flip
+    return orthonormal_vectors
+
+
 def gram_schmidt(vectors: torch.Tensor) -> torch.Tensor:
     """
-    Applies the Gram-Schmidt process to orthogonalize a set of three vectors in a batch-wise manner.
+    Applies the modified Gram-Schmidt process to orthogonalize a set of vectors in a batch-wise manner.
 
     Args:
         vectors (torch.Tensor): A batch of vectors of shape (batch_size, n_vectors, vector_dim),
-                                where n_vectors is the number of vectors to orthogonalize (here 3).
+                                where n_vectors is the number of vectors to orthogonalize (at most vector_dim).
 
     Returns:
         torch.Tensor: The orthogonalized vectors of the same shape as the input.
@@ -38,23 +114,35 @@ def gram_schmidt(vectors: torch.Tensor) -> torch.Tensor:
                  [0.0000, 1.0000, 0.0000],
                  [0.0000, 0.0000, 1.0000]]])
     """
-    v1 = vectors[:, 0]
-    v1 = v1 / torch.norm(v1, dim=1, keepdim=True)
-    v2 = vectors[:, 1] - torch.sum(vectors[:, 1] * v1, dim=1, keepdim=True) * v1
-    v2 = v2 / torch.norm(v2, dim=1, keepdim=True)
-    v3 = (
-        vectors[:, 2]
-        - torch.sum(vectors[:, 2] * v1, dim=1, keepdim=True) * v1
-        - torch.sum(vectors[:, 2] * v2, dim=1, keepdim=True) * v2
-    )
-    v3 = v3 / torch.norm(v3, dim=1, keepdim=True)
-    return torch.stack([v1, v2, v3], dim=1)
+    return orthonormalize(vectors, method="gram_schmidt")
+
+
+def is_compiling() -> bool:
+    """
+    Checks whether the code is being compiled with torch.compile, scripted or traced.
+
+    Data-dependent shortcuts (e.g. returning early when a batch needs no transformation) and out= arguments
+    break the graph, so the functions of equiadapt skip them in that case.
+
+    Returns:
+        bool: Whether the code is being compiled, scripted or traced.
+    """
+    if torch.jit.is_scripting() or torch.jit.is_tracing():
+        return True
+    # torch.compiler only exists from torch 2.1
+    compiler = getattr(torch, "compiler", None)
+    is_dynamo_compiling = getattr(compiler, "is_compiling", None)
+    return is_dynamo_compiling is not None and bool(is_dynamo_compiling())
 
 
 class LieParameterization(torch.nn.Module):
     """
     A class for parameterizing Lie groups and their representations for a single block.
 
+    The so(n) generators are built once and registered as a buffer. The exponential map uses
+    closed forms for SO(2) (rotation by an angle) and SO(3) (Rodrigues' formula) and falls back
+    to `torch.matrix_exp` for larger n.
+
     Args:
         group_type (str): The type of Lie group (e.g., 'SOn', 'SEn', 'On', 'En').
         group_dim (int): The dimension of the Lie group.
@@ -62,32 +150,84 @@ class LieParameterization(torch.nn.Module):
     Attributes:
         group_type (str): Type of Lie group.
         group_dim (int): Dimension of the Lie group.
+        son_bases (torch.Tensor): The so(n) generators of shape (num_params, group_dim, group_dim).
+        reflection_mask (torch.Tensor): One-hot mask of the axis flipped by a reflection, of shape (group_dim,).
     """
 
+    son_bases: torch.Tensor
+    reflection_mask: torch.Tensor
+
     def __init__(self, group_type: str, group_dim: int):
         super().__init__()
         self.group_type = group_type
         self.group_dim = group_dim
 
+        num_son_bases = self.group_dim * (self.group_dim - 1) // 2
+        rows, cols = torch.triu_indices(self.group_dim, self.group_dim, offset=1)
+        son_bases = torch.zeros((num_son_bases, self.group_dim, self.group_dim))
+        son_bases[torch.arange(num_son_bases), rows, cols] = 1
+        son_bases[torch.arange(num_son_bases), cols, rows] = -1
+        self.register_buffer("son_bases", son_bases, persistent=False)
+
+        reflection_mask = torch.zeros(self.group_dim)
+        reflection_mask[-1] = 1
+        self.register_buffer("reflection_mask", reflection_mask, persistent=False)
+
     def get_son_bases(self) -> torch.Tensor:
         """
-        Generates the basis of the Lie group of SOn.
+        Returns the basis of the Lie algebra of SOn.
 
         Returns:
             torch.Tensor: The son basis of shape (num_params, group_dim, group_dim).
         """
-        num_son_bases = self.group_dim * (self.group_dim - 1) // 2
-        son_bases = torch.zeros((num_son_bases, self.group_dim, self.group_dim))
-        for counter, (i, j) in enumerate(
-            [
-                (i, j)
-                for i in range(self.group_dim)
-                for j in range(i + 1, self.group_dim)
-            ]
-        ):
-            son_bases[counter, i, j] = 1
-            son_bases[counter, j, i] = -1
-        return son_bases
+        return self.son_bases
+
+    def get_so2_rep(self, params: torch.Tensor) -> torch.Tensor:
+        """
+        Computes the exponential map of so(2) in closed form.
+
+        Args:
+            params (torch.Tensor): Input parameters of shape (..., 1).
+
+        Returns:
+            torch.Tensor: The rotation matrices of shape (..., 2, 2).
+        """
+        cos, sin = torch.cos(params[..., 0]), torch.sin(params[..., 0])
+        return torch.stack(
+            [torch.stack([cos, sin], dim=-1), torch.stack([-sin, cos], dim=-1)],
+            dim=-2,
+        )
+
+    def get_so3_rep(self, params: torch.Tensor) -> torch.Tensor:
+        """
+        Computes the exponential map of so(3) in closed form with Rodrigues' formula.
+
+        Args:
+            params (torch.Tensor): Input parameters of shape (..., 3).
+
+        Returns:
+            torch.Tensor: The rotation matrices of shape (..., 3, 3).
+        """
+        A = torch.einsum("...s,sij->...ij", params, self.son_bases.to(params))
+        theta_squared = params.pow(2).sum(dim=-1)[..., None, None]
+
+        # the Taylor expansions avoid dividing by zero for small angles
+        is_small = theta_squared < 1e-6
+        theta_squared_safe = torch.where(
+            is_small, torch.ones_like(theta_squared), theta_squared
+        )
+        theta = torch.sqrt(theta_squared_safe)
+        sin_coefficient = torch.where(
+            is_small, 1 - theta_squared / 6, torch.sin(theta) / theta
+        )
+        cos_coefficient = torch.where(
+            is_small,
+            0.5 - theta_squared / 24,
+            (1 - torch.cos(theta)) / theta_squared_safe,
+        )
+
+        identity = torch.eye(3, dtype=params.dtype, device=params.device)
+        return identity + sin_coefficient * A + cos_coefficient * torch.matmul(A, A)
 
     def get_son_rep(self, params: torch.Tensor) -> torch.Tensor:
         """
@@ -99,10 +239,33 @@ class LieParameterization(torch.nn.Module):
         Returns:
             torch.Tensor: The representation of shape (batch_size, rep_dim, rep_dim).
         """
-        son_bases = self.get_son_bases().to(params.device)
-        A = torch.einsum("bs,sij->bij", params, son_bases)
+        if self.group_dim == 2:
+            return self.get_so2_rep(params)
+        if self.group_dim == 3:
+            return self.get_so3_rep(params)
+        A = torch.einsum("...s,sij->...ij", params, self.son_bases.to(params))
         return torch.matrix_exp(A)
 
+    def get_homogeneous_rep(
+        self, linear_rep: torch.Tensor, translation: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Builds the homogeneous matrices of affine maps.
+
+        Args:
+            linear_rep (torch.Tensor): The linear part of shape (batch_size, group_dim, group_dim).
+            translation (torch.Tensor): The translation of shape (batch_size, group_dim).
+
+        Returns:
+            torch.Tensor: The representation of shape (batch_size, group_dim + 1, group_dim + 1).
+        """
+        last_row = torch.zeros_like(linear_rep[:, :1])
+        last_row = torch.cat([last_row, torch.ones_like(last_row[..., :1])], dim=-1)
+        return torch.cat(
+            [torch.cat([linear_rep, translation.unsqueeze(-1)], dim=-1), last_row],
+            dim=-2,
+        )
+
     def get_on_rep(
         self, params: torch.Tensor, reflect_indicators: torch.Tensor
     ) -> torch.Tensor:
@@ -121,16 +284,10 @@ class LieParameterization(torch.nn.Module):
         # This is a simplified and conceptual approach; actual reflection handling
         # would need to determine how to reflect (e.g., across which axis or plane)
         # and this might not directly apply as-is.
-        identity_matrix = torch.eye(self.group_dim)
-        reflection_matrix = torch.diag_embed(
-            torch.tensor([1] * (self.group_dim - 1) + [-1])
-        )
-        on_rep = torch.matmul(
-            son_rep,
-            reflect_indicators * reflection_matrix
-            + (1 - reflect_indicators) * identity_matrix,
-        )
-        return on_rep
+        # Multiplying by the diagonal reflection matrix flips the sign of the last column
+        reflect_indicators = reflect_indicators.view(-1, 1, 1).to(son_rep)
+        reflection_signs = 1 - 2 * reflect_indicators * self.reflection_mask.to(son_rep)
+        return son_rep * reflection_signs
 
     def get_sen_rep(self, params: torch.Tensor) -> torch.Tensor:
         """
@@ -143,18 +300,10 @@ class LieParameterization(torch.nn.Module):
             torch.Tensor: The representation of shape (batch_size, rep_dim, rep_dim).
         """
         son_param_dim = self.group_dim * (self.group_dim - 1) // 2
-        rho = torch.zeros(
-            params.shape[0],
-            self.group_dim + 1,
-            self.group_dim + 1,
-            device=params.device,
+        return self.get_homogeneous_rep(
+            self.get_son_rep(params[:, :son_param_dim]),
+            params[:, son_param_dim : son_param_dim + self.group_dim],
         )
-        rho[:, : self.group_dim, : self.group_dim] = self.get_son_rep(
-            params[:, :son_param_dim].unsqueeze(0)
-        ).squeeze(0)
-        rho[:, : self.group_dim, self.group_dim] = params[:, son_param_dim:]
-        rho[:, self.group_dim, self.group_dim] = 1
-        return rho
 
     def get_en_rep(
         self, params: torch.Tensor, reflect_indicators: torch.Tensor
@@ -183,17 +332,7 @@ class LieParameterization(torch.nn.Module):
         rotoreflection_rep = self.get_on_rep(rotation_params, reflect_indicators)
 
         # Construct the E(n) representation matrix
-        en_rep = torch.zeros(
-            params.shape[0],
-            self.group_dim + 1,
-            self.group_dim + 1,
-            device=params.device,
-        )
-        en_rep[:, : self.group_dim, : self.group_dim] = rotoreflection_rep
-        en_rep[:, : self.group_dim, self.group_dim] = translation_params
-        en_rep[:, self.group_dim, self.group_dim] = 1
-
-        return en_rep
+        return self.get_homogeneous_rep(rotoreflection_rep, translation_params)
 
     def get_group_rep(self, params: torch.Tensor) -> torch.Tensor:
         """
@@ -211,12 +350,8 @@ class LieParameterization(torch.nn.Module):
             return self.get_sen_rep(params)
         elif self.group_type == "On":
             # TODO: currently assuming no reflections
-            return self.get_on_rep(
-                params, torch.zeros(params.shape[0], 1, device=params.device)
-            )
+            return self.get_on_rep(params, params.new_zeros(params.shape[0], 1))
         elif self.group_type == "En":
-            return self.get_en_rep(
-                params, torch.zeros(params.shape[0], 1, device=params.device)
-            )
+            return self.get_en_rep(params, params.new_zeros(params.shape[0], 1))
         else:
             raise ValueError(f"Unsupported group type: {self.group_type}")
@@ -1,41 +1,47 @@
-from equiadapt.images import canonicalization, canonicalization_networks, utils
-from equiadapt.images.canonicalization import (
-    ContinuousGroupImageCanonicalization,
-    DiscreteGroupImageCanonicalization,
-    GroupEquivariantImageCanonicalization,
-    OptimizedGroupEquivariantImageCanonicalization,
-    OptimizedSteerableImageCanonicalization,
-    SteerableImageCanonicalization,
-    continuous_group,
-    discrete_group,
-)
-from equiadapt.images.canonicalization_networks import (
-    ConvNetwork,
-    CustomEquivariantNetwork,
-    ESCNNEquivariantNetwork,
-    ESCNNSteerableNetwork,
-    ESCNNWideBasic,
-    ESCNNWideBottleneck,
-    ESCNNWRNEquivariantNetwork,
-    ResNet18Network,
-    RotationEquivariantConv,
-    RotationEquivariantConvLift,
-    RotoReflectionEquivariantConv,
-    RotoReflectionEquivariantConvLift,
-    custom_equivariant_networks,
-    custom_group_equivariant_layers,
-    custom_nonequivariant_networks,
-    escnn_networks,
-)
-from equiadapt.images.utils import (
-    flip_boxes,
-    flip_masks,
-    get_action_on_image_features,
-    roll_by_gather,
-    rotate_boxes,
-    rotate_masks,
-    rotate_points,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.images import canonicalization, canonicalization_networks, utils
+    from equiadapt.images.canonicalization import (
+        ContinuousGroupImageCanonicalization,
+        DiscreteGroupImageCanonicalization,
+        GroupEquivariantImageCanonicalization,
+        OptimizedGroupEquivariantImageCanonicalization,
+        OptimizedSteerableImageCanonicalization,
+        SteerableImageCanonicalization,
+        continuous_group,
+        discrete_group,
+    )
+    from equiadapt.images.canonicalization_networks import (
+        ConvNetwork,
+        CustomEquivariantNetwork,
+        ESCNNEquivariantNetwork,
+        ESCNNSteerableNetwork,
+        ESCNNWideBasic,
+        ESCNNWideBottleneck,
+        ESCNNWRNEquivariantNetwork,
+        ResNet18Network,
+        RotationEquivariantConv,
+        RotationEquivariantConvLift,
+        RotoReflectionEquivariantConv,
+        RotoReflectionEquivariantConvLift,
+        custom_equivariant_networks,
+        custom_group_equivariant_layers,
+        custom_nonequivariant_networks,
+        escnn_networks,
+    )
+    from equiadapt.images.utils import (
+        flip_boxes,
+        flip_masks,
+        get_action_on_image_features,
+        roll_by_gather,
+        rotate_boxes,
+        rotate_masks,
+        rotate_points,
+        transform_targets,
+    )
 
 __all__ = [
     "ContinuousGroupImageCanonicalization",
@@ -71,5 +77,45 @@ __all__ = [
     "rotate_boxes",
     "rotate_masks",
     "rotate_points",
+    "transform_targets",
     "utils",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=["canonicalization", "canonicalization_networks", "utils"],
+    attributes={
+        "ContinuousGroupImageCanonicalization": "equiadapt.images.canonicalization",
+        "DiscreteGroupImageCanonicalization": "equiadapt.images.canonicalization",
+        "GroupEquivariantImageCanonicalization": "equiadapt.images.canonicalization",
+        "OptimizedGroupEquivariantImageCanonicalization": "equiadapt.images.canonicalization",
+        "OptimizedSteerableImageCanonicalization": "equiadapt.images.canonicalization",
+        "SteerableImageCanonicalization": "equiadapt.images.canonicalization",
+        "continuous_group": "equiadapt.images.canonicalization",
+        "discrete_group": "equiadapt.images.canonicalization",
+        "ConvNetwork": "equiadapt.images.canonicalization_networks",
+        "CustomEquivariantNetwork": "equiadapt.images.canonicalization_networks",
+        "ESCNNEquivariantNetwork": "equiadapt.images.canonicalization_networks",
+        "ESCNNSteerableNetwork": "equiadapt.images.canonicalization_networks",
+        "ESCNNWideBasic": "equiadapt.images.canonicalization_networks",
+        "ESCNNWideBottleneck": "equiadapt.images.canonicalization_networks",
+        "ESCNNWRNEquivariantNetwork": "equiadapt.images.canonicalization_networks",
+        "ResNet18Network": "equiadapt.images.canonicalization_networks",
+        "RotationEquivariantConv": "equiadapt.images.canonicalization_networks",
+        "RotationEquivariantConvLift": "equiadapt.images.canonicalization_networks",
+        "RotoReflectionEquivariantConv": "equiadapt.images.canonicalization_networks",
+        "RotoReflectionEquivariantConvLift": "equiadapt.images.canonicalization_networks",
+        "custom_equivariant_networks": "equiadapt.images.canonicalization_networks",
+        "custom_group_equivariant_layers": "equiadapt.images.canonicalization_networks",
+        "custom_nonequivariant_networks": "equiadapt.images.canonicalization_networks",
+        "escnn_networks": "equiadapt.images.canonicalization_networks",
+        "flip_boxes": "equiadapt.images.utils",
+        "flip_masks": "equiadapt.images.utils",
+        "get_action_on_image_features": "equiadapt.images.utils",
+        "roll_by_gather": "equiadapt.images.utils",
+        "rotate_boxes": "equiadapt.images.utils",
+        "rotate_masks": "equiadapt.images.utils",
+        "rotate_points": "equiadapt.images.utils",
+        "transform_targets": "equiadapt.images.utils",
+    },
+)
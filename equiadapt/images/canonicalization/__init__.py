@@ -1,14 +1,19 @@
-from equiadapt.images.canonicalization import continuous_group, discrete_group
-from equiadapt.images.canonicalization.continuous_group import (
-    ContinuousGroupImageCanonicalization,
-    OptimizedSteerableImageCanonicalization,
-    SteerableImageCanonicalization,
-)
-from equiadapt.images.canonicalization.discrete_group import (
-    DiscreteGroupImageCanonicalization,
-    GroupEquivariantImageCanonicalization,
-    OptimizedGroupEquivariantImageCanonicalization,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.images.canonicalization import continuous_group, discrete_group
+    from equiadapt.images.canonicalization.continuous_group import (
+        ContinuousGroupImageCanonicalization,
+        OptimizedSteerableImageCanonicalization,
+        SteerableImageCanonicalization,
+    )
+    from equiadapt.images.canonicalization.discrete_group import (
+        DiscreteGroupImageCanonicalization,
+        GroupEquivariantImageCanonicalization,
+        OptimizedGroupEquivariantImageCanonicalization,
+    )
 
 __all__ = [
     "ContinuousGroupImageCanonicalization",
@@ -20,3 +25,16 @@ __all__ = [
     "continuous_group",
     "discrete_group",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=["continuous_group", "discrete_group"],
+    attributes={
+        "ContinuousGroupImageCanonicalization": "equiadapt.images.canonicalization.continuous_group",
+        "OptimizedSteerableImageCanonicalization": "equiadapt.images.canonicalization.continuous_group",
+        "SteerableImageCanonicalization": "equiadapt.images.canonicalization.continuous_group",
+        "DiscreteGroupImageCanonicalization": "equiadapt.images.canonicalization.discrete_group",
+        "GroupEquivariantImageCanonicalization": "equiadapt.images.canonicalization.discrete_group",
+        "OptimizedGroupEquivariantImageCanonicalization": "equiadapt.images.canonicalization.discrete_group",
+    },
+)
@@ -1,15 +1,17 @@
 import math
 from typing import Any, Dict, List, Optional, Tuple, Union
 
-import kornia as K
 import torch
 from omegaconf import DictConfig
 from torch.nn import functional as F
 from torchvision import transforms
 
-from equiadapt.common.basecanonicalization import ContinuousGroupCanonicalization
+from equiadapt.common.basecanonicalization import (
+    CanonicalizationResult,
+    ContinuousGroupCanonicalization,
+)
 from equiadapt.common.utils import gram_schmidt
-from equiadapt.images.utils import get_action_on_image_features
+from equiadapt.images.utils import get_action_on_image_features, get_affine_grid
 
 
 class ContinuousGroupImageCanonicalization(ContinuousGroupCanonicalization):
@@ -22,10 +24,17 @@ class ContinuousGroupImageCanonicalization(ContinuousGroupCanonicalization):
     Methods:
         __init__: Initializes the ContinuousGroupImageCanonicalization instance.
         get_rotation_matrix_from_vector: This method takes the input vector and returns the rotation matrix.
-        get_groupelement: This method maps the input image to the group element.
+        get_groupelement_and_info: This method maps the input image to the group element without storing anything on the module.
+        get_inference_groupelement: This method maps the input image to the group element and its matrix representation for inference.
         transformations_before_canonicalization_network_forward: Applies transformations to the input image before forwarding it through the canonicalization network.
         get_group_from_out_vectors: This method takes the output of the canonicalization network and returns the group element.
+        get_identity_mask: This method returns which images have the identity as group element.
+        warp_images: This method warps the input image with the inverse of the group element.
+        apply_inverse_group_element: This method applies the inverse of the group element to the input image.
+        use_warp_short_circuit: This method returns whether the images with the identity group element skip the warp.
         canonicalize: This method takes an image as input and returns the canonicalized image.
+        canonicalize_stateless: This method canonicalizes the image and returns a CanonicalizationResult.
+        canonicalize_inference: This method canonicalizes the image in a form that can be compiled.
         invert_canonicalization: Inverts the canonicalization process on the output of the canonicalized image.
     """
 
@@ -43,7 +52,7 @@ class ContinuousGroupImageCanonicalization(ContinuousGroupCanonicalization):
             canonicalization_hyperparams (DictConfig): The hyperparameters for the canonicalization process.
             in_shape (tuple): The shape of the input images.
         """
-        super().__init__(canonicalization_network)
+        super().__init__(canonicalization_network, group_rep_dim=2)
 
         assert (
             len(in_shape) == 3
@@ -80,19 +89,55 @@ class ContinuousGroupImageCanonicalization(ContinuousGroupCanonicalization):
             if is_grayscale
             else transforms.Resize(size=canonicalization_hyperparams.resize_shape)
         )
+        # canonicalize() folds the reflection, the edge padding (as border sampling), the rotation
+        # and the crop above into a single sampling grid at the output resolution
+        self.canonicalization_pad = 0 if is_grayscale else math.ceil(in_shape[-1] * 0.5)
+        self.canonicalization_out_shape = (
+            None if is_grayscale else (in_shape[-2], in_shape[-1])
+        )
+        self.canonicalization_padding_mode = "zeros" if is_grayscale else "border"
         self.group_info_dict: Dict[str, Any] = {}
+        # at inference, skip the warp and inversion of images (nearly) in canonical pose
+        self.identity_short_circuit = canonicalization_hyperparams.get(
+            "identity_short_circuit", False
+        )
+        self.identity_tolerance = canonicalization_hyperparams.get(
+            "identity_tolerance", 1e-3
+        )
 
-    def get_groupelement(self, x: torch.Tensor) -> dict:
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
         """
-        This method takes the input image and maps it to the group element
+        This method takes the input image and maps it to the group element without storing anything on the module
+
+        Args:
+            x (torch.Tensor): input image
+
+        Returns:
+            dict: group element
+            dict: information about the canonicalization
+        """
+        raise NotImplementedError("get_groupelement_and_info method is not implemented")
+
+    def get_inference_groupelement(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], torch.Tensor]:
+        """
+        This method maps the input image to the group element, without the information that is only needed for training
 
         Args:
             x (torch.Tensor): input image
 
         Returns:
             dict: group element
+            torch.Tensor: matrix representation of the group element
         """
-        raise NotImplementedError("get_groupelement method is not implemented")
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(x)
+        return (
+            group_element_dict,
+            canonicalization_info["group_element_matrix_representation"],
+        )
 
     def transformations_before_canonicalization_network_forward(
         self, x: torch.Tensor
@@ -139,75 +184,233 @@ class ContinuousGroupImageCanonicalization(ContinuousGroupCanonicalization):
             reflect_indicator = (1 - determinant[:, None, None, None]) / 2
             group_element_dict["reflection"] = reflect_indicator
 
-            # Identify matrices with a reflection (negative determinant)
-            reflection_indices = determinant < 0
-
-            # For matrices with a reflection, adjust to remove the reflection component
-            # This example assumes flipping the sign of the second column as one way to adjust
-            # Note: This method of adjustment is context-dependent and may vary based on your specific requirements
-            rotation_matrices = rotoreflection_matrices
-            rotation_matrices[reflection_indices, :, 1] *= -1
+            # For matrices with a reflection (negative determinant), flip the sign of the
+            # second column to remove the reflection component, without in-place indexing
+            second_column_sign = 1 - 2 * (determinant < 0).to(determinant.dtype)
+            rotation_matrices = torch.stack(
+                [
+                    rotoreflection_matrices[:, :, 0],
+                    rotoreflection_matrices[:, :, 1] * second_column_sign[:, None],
+                ],
+                dim=-1,
+            )
         else:
             # Pass the first vector to get the rotation matrix
             rotation_matrices = self.get_rotation_matrix_from_vector(out_vectors[:, 0])
 
         group_element_dict["rotation"] = rotation_matrices
 
-        return group_element_dict, (
-            rotoreflection_matrices
-            if self.group_type == "roto-reflection"
-            else rotation_matrices
+        return group_element_dict, rotation_matrices
+
+    def get_identity_mask(
+        self, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        This method returns which images have the identity as group element, i.e. no reflection and a rotation
+        matrix whose entries are within `identity_tolerance` of the identity matrix
+
+        Args:
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each image.
+
+        Returns:
+            torch.Tensor: boolean tensor of shape (batch_size,)
+        """
+        rotation_matrices = group_element_dict["rotation"]
+        identity = torch.eye(
+            2, dtype=rotation_matrices.dtype, device=rotation_matrices.device
         )
+        distance = (rotation_matrices - identity).abs().amax(dim=(-2, -1))
+        identity_mask = distance <= self.identity_tolerance
+        if "reflection" in group_element_dict:
+            identity_mask &= group_element_dict["reflection"].reshape(-1) <= 0.5
+        return identity_mask
 
-    def canonicalize(
-        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
-    ) -> Union[torch.Tensor, Tuple[torch.Tensor, List]]:
+    def apply_inverse_group_element(
+        self, x: torch.Tensor, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
         """
-        This method takes an image as input and returns the canonicalized image
+        This method applies the inverse of the group element to the input image
+
+        With `identity_short_circuit`, only the images whose group element is not (nearly) the identity are warped
+        at inference.
 
         Args:
             x (torch.Tensor): The input image.
-            targets (Optional[List]): The targets, if any.
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each image.
 
         Returns:
             torch.Tensor: canonicalized image
         """
-        self.device = x.device
+        if self.use_warp_short_circuit(x):
+            return self.apply_to_non_identity(self.warp_images, x, group_element_dict)
+        return self.warp_images(x, group_element_dict)
 
-        # get the group element dictionary with keys as 'rotation' and 'reflection'
-        group_element_dict = self.get_groupelement(x)
+    def use_warp_short_circuit(self, x: torch.Tensor) -> bool:
+        """
+        This method returns whether the images with the identity group element skip the warp
+
+        Args:
+            x (torch.Tensor): The input image.
+
+        Returns:
+            bool: whether `apply_inverse_group_element` only warps the images whose group element is not the identity
+        """
+        # the images are copied unchanged, so they must already have the output size
+        return self.use_identity_short_circuit() and x.shape[-2:] == (
+            self.canonicalization_out_shape or x.shape[-2:]
+        )
+
+    def warp_images(
+        self, x: torch.Tensor, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        This method warps the input image with the inverse of the group element, in a single resampling
 
+        Args:
+            x (torch.Tensor): The input image.
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each image.
+
+        Returns:
+            torch.Tensor: canonicalized image
+        """
         rotation_matrices = group_element_dict["rotation"]
+        batch_size, channels, height, width = x.shape
+        out_height, out_width = self.canonicalization_out_shape or (height, width)
+        pad = self.canonicalization_pad
+
+        # All the coordinates below are (x, y) pixel coordinates of the input image:
+        # the center of the rotation, as used by warp_affine on the padded image, the top
+        # left corner of the center crop of the padded image, and the scales that map
+        # them to the normalized coordinates of grid_sample (align_corners=True)
+        center, crop_offset, in_scale, out_scale = torch.tensor(
+            [
+                [(height + 2 * pad) // 2 - pad, (width + 2 * pad) // 2 - pad],
+                [
+                    int(round((width + 2 * pad - out_width) / 2.0)) - pad,
+                    int(round((height + 2 * pad - out_height) / 2.0)) - pad,
+                ],
+                [(width - 1) / 2, (height - 1) / 2],
+                [(out_width - 1) / 2, (out_height - 1) / 2],
+            ],
+            dtype=rotation_matrices.dtype,
+            device=rotation_matrices.device,
+        )
 
-        # To apply inverse rotation for canonicalization
-        rotation_matrices[:, [0, 1], [1, 0]] *= -1
+        # Each output pixel o samples the (maybe reflected) input at R (o + offset - c) + c,
+        # which applies the inverse rotation for canonicalization
+        linear = rotation_matrices
+        translation = center + (linear @ (crop_offset - center)[:, None]).squeeze(-1)
 
         if "reflection" in group_element_dict:
-            reflect_indicator = group_element_dict["reflection"]
+            # Reflecting the image maps the x coordinate to width - 1 - x
+            reflect_indicator = group_element_dict["reflection"].reshape(-1, 1)
+            flip_scale = torch.cat(
+                [1 - 2 * reflect_indicator, torch.ones_like(reflect_indicator)], dim=-1
+            )
+            flip_shift = torch.cat(
+                [reflect_indicator * (width - 1), torch.zeros_like(reflect_indicator)],
+                dim=-1,
+            )
+            linear = flip_scale[:, :, None] * linear
+            translation = flip_scale * translation + flip_shift
+
+        affine_translation = (
+            (linear @ out_scale[:, None]).squeeze(-1) + translation - in_scale
+        ) / in_scale
+        affine_matrices = torch.cat(
+            [linear * out_scale / in_scale[:, None], affine_translation[..., None]],
+            dim=-1,
+        )
 
-            # Reflect the image conditionally
-            x = (1 - reflect_indicator) * x + reflect_indicator * K.geometry.hflip(x)
+        # Sample the canonicalized image directly at the output resolution,
+        # border sampling replaces the edge padding
+        grid = get_affine_grid(
+            affine_matrices.to(x.dtype), [batch_size, channels, out_height, out_width]
+        )
+        return F.grid_sample(
+            x,
+            grid,
+            mode="bilinear",
+            padding_mode=self.canonicalization_padding_mode,
+            align_corners=True,
+        )
 
-        # Apply padding before canonicalization
-        x = self.pad(x)
+    def canonicalize_stateless(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> CanonicalizationResult:
+        """
+        This method canonicalizes the image without storing anything on the module
+
+        Args:
+            x (torch.Tensor): The input image.
+            targets (Optional[List]): The targets, if any.
 
-        # Compute affine part for warp affine
-        alpha, beta = rotation_matrices[:, 0, 0], rotation_matrices[:, 0, 1]
-        cx, cy = x.shape[-2] // 2, x.shape[-1] // 2
-        affine_part = torch.stack(
-            [(1 - alpha) * cx - beta * cy, beta * cx + (1 - alpha) * cy], dim=1
+        Returns:
+            CanonicalizationResult: canonicalized image and information about the canonicalization
+        """
+        # get the group element dictionary with keys as 'rotation' and 'reflection'
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(x)
+        if self.use_warp_short_circuit(x):
+            canonicalization_info["identity_mask"] = self.get_identity_mask(
+                group_element_dict
+            )
+
+        return CanonicalizationResult(
+            canonicalized_x=self.apply_inverse_group_element(x, group_element_dict),
+            group_element=group_element_dict,
+            canonicalization_info=canonicalization_info,
+            targets=targets,
         )
 
-        # Prepare affine matrices for warp affine, adjusting rotation matrix for Kornia compatibility
-        affine_matrices = torch.cat(
-            [rotation_matrices, affine_part.unsqueeze(-1)], dim=-1
+    def canonicalize_inference(
+        self, x: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        This method canonicalizes the image for inference without storing anything on the module
+
+        Only tensors go in and out, so the canonicalization and the prediction network can be captured
+        by `torch.compile` as a single graph.
+
+        Args:
+            x (torch.Tensor): The input image.
+
+        Returns:
+            torch.Tensor: canonicalized image
+            torch.Tensor: matrix representation of the group element, of shape (batch_size, 2, 2)
+        """
+        (
+            group_element_dict,
+            group_element_representation,
+        ) = self.get_inference_groupelement(x)
+        return (
+            self.apply_inverse_group_element(x, group_element_dict),
+            group_element_representation,
         )
 
-        # Apply warp affine, and then crop
-        x = K.geometry.warp_affine(x, affine_matrices, dsize=(x.shape[-2], x.shape[-1]))
-        x = self.crop(x)
+    def canonicalize(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, List]]:
+        """
+        This method takes an image as input and returns the canonicalized image
 
-        return x
+        Args:
+            x (torch.Tensor): The input image.
+            targets (Optional[List]): The targets, if any.
+
+        Returns:
+            torch.Tensor: canonicalized image
+        """
+        self.device = x.device
+
+        # get the group element dictionary with keys as 'rotation' and 'reflection'
+        group_element_dict = self.get_groupelement(x)
+        if self.use_warp_short_circuit(x):
+            self.canonicalization_info_dict["identity_mask"] = self.get_identity_mask(
+                group_element_dict
+            )
+            self.update_identity_short_circuit_stats(self.canonicalization_info_dict)
+
+        return self.apply_inverse_group_element(x, group_element_dict)
 
     def invert_canonicalization(
         self, x_canonicalized_out: torch.Tensor, **kwargs: Any
@@ -217,16 +420,41 @@ class ContinuousGroupImageCanonicalization(ContinuousGroupCanonicalization):
 
         Args:
             x_canonicalized_out (torch.Tensor): The output of the canonicalized image.
+            **kwargs (Any): Additional keyword arguments, such as `induced_rep_type`
+                and `canonicalization_result` (returned by canonicalize_stateless).
 
         Returns:
             torch.Tensor: The output corresponding to the original image.
         """
         induced_rep_type = kwargs.get("induced_rep_type", "vector")
-        return get_action_on_image_features(
-            feature_map=x_canonicalized_out,
-            group_info_dict=self.group_info_dict,
-            group_element_dict=self.canonicalization_info_dict["group_element"],  # type: ignore
-            induced_rep_type=induced_rep_type,
+        canonicalization_info_dict = self.get_canonicalization_info_dict(
+            kwargs.get("canonicalization_result")
+        )
+
+        def apply_action(
+            feature_map: torch.Tensor, group_element_dict: Dict[str, torch.Tensor]
+        ) -> torch.Tensor:
+            # the action on feature maps takes the angle of the rotation matrices, in degrees
+            rotation_matrices = group_element_dict["rotation"]
+            angles = torch.rad2deg(
+                torch.atan2(rotation_matrices[:, 0, 1], rotation_matrices[:, 0, 0])
+            )
+            return get_action_on_image_features(
+                feature_map=feature_map,
+                group_info_dict=self.group_info_dict,
+                group_element_dict={**group_element_dict, "rotation": angles},
+                induced_rep_type=induced_rep_type,
+            )
+
+        if self.use_identity_short_circuit():
+            return self.apply_to_non_identity(
+                apply_action,
+                x_canonicalized_out,
+                canonicalization_info_dict["group_element"],
+                identity_mask=canonicalization_info_dict.get("identity_mask"),
+            )
+        return apply_action(
+            x_canonicalized_out, canonicalization_info_dict["group_element"]
         )
 
 
@@ -239,7 +467,7 @@ class SteerableImageCanonicalization(ContinuousGroupImageCanonicalization):
     Methods:
         __init__: Initializes the SteerableImageCanonicalization instance.
         get_rotation_matrix_from_vector: This method takes the input vector and returns the rotation matrix.
-        get_groupelement: This method maps the input image to the group element.
+        get_groupelement_and_info: This method maps the input image to the group element.
     """
 
     def __init__(
@@ -276,7 +504,9 @@ class SteerableImageCanonicalization(ContinuousGroupImageCanonicalization):
         rotation_matrices = torch.stack([v1, v2], dim=1)
         return rotation_matrices
 
-    def get_groupelement(self, x: torch.Tensor) -> dict:
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
         """
         This method takes the input image and maps it to the group element
 
@@ -285,30 +515,25 @@ class SteerableImageCanonicalization(ContinuousGroupImageCanonicalization):
 
         Returns:
             dict: group element
+            dict: information about the canonicalization
         """
-        group_element_dict: Dict[str, Any] = {}
-
         x = self.transformations_before_canonicalization_network_forward(x)
 
         # convert the group activations to one hot encoding of group element
         # this conversion is differentiable and will be used to select the group element
         out_vectors = self.canonicalization_network(x)
 
-        # Check whether canonicalization_info_dict is already defined
-        if not hasattr(self, "canonicalization_info_dict"):
-            self.canonicalization_info_dict = {}
-
         (
             group_element_dict,
             group_element_representation,
         ) = self.get_group_from_out_vectors(out_vectors)
-        self.canonicalization_info_dict["group_element_matrix_representation"] = (
-            group_element_representation
-        )
 
-        self.canonicalization_info_dict["group_element"] = group_element_dict  # type: ignore
+        canonicalization_info = {
+            "group_element_matrix_representation": group_element_representation,
+            "group_element": group_element_dict,
+        }
 
-        return group_element_dict
+        return group_element_dict, canonicalization_info
 
 
 class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalization):
@@ -321,7 +546,8 @@ class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalizati
         __init__: Initializes the OptimizedSteerableImageCanonicalization instance.
         get_rotation_matrix_from_vector: This method takes the input vector and returns the rotation matrix.
         group_augment: This method applies random rotations and reflections to the input images.
-        get_groupelement: This method maps the input image to the group element.
+        get_groupelement_and_info: This method maps the input image to the group element.
+        get_inference_groupelement: This method maps the input image to the group element without augmenting it.
         get_optimization_specific_loss: This method returns the optimization specific loss.
     """
 
@@ -373,11 +599,11 @@ class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalizati
         batch_size = x.shape[0]
 
         # Generate random rotation angles (in radians)
-        angles = torch.rand(batch_size, device=self.device) * 2 * torch.pi
+        angles = torch.rand(batch_size, device=x.device) * 2 * torch.pi
         cos_a, sin_a = torch.cos(angles), torch.sin(angles)
 
         # Create tensors for rotation matrices
-        rotation_matrices = torch.zeros(batch_size, 2, 3, device=self.device)
+        rotation_matrices = torch.zeros(batch_size, 2, 3, device=x.device)
         rotation_matrices[:, :2, :2] = torch.stack(
             (cos_a, -sin_a, sin_a, cos_a)
         ).reshape(-1, 2, 2)
@@ -385,7 +611,7 @@ class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalizati
         if self.group_type == "roto-reflection":
             # Generate reflection indicators (horizontal flip) with 50% probability
             reflect = (
-                torch.randint(0, 2, (batch_size,), device=self.device).float() * 2 - 1
+                torch.randint(0, 2, (batch_size,), device=x.device).float() * 2 - 1
             )
             # Adjust the rotation matrix for reflections
             rotation_matrices[:, 0, 0] *= reflect
@@ -411,7 +637,9 @@ class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalizati
         # Return augmented images and the transformation matrices used
         return augmented_images, rotation_matrices[:, :, :2]
 
-    def get_groupelement(self, x: torch.Tensor) -> dict:
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
         """
         Maps the input image to the group element.
 
@@ -420,9 +648,8 @@ class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalizati
 
         Returns:
             dict: The group element.
+            dict: The information about the canonicalization.
         """
-        group_element_dict: Dict[str, Any] = {}
-
         batch_size = x.shape[0]
 
         # randomly sample generate some agmentations of the input image using rotation and reflection
@@ -447,47 +674,65 @@ class OptimizedSteerableImageCanonicalization(ContinuousGroupImageCanonicalizati
 
         out_vectors, out_vectors_augmented = out_vectors_all.chunk(2, dim=0)
 
-        # Check whether canonicalization_info_dict is already defined
-        if not hasattr(self, "canonicalization_info_dict"):
-            self.canonicalization_info_dict = {}
-
         (
             group_element_dict,
             group_element_representations,
         ) = self.get_group_from_out_vectors(out_vectors)
-        # Store the matrix representation of the group element for regularization and identity metric
-        self.canonicalization_info_dict["group_element_matrix_representation"] = (
-            group_element_representations
-        )
-        self.canonicalization_info_dict["group_element"] = group_element_dict  # type: ignore
 
         _, group_element_representations_augmented = self.get_group_from_out_vectors(
             out_vectors_augmented
         )
-        self.canonicalization_info_dict[
-            "group_element_matrix_representation_augmented"
-        ] = group_element_representations_augmented
-        self.canonicalization_info_dict[
-            "group_element_matrix_representation_augmented_gt"
-        ] = group_element_representations_augmented_gt
 
-        return group_element_dict
+        canonicalization_info = {
+            # Store the matrix representation of the group element for regularization and identity metric
+            "group_element_matrix_representation": group_element_representations,
+            "group_element": group_element_dict,
+            "group_element_matrix_representation_augmented": group_element_representations_augmented,
+            "group_element_matrix_representation_augmented_gt": group_element_representations_augmented_gt,
+        }
 
-    def get_optimization_specific_loss(self) -> torch.Tensor:
+        return group_element_dict, canonicalization_info
+
+    def get_inference_groupelement(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], torch.Tensor]:
+        """
+        Maps the input image to the group element, without the augmented images that are only needed for training.
+
+        Args:
+            x (torch.Tensor): The input image.
+
+        Returns:
+            dict: The group element.
+            torch.Tensor: The matrix representation of the group element.
+        """
+        batch_size = x.shape[0]
+        x = self.transformations_before_canonicalization_network_forward(x)
+        out_vectors = self.canonicalization_network(x).reshape(batch_size, -1, 2)
+        return self.get_group_from_out_vectors(out_vectors)
+
+    def get_optimization_specific_loss(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         This method returns the optimization specific loss
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+                If not given, the information stored by the last call to canonicalize is used.
+
         Returns:
             torch.Tensor: optimization specific loss
         """
+        canonicalization_info_dict = self.get_canonicalization_info_dict(
+            canonicalization_result
+        )
         (
             group_element_representations_augmented,
             group_element_representations_augmented_gt,
         ) = (
-            self.canonicalization_info_dict[
-                "group_element_matrix_representation_augmented"
-            ],
-            self.canonicalization_info_dict[
+            canonicalization_info_dict["group_element_matrix_representation_augmented"],
+            canonicalization_info_dict[
                 "group_element_matrix_representation_augmented_gt"
             ],
         )
@@ -7,15 +7,22 @@ from omegaconf import DictConfig
 from torch.nn import functional as F
 from torchvision import transforms
 
-from equiadapt.common.basecanonicalization import DiscreteGroupCanonicalization
+from equiadapt.common.basecanonicalization import (
+    CanonicalizationResult,
+    DiscreteGroupCanonicalization,
+)
+from equiadapt.common.utils import is_compiling
 from equiadapt.images.utils import (
-    flip_boxes,
-    flip_masks,
     get_action_on_image_features,
-    rotate_boxes,
-    rotate_masks,
+    get_rot90_permutations,
+    rot90_images,
+    transform_targets,
+    use_exact_rotations,
 )
 
+# number of group_augment grids of non-default input sizes kept by each canonicalizer
+MAX_CACHED_GROUP_AUGMENT_GRIDS = 8
+
 
 class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
     """
@@ -26,10 +33,18 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
 
     Methods:
         __init__: Initializes the DiscreteGroupImageCanonicalization instance.
+        register_group_element_buffers: Registers the rotation angle and reflection of every group element as buffers.
         groupactivations_to_groupelement: Takes the activations for each group element as input and returns the group element.
-        get_groupelement: Maps the input image to a group element.
+        get_group_activations_and_info: Gets the group activations and any extra information about the canonicalization.
+        get_inference_group_activations: Gets the group activations without the information only needed for training.
+        get_groupelement_and_info: Maps the input image to a group element without storing anything on the module.
         transformations_before_canonicalization_network_forward: Applies transformations to the input images before passing it through the canonicalization network.
+        get_identity_mask: Returns which images have the identity as group element.
+        warp_images: Applies the inverse of the group element to the input images.
+        apply_inverse_group_element: Applies the inverse of the group element to the input images and targets.
         canonicalize: Canonicalizes the input images.
+        canonicalize_stateless: Canonicalizes the input images and returns a CanonicalizationResult.
+        canonicalize_inference: Canonicalizes the input images in a form that can be compiled.
         invert_canonicalization: Inverts the canonicalization of the output of the canonicalized image.
     """
 
@@ -50,6 +65,17 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
         super().__init__(canonicalization_network)
 
         self.beta = canonicalization_hyperparams.beta
+        # rotations by multiples of 90 degrees can skip interpolation (see ROTATION_BACKENDS)
+        self.rotation_backend = canonicalization_hyperparams.get(
+            "rotation_backend", "auto"
+        )
+        # at inference, skip the warp and inversion of images already in canonical pose
+        self.identity_short_circuit = canonicalization_hyperparams.get(
+            "identity_short_circuit", False
+        )
+        self.identity_tolerance = canonicalization_hyperparams.get(
+            "identity_tolerance", 1e-3
+        )
 
         assert (
             len(in_shape) == 3
@@ -91,6 +117,22 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
             else transforms.Resize(size=canonicalization_hyperparams.resize_shape)
         )
 
+    def register_group_element_buffers(self) -> None:
+        """
+        This method registers the rotation angle and reflection indicator of every group element as non-persistent
+        buffers, so that they are not built and copied to the device every time a group element is computed.
+        It must be called once `num_rotations` and `group_type` are set.
+        """
+        angles = torch.linspace(0.0, 360.0, self.num_rotations + 1)[
+            : self.num_rotations
+        ]
+        reflections = torch.zeros(self.num_rotations)
+        if self.group_type == "roto-reflection":
+            angles = torch.cat([angles, angles], dim=0)
+            reflections = torch.cat([reflections, torch.ones(self.num_rotations)])
+        self.register_buffer("group_element_angles", angles, persistent=False)
+        self.register_buffer("group_element_reflections", reflections, persistent=False)
+
     def groupactivations_to_groupelement(self, group_activations: torch.Tensor) -> dict:
         """
         This method takes the activations for each group element as input and returns the group element
@@ -107,14 +149,8 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
             group_activations
         )
 
-        angles = torch.linspace(0.0, 360.0, self.num_rotations + 1)[
-            : self.num_rotations
-        ].to(self.device)
-        group_elements_rot_comp = (
-            torch.cat([angles, angles], dim=0)
-            if self.group_type == "roto-reflection"
-            else angles
-        )
+        # no-op unless the module and the activations are on different devices
+        group_elements_rot_comp = self.group_element_angles.to(group_activations.device)
 
         group_element_dict = {}
 
@@ -124,9 +160,9 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
         group_element_dict["rotation"] = group_element_rot_comp
 
         if self.group_type == "roto-reflection":
-            reflect_identifier_vector = torch.cat(
-                [torch.zeros(self.num_rotations), torch.ones(self.num_rotations)], dim=0
-            ).to(self.device)
+            reflect_identifier_vector = self.group_element_reflections.to(
+                group_activations.device
+            )
             group_element_reflect_comp = torch.sum(
                 group_elements_one_hot * reflect_identifier_vector, dim=-1
             )
@@ -149,27 +185,57 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
             "the DiscreteGroupImageCanonicalization class"
         )
 
-    def get_groupelement(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+    def get_group_activations_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[torch.Tensor, Dict[str, Any]]:
+        """
+        Gets the group activations for the input images, along with any extra information
+        about the canonicalization that is needed later (e.g. for the optimization specific loss).
+
+        Args:
+            x (torch.Tensor): The input images.
+
+        Returns:
+            torch.Tensor: The group activations.
+            dict: Extra information about the canonicalization.
+        """
+        return self.get_group_activations(x), {}
+
+    def get_inference_group_activations(self, x: torch.Tensor) -> torch.Tensor:
         """
-        Maps the input image to a group element.
+        Gets the group activations for the input images, without the information that is only needed for training.
+
+        Args:
+            x (torch.Tensor): The input images.
+
+        Returns:
+            torch.Tensor: The group activations.
+        """
+        group_activations, _ = self.get_group_activations_and_info(x)
+        return group_activations
+
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
+        """
+        Maps the input image to a group element without storing anything on the module.
 
         Args:
             x (torch.Tensor): The input images.
 
         Returns:
             dict[str, torch.Tensor]: The corresponding group elements.
+            dict: The information about the canonicalization.
         """
-        group_activations = self.get_group_activations(x)
+        group_activations, canonicalization_info = self.get_group_activations_and_info(
+            x
+        )
         group_element_dict = self.groupactivations_to_groupelement(group_activations)
 
-        # Check whether canonicalization_info_dict is already defined
-        if not hasattr(self, "canonicalization_info_dict"):
-            self.canonicalization_info_dict = {}
-
-        self.canonicalization_info_dict["group_element"] = group_element_dict  # type: ignore
-        self.canonicalization_info_dict["group_activations"] = group_activations
+        canonicalization_info["group_element"] = group_element_dict
+        canonicalization_info["group_activations"] = group_activations
 
-        return group_element_dict
+        return group_element_dict, canonicalization_info
 
     def transformations_before_canonicalization_network_forward(
         self, x: torch.Tensor
@@ -187,11 +253,100 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
         x = self.resize_canonization(x)
         return x
 
-    def canonicalize(
+    def get_identity_mask(
+        self, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        Returns which images have the identity as group element, i.e. no rotation (within `identity_tolerance`
+        degrees) and no reflection.
+
+        Args:
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each image.
+
+        Returns:
+            torch.Tensor: A boolean tensor of shape (batch_size,).
+        """
+        identity_mask = group_element_dict["rotation"].abs() <= self.identity_tolerance
+        if "reflection" in group_element_dict:
+            identity_mask &= group_element_dict["reflection"] <= 0.5
+        return identity_mask
+
+    def warp_images(
+        self, x: torch.Tensor, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        Applies the inverse of the group element to the input images.
+
+        Args:
+            x (torch.Tensor): The input images.
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each image.
+
+        Returns:
+            torch.Tensor: The canonicalized images.
+        """
+        if use_exact_rotations(
+            x, self.num_rotations, self.rotation_backend, group_element_dict["rotation"]
+        ):
+            # the group element is a pixel permutation, so there is nothing to pad or crop
+            x = rot90_images(
+                x, -group_element_dict["rotation"], group_element_dict.get("reflection")
+            )
+        else:
+            x = self.pad(x)
+
+            if "reflection" in group_element_dict.keys():
+                reflect_indicator = group_element_dict["reflection"].view(-1, 1, 1, 1)
+                x_reflected = K.geometry.hflip(x)
+                x = (1 - reflect_indicator) * x + reflect_indicator * x_reflected
+
+            x = K.geometry.rotate(x, -group_element_dict["rotation"])
+
+            x = self.crop(x)
+        return x
+
+    def apply_inverse_group_element(
+        self,
+        x: torch.Tensor,
+        group_element_dict: Dict[str, torch.Tensor],
+        targets: Optional[List] = None,
+    ) -> Tuple[torch.Tensor, Optional[List]]:
+        """
+        Applies the inverse of the group element to the input images and, optionally, the targets.
+
+        With `identity_short_circuit`, only the images whose group element is not the identity are warped at inference.
+
+        Args:
+            x (torch.Tensor): The input images.
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each image.
+            targets (Optional[List], optional): The targets for instance segmentation. Defaults to None.
+
+        Returns:
+            Tuple[torch.Tensor, Optional[List]]: The canonicalized images and targets.
+        """
+        if self.use_identity_short_circuit():
+            x = self.apply_to_non_identity(self.warp_images, x, group_element_dict)
+        else:
+            x = self.warp_images(x, group_element_dict)
+
+        if targets:
+            # canonicalize the targets (for instance segmentation, masks and boxes)
+            # of the whole batch at once
+            targets = transform_targets(
+                targets,
+                group_element_dict["rotation"],
+                x.shape[-1],
+                reflect=group_element_dict.get("reflection"),
+                num_rotations=self.num_rotations,
+                backend=self.rotation_backend,
+            )
+
+        return x, targets
+
+    def canonicalize_stateless(
         self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
-    ) -> Union[torch.Tensor, Tuple[torch.Tensor, List]]:
+    ) -> CanonicalizationResult:
         """
-        Canonicalizes the input images.
+        Canonicalizes the input images without storing anything on the module.
 
         Args:
             x (torch.Tensor): The input images.
@@ -199,43 +354,67 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
             **kwargs (Any): Additional keyword arguments.
 
         Returns:
-            Union[torch.Tensor, Tuple[torch.Tensor, List]]: The canonicalized image, and optionally the targets.
+            CanonicalizationResult: The canonicalized images, targets and information about the canonicalization.
         """
-        self.device = x.device
-        group_element_dict = self.get_groupelement(x)
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(x)
+        if self.use_identity_short_circuit():
+            canonicalization_info["identity_mask"] = self.get_identity_mask(
+                group_element_dict
+            )
+        x_canonicalized, targets = self.apply_inverse_group_element(
+            x, group_element_dict, targets
+        )
+        return CanonicalizationResult(
+            canonicalized_x=x_canonicalized,
+            group_element=group_element_dict,
+            canonicalization_info=canonicalization_info,
+            targets=targets,
+        )
 
-        x = self.pad(x)
+    def canonicalize_inference(
+        self, x: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Canonicalizes the input images for inference, without storing anything on the module.
 
-        if "reflection" in group_element_dict.keys():
-            reflect_indicator = group_element_dict["reflection"][:, None, None, None]
-            x = (1 - reflect_indicator) * x + reflect_indicator * K.geometry.hflip(x)
+        Only tensors go in and out, so the canonicalization and the prediction network can be captured
+        by `torch.compile` as a single graph.
 
-        x = K.geometry.rotate(x, -group_element_dict["rotation"])
+        Args:
+            x (torch.Tensor): The input images.
 
-        x = self.crop(x)
+        Returns:
+            torch.Tensor: The canonicalized images.
+            torch.Tensor: The index of the group element of each image, rotations first, then roto-reflections.
+        """
+        group_activations = self.get_inference_group_activations(x)
+        group_element_dict = self.groupactivations_to_groupelement(group_activations)
+        x_canonicalized, _ = self.apply_inverse_group_element(x, group_element_dict)
+        return x_canonicalized, group_activations.argmax(dim=-1)
 
-        if targets:
-            # canonicalize the targets (for instance segmentation, masks and boxes)
-            image_width = x.shape[-1]
+    def canonicalize(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, List]]:
+        """
+        Canonicalizes the input images.
 
-            if "reflection" in group_element_dict.keys():
-                # flip masks and boxes
-                for t in range(len(targets)):
-                    targets[t]["boxes"] = flip_boxes(targets[t]["boxes"], image_width)
-                    targets[t]["masks"] = flip_masks(targets[t]["masks"])
-
-            # rotate masks and boxes
-            for t in range(len(targets)):
-                targets[t]["boxes"] = rotate_boxes(
-                    targets[t]["boxes"], group_element_dict["rotation"][t], image_width
-                )
-                targets[t]["masks"] = rotate_masks(
-                    targets[t]["masks"], -group_element_dict["rotation"][t].item()  # type: ignore
-                )
+        Args:
+            x (torch.Tensor): The input images.
+            targets (Optional[List], optional): The targets for instance segmentation. Defaults to None.
+            **kwargs (Any): Additional keyword arguments.
 
-            return x, targets
+        Returns:
+            Union[torch.Tensor, Tuple[torch.Tensor, List]]: The canonicalized image, and optionally the targets.
+        """
+        self.device = x.device
+        result = self.canonicalize_stateless(x, targets, **kwargs)
+        self.canonicalization_info_dict = dict(result.canonicalization_info)
+        self.update_identity_short_circuit_stats(self.canonicalization_info_dict)
 
-        return x
+        if targets:
+            return result.canonicalized_x, result.targets  # type: ignore
+
+        return result.canonicalized_x
 
     def invert_canonicalization(
         self, x_canonicalized_out: torch.Tensor, **kwargs: Any
@@ -245,17 +424,37 @@ class DiscreteGroupImageCanonicalization(DiscreteGroupCanonicalization):
 
         Args:
             x_canonicalized_out (torch.Tensor): The output of the canonicalized image.
-            **kwargs (Any): Additional keyword arguments.
+            **kwargs (Any): Additional keyword arguments, such as `induced_rep_type`
+                and `canonicalization_result` (returned by canonicalize_stateless).
 
         Returns:
             torch.Tensor: The output corresponding to the original image.
         """
         induced_rep_type = kwargs.get("induced_rep_type", "regular")
-        return get_action_on_image_features(
-            feature_map=x_canonicalized_out,
-            group_info_dict=self.group_info_dict,
-            group_element_dict=self.canonicalization_info_dict["group_element"],  # type: ignore
-            induced_rep_type=induced_rep_type,
+        canonicalization_info_dict = self.get_canonicalization_info_dict(
+            kwargs.get("canonicalization_result")
+        )
+
+        def apply_action(
+            feature_map: torch.Tensor, group_element_dict: Dict[str, torch.Tensor]
+        ) -> torch.Tensor:
+            return get_action_on_image_features(
+                feature_map=feature_map,
+                group_info_dict=self.group_info_dict,
+                group_element_dict=group_element_dict,
+                induced_rep_type=induced_rep_type,
+                rotation_backend=self.rotation_backend,
+            )
+
+        if self.use_identity_short_circuit():
+            return self.apply_to_non_identity(
+                apply_action,
+                x_canonicalized_out,
+                canonicalization_info_dict["group_element"],
+                identity_mask=canonicalization_info_dict.get("identity_mask"),
+            )
+        return apply_action(
+            x_canonicalized_out, canonicalization_info_dict["group_element"]
         )
 
 
@@ -298,6 +497,7 @@ class GroupEquivariantImageCanonicalization(DiscreteGroupImageCanonicalization):
             "num_rotations": self.num_rotations,
             "num_group": self.num_group,
         }
+        self.register_group_element_buffers()
 
     def get_group_activations(self, x: torch.Tensor) -> torch.Tensor:
         """
@@ -327,9 +527,14 @@ class OptimizedGroupEquivariantImageCanonicalization(
 
     Methods:
         __init__: Initializes the OptimizedGroupEquivariantImageCanonicalization instance.
+        get_group_augment_grid: Builds the sampling grid that maps the input images to their whole orbit.
+        get_cached_group_augment_grid: Returns the sampling grid for images of a size other than the default one.
         rotate_and_maybe_reflect: Rotate and maybe reflect the input images.
         group_augment: Augment the input images by applying group transformations (rotations and reflections).
         get_group_activations: Gets the group activations for the input images.
+        get_group_activations_and_info: Gets the group activations and the output vectors of the canonicalization network.
+        get_inference_group_activations: Gets the group activations without computing the artifact error.
+        get_group_activations_from_vectors: Compares the output vectors of the canonicalization network to the reference vector.
         get_optimization_specific_loss: Gets the loss specific to the optimization process.
     """
 
@@ -375,6 +580,34 @@ class OptimizedGroupEquivariantImageCanonicalization(
             )
         )
 
+        # group_augment() builds the whole orbit with a single grid_sample call.
+        # Border sampling plays the role of the edge padding above, and the output
+        # grid directly covers the center crop, so no padded copy is ever made.
+        self.group_augment_pad = (
+            0 if in_shape[0] == 1 else math.ceil(group_augment_in_shape * 0.5)
+        )
+        self.group_augment_out_shape = (
+            None if in_shape[0] == 1 else (group_augment_in_shape,) * 2
+        )
+        self.group_augment_padding_mode = "zeros" if in_shape[0] == 1 else "border"
+        self.group_augment_grid_in_shape = (
+            (in_shape[-2], in_shape[-1])
+            if in_shape[0] == 1
+            else (group_augment_in_shape, group_augment_in_shape)
+        )
+        self.register_buffer(
+            "group_augment_grid",
+            self.get_group_augment_grid(*self.group_augment_grid_in_shape),
+            persistent=False,
+        )
+        # grids of the other input sizes, built on first use and dropped once there are too many
+        self.group_augment_grid_cache: Dict[tuple, torch.Tensor] = {}
+        self.register_buffer(
+            "group_off_diagonal_mask",
+            1.0 - torch.eye(self.num_group),
+            persistent=False,
+        )
+
         self.reference_vector = torch.nn.Parameter(
             torch.randn(1, self.out_vector_size),
             requires_grad=canonicalization_hyperparams.learn_ref_vec,
@@ -383,6 +616,87 @@ class OptimizedGroupEquivariantImageCanonicalization(
             "num_rotations": self.num_rotations,
             "num_group": self.num_group,
         }
+        self.register_group_element_buffers()
+
+    def get_group_augment_grid(
+        self,
+        height: int,
+        width: int,
+        degrees: Optional[torch.Tensor] = None,
+        reflect: bool = False,
+    ) -> torch.Tensor:
+        """
+        Builds the sampling grid of all the group elements for images of the given size.
+
+        For every group element, the grid reproduces padding the image, rotating it with
+        `K.geometry.rotate(x, -degree)`, maybe flipping it horizontally and center cropping it,
+        in a single affine map. The grids are stacked along the height dimension in the
+        (group-major) order expected by `get_group_activations`.
+
+        Args:
+            height (int): The height of the input images.
+            width (int): The width of the input images.
+            degrees (Optional[torch.Tensor], optional): The degrees of rotation to use instead of the group elements. Defaults to None.
+            reflect (bool, optional): Whether to reflect the images rotated by `degrees`. Defaults to False.
+
+        Returns:
+            torch.Tensor: The sampling grid of shape (1, num_elements * out_height, out_width, 2).
+        """
+        out_height, out_width = self.group_augment_out_shape or (height, width)
+
+        if degrees is None:
+            degrees = torch.linspace(0, 360, self.num_rotations + 1)[:-1]
+            reflect_half = self.group_type == "roto-reflection"
+        else:
+            reflect_half = False
+        radians = torch.deg2rad(degrees.detach().cpu().to(torch.float64))
+        cos_a, sin_a = torch.cos(radians), torch.sin(radians)
+
+        # location in the input image sampled by each output pixel, in pixel coordinates
+        # centered on the image, i.e. the inverse of the rotation by -degree
+        linear = torch.stack(
+            [torch.stack([cos_a, sin_a], dim=-1), torch.stack([-sin_a, cos_a], dim=-1)],
+            dim=-2,
+        )  # (num_rotations, 2, 2)
+        # the horizontal flip happens after the rotation, so it flips the x coordinate first
+        flip = torch.tensor([-1.0, 1.0], dtype=torch.float64)
+        if reflect_half:
+            linear = torch.cat([linear, linear * flip], dim=0)
+        elif reflect:
+            linear = linear * flip
+
+        # offset of the center of the crop with respect to the center of the input image
+        # (same rounding as transforms.CenterCrop on the padded image)
+        pad = self.group_augment_pad
+        crop_left = int(round((width + 2 * pad - out_width) / 2.0)) - pad
+        crop_top = int(round((height + 2 * pad - out_height) / 2.0)) - pad
+        offset = torch.tensor(
+            [
+                crop_left + (out_width - width) / 2,
+                crop_top + (out_height - height) / 2,
+            ],
+            dtype=torch.float64,
+        )
+
+        # move from pixel coordinates to the normalized coordinates of grid_sample
+        in_scale = torch.tensor(
+            [(width - 1) / 2, (height - 1) / 2], dtype=torch.float64
+        )
+        out_scale = torch.tensor(
+            [(out_width - 1) / 2, (out_height - 1) / 2], dtype=torch.float64
+        )
+        thetas = torch.cat(
+            [
+                linear * out_scale / in_scale[:, None],
+                (linear @ offset / in_scale)[..., None],
+            ],
+            dim=-1,
+        )  # (group_size, 2, 3)
+
+        grid = F.affine_grid(
+            thetas, [len(thetas), 1, out_height, out_width], align_corners=True
+        )  # (num_elements, out_height, out_width, 2)
+        return grid.reshape(1, -1, out_width, 2).float()
 
     def rotate_and_maybe_reflect(
         self, x: torch.Tensor, degrees: torch.Tensor, reflect: bool = False
@@ -390,6 +704,8 @@ class OptimizedGroupEquivariantImageCanonicalization(
         """
         Rotate and maybe reflect the input images.
 
+        The images are warped by all the rotations at once with the grid of `get_group_augment_grid`.
+
         Args:
             x (torch.Tensor): The input image.
             degrees (torch.Tensor): The degrees of rotation.
@@ -398,15 +714,51 @@ class OptimizedGroupEquivariantImageCanonicalization(
         Returns:
             List[torch.Tensor]: The list of rotated and maybe reflected images.
         """
-        x_augmented_list = []
-        for degree in degrees:
-            x_rot = self.pad_group_augment(x)
-            x_rot = K.geometry.rotate(x_rot, -degree)
-            if reflect:
-                x_rot = K.geometry.hflip(x_rot)
-            x_rot = self.crop_group_augment(x_rot)
-            x_augmented_list.append(x_rot)
-        return x_augmented_list
+        batch_size, channels, height, width = x.shape
+        grid = self.get_group_augment_grid(height, width, degrees, reflect)
+        out_height, out_width = grid.shape[1] // len(degrees), grid.shape[2]
+        x_augmented = F.grid_sample(
+            x,
+            grid.to(x.device, x.dtype).expand(batch_size, -1, -1, -1),
+            mode="bilinear",
+            padding_mode=self.group_augment_padding_mode,
+            align_corners=True,
+        )
+        return list(
+            x_augmented.reshape(
+                batch_size, channels, len(degrees), out_height, out_width
+            ).unbind(dim=2)
+        )
+
+    def get_cached_group_augment_grid(
+        self, height: int, width: int, like: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Returns the sampling grid of `get_group_augment_grid` for images of a size other than the default one.
+
+        The grids are kept in `group_augment_grid_cache`, which is not a buffer, so they are neither saved
+        nor moved with the module. The cache is emptied once it holds `MAX_CACHED_GROUP_AUGMENT_GRIDS` grids,
+        and every operation on it is atomic, so it can be used from several threads at once.
+
+        Args:
+            height (int): The height of the input images.
+            width (int): The width of the input images.
+            like (torch.Tensor): Tensor whose device and dtype the grid must have.
+
+        Returns:
+            torch.Tensor: The sampling grid of shape (1, group_size * out_height, out_width, 2).
+        """
+        if is_compiling():
+            # updating the cache while tracing would break the graph
+            return self.get_group_augment_grid(height, width).to(like.device)
+        key = (height, width, like.device)
+        grid = self.group_augment_grid_cache.get(key)
+        if grid is None:
+            grid = self.get_group_augment_grid(height, width).to(like.device)
+            if len(self.group_augment_grid_cache) >= MAX_CACHED_GROUP_AUGMENT_GRIDS:
+                self.group_augment_grid_cache.clear()
+            self.group_augment_grid_cache[key] = grid
+        return grid
 
     def group_augment(self, x: torch.Tensor) -> torch.Tensor:
         """
@@ -418,13 +770,47 @@ class OptimizedGroupEquivariantImageCanonicalization(
         Returns:
             torch.Tensor: The augmented image.
         """
-        degrees = torch.linspace(0, 360, self.num_rotations + 1)[:-1].to(self.device)
-        x_augmented_list = self.rotate_and_maybe_reflect(x, degrees)
+        batch_size, channels, height, width = x.shape
+
+        if self.group_augment_out_shape in (None, (height, width)) and (
+            use_exact_rotations(x, self.num_rotations, self.rotation_backend)
+        ):
+            # each group element is a pixel permutation: gather the whole orbit at once.
+            # Rotating by -degree and then flipping is the same as flipping and rotating by degree
+            steps = [4 * i // self.num_rotations for i in range(self.num_rotations)]
+            transform_ids = [-step % 4 for step in steps]
+            if self.group_type == "roto-reflection":
+                transform_ids += [4 + step for step in steps]
+            permutations = get_rot90_permutations(height, x.device)[transform_ids]
+            x_augmented = x.flatten(-2)[..., permutations.flatten()]
+            return (
+                x_augmented.reshape(batch_size, channels, self.num_group, height, width)
+                .permute(2, 0, 1, 3, 4)
+                .reshape(-1, channels, height, width)
+            )
 
-        if self.group_type == "roto-reflection":
-            x_augmented_list += self.rotate_and_maybe_reflect(x, degrees, reflect=True)
+        grid: torch.Tensor = self.group_augment_grid  # type: ignore[assignment]
+        if (height, width) != self.group_augment_grid_in_shape:
+            grid = self.get_cached_group_augment_grid(height, width, x)
+        out_height, out_width = grid.shape[1] // self.num_group, grid.shape[2]
+
+        # a single warp of the whole orbit: (batch_size, channels, group_size * height, width)
+        x_augmented = F.grid_sample(
+            x,
+            grid.to(x.dtype).expand(batch_size, -1, -1, -1),
+            mode="bilinear",
+            padding_mode=self.group_augment_padding_mode,
+            align_corners=True,
+        )
 
-        return torch.cat(x_augmented_list, dim=0)
+        # size (group_size * batch_size, in_channels, height, width)
+        return (
+            x_augmented.reshape(
+                batch_size, channels, self.num_group, out_height, out_width
+            )
+            .permute(2, 0, 1, 3, 4)
+            .reshape(-1, channels, out_height, out_width)
+        )
 
     def get_group_activations(self, x: torch.Tensor) -> torch.Tensor:
         """
@@ -436,6 +822,26 @@ class OptimizedGroupEquivariantImageCanonicalization(
         Returns:
             torch.Tensor: The group activations.
         """
+        group_activations, canonicalization_info = self.get_group_activations_and_info(
+            x
+        )
+        self.canonicalization_info_dict = canonicalization_info
+        return group_activations
+
+    def get_group_activations_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[torch.Tensor, Dict[str, Any]]:
+        """
+        Gets the group activations for the input image, along with the output vectors
+        of the canonicalization network that are needed for the optimization specific loss.
+
+        Args:
+            x (torch.Tensor): The input image.
+
+        Returns:
+            torch.Tensor: The group activations.
+            dict: The output vectors of the canonicalization network.
+        """
         x = self.transformations_before_canonicalization_network_forward(x)
         x_augmented = self.group_augment(
             x
@@ -443,13 +849,13 @@ class OptimizedGroupEquivariantImageCanonicalization(
         vector_out = self.canonicalization_network(
             x_augmented
         )  # size (batch_size * group_size, reference_vector_size)
-        self.canonicalization_info_dict = {"vector_out": vector_out}
+        canonicalization_info = {"vector_out": vector_out}
 
         if self.artifact_err_wt:
             # select a random rotation for each image in the batch
             rotation_indices = torch.randint(
                 0, self.num_rotations, (x_augmented.shape[0],)
-            ).to(self.device)
+            ).to(x.device)
 
             # apply the rotation degree to the images
             x_dummy = self.pad_group_augment(x_augmented)
@@ -468,10 +874,38 @@ class OptimizedGroupEquivariantImageCanonicalization(
             vector_out_dummy = self.canonicalization_network(
                 x_dummy
             )  # size (batch_size * group_size, reference_vector_size)
-            self.canonicalization_info_dict.update(
-                {"vector_out_dummy": vector_out_dummy}
-            )
+            canonicalization_info["vector_out_dummy"] = vector_out_dummy
+
+        group_activations = self.get_group_activations_from_vectors(vector_out)
+        return group_activations, canonicalization_info
+
+    def get_inference_group_activations(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Gets the group activations for the input image, without the output vectors of the
+        canonicalization network and the artifact error that are only needed for training.
+
+        Args:
+            x (torch.Tensor): The input image.
+
+        Returns:
+            torch.Tensor: The group activations.
+        """
+        x = self.transformations_before_canonicalization_network_forward(x)
+        vector_out = self.canonicalization_network(self.group_augment(x))
+        return self.get_group_activations_from_vectors(vector_out)
+
+    def get_group_activations_from_vectors(
+        self, vector_out: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Gets the group activations from the output vectors of the canonicalization network for the whole orbit.
+
+        Args:
+            vector_out (torch.Tensor): The output vectors of size (group_size * batch_size, reference_vector_size).
 
+        Returns:
+            torch.Tensor: The group activations of size (batch_size, group_size).
+        """
         scalar_out = F.cosine_similarity(
             self.reference_vector.repeat(vector_out.shape[0], 1), vector_out
         )  # size (batch_size * group_size, 1)
@@ -480,19 +914,28 @@ class OptimizedGroupEquivariantImageCanonicalization(
         ).T  # size (batch_size, group_size)
         return group_activations
 
-    def get_optimization_specific_loss(self) -> torch.Tensor:
+    def get_optimization_specific_loss(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> torch.Tensor:
         """
         Gets the loss specific to the optimization process.
 
+        Args:
+            canonicalization_result (CanonicalizationResult, optional): Result returned by canonicalize_stateless.
+                If not given, the information stored by the last call to canonicalize is used.
+
         Returns:
             torch.Tensor: The loss.
         """
-        vectors = self.canonicalization_info_dict["vector_out"]
+        canonicalization_info_dict = self.get_canonicalization_info_dict(
+            canonicalization_result
+        )
+        vectors = canonicalization_info_dict["vector_out"]
 
         # compute error to reduce rotation artifacts
         rotation_artifact_error = 0
         if self.artifact_err_wt:
-            vectors_dummy = self.canonicalization_info_dict["vector_out_dummy"]
+            vectors_dummy = canonicalization_info_dict["vector_out_dummy"]
             rotation_artifact_error = torch.nn.functional.mse_loss(
                 vectors_dummy, vectors
             )  # type: ignore
@@ -502,9 +945,8 @@ class OptimizedGroupEquivariantImageCanonicalization(
             (1, 0, 2)
         )  # (batch_size, group_size, vector_out_size)
         distances = vectors @ vectors.permute((0, 2, 1))
-        mask = 1.0 - torch.eye(self.num_group).to(
-            self.device
-        )  # (group_size, group_size)
+        # (group_size, group_size)
+        mask = self.group_off_diagonal_mask.to(vectors.dtype)
 
         return (
             torch.abs(distances * mask).mean()
@@ -1,29 +1,34 @@
-from equiadapt.images.canonicalization_networks import (
-    custom_equivariant_networks,
-    custom_group_equivariant_layers,
-    custom_nonequivariant_networks,
-    escnn_networks,
-)
-from equiadapt.images.canonicalization_networks.custom_equivariant_networks import (
-    CustomEquivariantNetwork,
-)
-from equiadapt.images.canonicalization_networks.custom_group_equivariant_layers import (
-    RotationEquivariantConv,
-    RotationEquivariantConvLift,
-    RotoReflectionEquivariantConv,
-    RotoReflectionEquivariantConvLift,
-)
-from equiadapt.images.canonicalization_networks.custom_nonequivariant_networks import (
-    ConvNetwork,
-    ResNet18Network,
-)
-from equiadapt.images.canonicalization_networks.escnn_networks import (
-    ESCNNEquivariantNetwork,
-    ESCNNSteerableNetwork,
-    ESCNNWideBasic,
-    ESCNNWideBottleneck,
-    ESCNNWRNEquivariantNetwork,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.images.canonicalization_networks import (
+        custom_equivariant_networks,
+        custom_group_equivariant_layers,
+        custom_nonequivariant_networks,
+        escnn_networks,
+    )
+    from equiadapt.images.canonicalization_networks.custom_equivariant_networks import (
+        CustomEquivariantNetwork,
+    )
+    from equiadapt.images.canonicalization_networks.custom_group_equivariant_layers import (
+        RotationEquivariantConv,
+        RotationEquivariantConvLift,
+        RotoReflectionEquivariantConv,
+        RotoReflectionEquivariantConvLift,
+    )
+    from equiadapt.images.canonicalization_networks.custom_nonequivariant_networks import (
+        ConvNetwork,
+        ResNet18Network,
+    )
+    from equiadapt.images.canonicalization_networks.escnn_networks import (
+        ESCNNEquivariantNetwork,
+        ESCNNSteerableNetwork,
+        ESCNNWideBasic,
+        ESCNNWideBottleneck,
+        ESCNNWRNEquivariantNetwork,
+    )
 
 __all__ = [
     "ConvNetwork",
@@ -43,3 +48,27 @@ __all__ = [
     "custom_nonequivariant_networks",
     "escnn_networks",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=[
+        "custom_equivariant_networks",
+        "custom_group_equivariant_layers",
+        "custom_nonequivariant_networks",
+        "escnn_networks",
+    ],
+    attributes={
+        "CustomEquivariantNetwork": "equiadapt.images.canonicalization_networks.custom_equivariant_networks",
+        "RotationEquivariantConv": "equiadapt.images.canonicalization_networks.custom_group_equivariant_layers",
+        "RotationEquivariantConvLift": "equiadapt.images.canonicalization_networks.custom_group_equivariant_layers",
+        "RotoReflectionEquivariantConv": "equiadapt.images.canonicalization_networks.custom_group_equivariant_layers",
+        "RotoReflectionEquivariantConvLift": "equiadapt.images.canonicalization_networks.custom_group_equivariant_layers",
+        "ConvNetwork": "equiadapt.images.canonicalization_networks.custom_nonequivariant_networks",
+        "ResNet18Network": "equiadapt.images.canonicalization_networks.custom_nonequivariant_networks",
+        "ESCNNEquivariantNetwork": "equiadapt.images.canonicalization_networks.escnn_networks",
+        "ESCNNSteerableNetwork": "equiadapt.images.canonicalization_networks.escnn_networks",
+        "ESCNNWideBasic": "equiadapt.images.canonicalization_networks.escnn_networks",
+        "ESCNNWideBottleneck": "equiadapt.images.canonicalization_networks.escnn_networks",
+        "ESCNNWRNEquivariantNetwork": "equiadapt.images.canonicalization_networks.escnn_networks",
+    },
+)
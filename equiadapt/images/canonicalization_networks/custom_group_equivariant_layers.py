@@ -1,12 +1,94 @@
 import math
+from typing import Any, Optional, Tuple, TypeVar
 
 import kornia as K
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from equiadapt.images.utils import rotate_images
 
-class RotationEquivariantConvLift(nn.Module):
+T = TypeVar("T", bound="CachedFilterBankConv")
+
+
+class CachedFilterBankConv(nn.Module):
+    """
+    This class is the base of the group equivariant convolutional layers, which expand their weights into a filter bank.
+
+    Building the filter bank (rotating, reflecting and permuting the weights) is the same work on every call
+    as long as the weights do not change. In eval mode, and when no gradient is required, the filter bank is
+    cached and reused until the parameters are modified (tracked through their version counters), the layer is
+    put back in training mode or a state dict is loaded.
+
+    Methods:
+        __init__: Initializes the CachedFilterBankConv instance.
+        get_filter_bank: Builds the filter bank from the weights of the layer.
+        get_cached_filter_bank: Returns the filter bank, reusing the cached one when possible.
+        clear_filter_bank_cache: Drops the cached filter bank.
+        train: Sets the layer in training or evaluation mode and drops the cached filter bank.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.filter_bank_cache: Optional[torch.Tensor] = None
+        self.filter_bank_cache_key: Optional[Tuple] = None
+
+    def get_filter_bank(self) -> torch.Tensor:
+        """
+        Builds the filter bank from the weights of the layer.
+
+        Returns:
+            torch.Tensor: The filter bank passed to F.conv2d.
+        """
+        raise NotImplementedError("get_filter_bank method is not implemented")
+
+    def get_cached_filter_bank(self) -> torch.Tensor:
+        """
+        Returns the filter bank, reusing the cached one when the layer is in eval mode, no gradient is required
+        and the parameters have not changed since it was built.
+
+        Returns:
+            torch.Tensor: The filter bank passed to F.conv2d.
+        """
+        parameters = list(self.parameters(recurse=False))
+        if self.training or (
+            torch.is_grad_enabled() and any(p.requires_grad for p in parameters)
+        ):
+            return self.get_filter_bank()
+
+        # in-place updates bump the version counter, and moving the layer changes the storage
+        cache_key = tuple(
+            (p.data_ptr(), p._version, p.device, p.dtype) for p in parameters
+        )
+        if self.filter_bank_cache is None or cache_key != self.filter_bank_cache_key:
+            self.filter_bank_cache = self.get_filter_bank()
+            self.filter_bank_cache_key = cache_key
+        return self.filter_bank_cache
+
+    def clear_filter_bank_cache(self) -> None:
+        """Drops the cached filter bank."""
+        self.filter_bank_cache = None
+        self.filter_bank_cache_key = None
+
+    def train(self: T, mode: bool = True) -> T:
+        """
+        Sets the layer in training or evaluation mode and drops the cached filter bank.
+
+        Args:
+            mode (bool, optional): Whether to set training mode. Defaults to True.
+
+        Returns:
+            CachedFilterBankConv: The layer itself.
+        """
+        self.clear_filter_bank_cache()
+        return super().train(mode)
+
+    def _load_from_state_dict(self, *args: Any, **kwargs: Any) -> None:
+        self.clear_filter_bank_cache()
+        super()._load_from_state_dict(*args, **kwargs)
+
+
+class RotationEquivariantConvLift(CachedFilterBankConv):
     """
     This class represents a rotation equivariant convolutional layer with lifting.
 
@@ -15,6 +97,7 @@ class RotationEquivariantConvLift(nn.Module):
     Methods:
         __init__: Initializes the RotationEquivariantConvLift instance.
         get_rotated_weights: Returns the weights of the layer after rotation.
+        get_filter_bank: Returns the rotated weights used in the forward pass.
         forward: Performs a forward pass through the layer.
     """
 
@@ -28,6 +111,7 @@ class RotationEquivariantConvLift(nn.Module):
         padding: int = 0,
         bias: bool = True,
         device: str = "cuda",
+        rotation_backend: str = "auto",
     ):
         """
         Initializes the RotationEquivariantConvLift instance.
@@ -41,6 +125,8 @@ class RotationEquivariantConvLift(nn.Module):
             padding (int, optional): The padding of the convolution. Defaults to 0.
             bias (bool, optional): Whether to include a bias term. Defaults to True.
             device (str, optional): The device to run the layer on. Defaults to "cuda".
+            rotation_backend (str, optional): How to rotate the filters, one of "auto", "exact" or "interpolate".
+                With "auto", the filters of C2 and C4 (and D2 and D4) are rotated with torch.rot90. Defaults to "auto".
         """
         super().__init__()
         self.weights = nn.Parameter(
@@ -58,6 +144,7 @@ class RotationEquivariantConvLift(nn.Module):
         self.padding = padding
         self.num_rotations = num_rotations
         self.kernel_size = kernel_size
+        self.rotation_backend = rotation_backend
 
     def get_rotated_weights(
         self, weights: torch.Tensor, num_rotations: int = 4
@@ -74,11 +161,13 @@ class RotationEquivariantConvLift(nn.Module):
         """
         device = weights.device
         weights = weights.flatten(0, 1).unsqueeze(0).repeat(num_rotations, 1, 1, 1)
-        rotated_weights = K.geometry.rotate(
+        rotated_weights = rotate_images(
             weights,
             torch.linspace(0.0, 360.0, steps=num_rotations + 1, dtype=torch.float32)[
                 :num_rotations
             ].to(device),
+            num_rotations,
+            self.rotation_backend,
         )
         rotated_weights = rotated_weights.reshape(
             self.num_rotations,
@@ -89,6 +178,15 @@ class RotationEquivariantConvLift(nn.Module):
         ).transpose(0, 1)
         return rotated_weights.flatten(0, 1)
 
+    def get_filter_bank(self) -> torch.Tensor:
+        """
+        Returns the rotated weights used in the forward pass.
+
+        Returns:
+            torch.Tensor: The rotated weights.
+        """
+        return self.get_rotated_weights(self.weights, self.num_rotations)
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
         Performs a forward pass through the layer.
@@ -100,7 +198,7 @@ class RotationEquivariantConvLift(nn.Module):
             torch.Tensor: The output of the layer. It has the shape (batch_size, out_channels, num_rotations, height, width).
         """
         batch_size = x.shape[0]
-        rotated_weights = self.get_rotated_weights(self.weights, self.num_rotations)
+        rotated_weights = self.get_cached_filter_bank()
         # shape (out_channels * num_rotations, in_channels, kernel_size, kernel_size)
         x = F.conv2d(x, rotated_weights, stride=self.stride, padding=self.padding)
         x = x.reshape(
@@ -111,7 +209,7 @@ class RotationEquivariantConvLift(nn.Module):
         return x
 
 
-class RotoReflectionEquivariantConvLift(nn.Module):
+class RotoReflectionEquivariantConvLift(CachedFilterBankConv):
     """
     This class represents a roto-reflection equivariant convolutional layer with lifting.
 
@@ -120,6 +218,7 @@ class RotoReflectionEquivariantConvLift(nn.Module):
     Methods:
         __init__: Initializes the RotoReflectionEquivariantConvLift instance.
         get_rotoreflected_weights: Returns the weights of the layer after rotation, reflection, and permutation.
+        get_filter_bank: Returns the roto-reflected weights used in the forward pass.
         forward: Performs a forward pass through the layer.
     """
 
@@ -133,6 +232,7 @@ class RotoReflectionEquivariantConvLift(nn.Module):
         padding: int = 0,
         bias: bool = True,
         device: str = "cuda",
+        rotation_backend: str = "auto",
     ):
         """
         Initializes the RotoReflectionEquivariantConvLift instance.
@@ -146,6 +246,8 @@ class RotoReflectionEquivariantConvLift(nn.Module):
             padding (int, optional): The padding of the convolution. Defaults to 0.
             bias (bool, optional): Whether to include a bias term. Defaults to True.
             device (str, optional): The device to run the layer on. Defaults to "cuda".
+            rotation_backend (str, optional): How to rotate the filters, one of "auto", "exact" or "interpolate".
+                With "auto", the filters of C2 and C4 (and D2 and D4) are rotated with torch.rot90. Defaults to "auto".
         """
         super().__init__()
         num_group_elements = 2 * num_rotations
@@ -164,6 +266,7 @@ class RotoReflectionEquivariantConvLift(nn.Module):
         self.padding = padding
         self.num_rotations = num_rotations
         self.kernel_size = kernel_size
+        self.rotation_backend = rotation_backend
         self.num_group_elements = num_group_elements
 
     def get_rotoreflected_weights(
@@ -181,11 +284,13 @@ class RotoReflectionEquivariantConvLift(nn.Module):
         """
         device = weights.device
         weights = weights.flatten(0, 1).unsqueeze(0).repeat(num_rotations, 1, 1, 1)
-        rotated_weights = K.geometry.rotate(
+        rotated_weights = rotate_images(
             weights,
             torch.linspace(0.0, 360.0, steps=num_rotations + 1, dtype=torch.float32)[
                 :num_rotations
             ].to(device),
+            num_rotations,
+            self.rotation_backend,
         )
         reflected_weights = K.geometry.hflip(rotated_weights)
         rotoreflected_weights = torch.cat([rotated_weights, reflected_weights], dim=0)
@@ -198,6 +303,15 @@ class RotoReflectionEquivariantConvLift(nn.Module):
         ).transpose(0, 1)
         return rotoreflected_weights.flatten(0, 1)
 
+    def get_filter_bank(self) -> torch.Tensor:
+        """
+        Returns the roto-reflected weights used in the forward pass.
+
+        Returns:
+            torch.Tensor: The roto-reflected weights.
+        """
+        return self.get_rotoreflected_weights(self.weights, self.num_rotations)
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
         Performs a forward pass through the layer.
@@ -209,9 +323,7 @@ class RotoReflectionEquivariantConvLift(nn.Module):
             torch.Tensor: The output of the layer. It has the shape (batch_size, out_channels, num_group_elements, height, width).
         """
         batch_size = x.shape[0]
-        rotoreflected_weights = self.get_rotoreflected_weights(
-            self.weights, self.num_rotations
-        )
+        rotoreflected_weights = self.get_cached_filter_bank()
         # shape (out_channels * num_group_elements, in_channels, kernel_size, kernel_size)
         x = F.conv2d(x, rotoreflected_weights, stride=self.stride, padding=self.padding)
         x = x.reshape(
@@ -226,7 +338,7 @@ class RotoReflectionEquivariantConvLift(nn.Module):
         return x
 
 
-class RotationEquivariantConv(nn.Module):
+class RotationEquivariantConv(CachedFilterBankConv):
     """
     This class represents a rotation equivariant convolutional layer.
 
@@ -235,9 +347,12 @@ class RotationEquivariantConv(nn.Module):
     Methods:
         __init__: Initializes the RotationEquivariantConv instance.
         get_rotated_permuted_weights: Returns the weights of the layer after rotation and permutation.
+        get_filter_bank: Returns the rotated and permuted weights used in the forward pass.
         forward: Performs a forward pass through the layer.
     """
 
+    permute_indices_along_group: torch.Tensor
+
     def __init__(
         self,
         in_channels: int,
@@ -248,6 +363,7 @@ class RotationEquivariantConv(nn.Module):
         padding: int = 0,
         bias: bool = True,
         device: str = "cuda",
+        rotation_backend: str = "auto",
     ):
         """
         Initializes the RotationEquivariantConv instance.
@@ -261,6 +377,8 @@ class RotationEquivariantConv(nn.Module):
             padding (int, optional): The padding of the convolution. Defaults to 0.
             bias (bool, optional): Whether to include a bias term. Defaults to True.
             device (str, optional): The device to run the layer on. Defaults to "cuda".
+            rotation_backend (str, optional): How to rotate the filters, one of "auto", "exact" or "interpolate".
+                With "auto", the filters of C2 and C4 (and D2 and D4) are rotated with torch.rot90. Defaults to "auto".
         """
         super().__init__()
         self.weights = nn.Parameter(
@@ -280,17 +398,15 @@ class RotationEquivariantConv(nn.Module):
         self.padding = padding
         self.num_rotations = num_rotations
         self.kernel_size = kernel_size
-        indices = (
-            torch.arange(num_rotations)
-            .view((1, 1, num_rotations, 1, 1))
-            .repeat(
-                num_rotations, out_channels * in_channels, 1, kernel_size, kernel_size
-            )
+        self.rotation_backend = rotation_backend
+        # row i holds the cyclic shift of the group axis for the i-th rotation of the filters,
+        # it is broadcast over the channels and the kernel when indexing the weights
+        indices = torch.arange(num_rotations, device=device)
+        self.register_buffer(
+            "permute_indices_along_group",
+            (indices[None, :] - indices[:, None]) % num_rotations,
+            persistent=False,
         )
-        self.permute_indices_along_group = (
-            (indices - torch.arange(num_rotations)[:, None, None, None, None])
-            % num_rotations
-        ).to(device)
         self.angle_list = torch.linspace(
             0.0, 360.0, steps=num_rotations + 1, dtype=torch.float32
         )[:num_rotations].to(device)
@@ -308,11 +424,15 @@ class RotationEquivariantConv(nn.Module):
         Returns:
             torch.Tensor: The weights after rotation and permutation.
         """
-        weights = weights.flatten(0, 1).unsqueeze(0).repeat(num_rotations, 1, 1, 1, 1)
-        permuted_weights = torch.gather(weights, 2, self.permute_indices_along_group)
-        rotated_permuted_weights = K.geometry.rotate(
+        # shape (num_rotations, out_channels * in_channels, num_rotations, kernel_size, kernel_size)
+        permuted_weights = weights.flatten(0, 1)[
+            :, self.permute_indices_along_group
+        ].transpose(0, 1)
+        rotated_permuted_weights = rotate_images(
             permuted_weights.flatten(1, 2),
             self.angle_list,
+            self.num_rotations,
+            self.rotation_backend,
         )
         rotated_permuted_weights = (
             rotated_permuted_weights.reshape(
@@ -333,6 +453,15 @@ class RotationEquivariantConv(nn.Module):
         )
         return rotated_permuted_weights
 
+    def get_filter_bank(self) -> torch.Tensor:
+        """
+        Returns the rotated and permuted weights used in the forward pass.
+
+        Returns:
+            torch.Tensor: The rotated and permuted weights.
+        """
+        return self.get_rotated_permuted_weights(self.weights, self.num_rotations)
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
         Performs a forward pass through the layer.
@@ -346,9 +475,7 @@ class RotationEquivariantConv(nn.Module):
         batch_size = x.shape[0]
         x = x.flatten(1, 2)
         # shape (batch_size, in_channels * num_rotations, height, width)
-        rotated_permuted_weights = self.get_rotated_permuted_weights(
-            self.weights, self.num_rotations
-        )
+        rotated_permuted_weights = self.get_cached_filter_bank()
         # shape (out_channels * num_rotations, in_channels * num_rotations, kernal_size, kernal_size)
         x = F.conv2d(
             x, rotated_permuted_weights, stride=self.stride, padding=self.padding
@@ -361,7 +488,7 @@ class RotationEquivariantConv(nn.Module):
         return x
 
 
-class RotoReflectionEquivariantConv(nn.Module):
+class RotoReflectionEquivariantConv(CachedFilterBankConv):
     """
     This class represents a roto-reflection equivariant convolutional layer.
 
@@ -370,9 +497,12 @@ class RotoReflectionEquivariantConv(nn.Module):
     Methods:
         __init__: Initializes the RotoReflectionEquivariantConv instance.
         get_rotoreflected_permuted_weights: Returns the weights of the layer after rotation, reflection, and permutation.
+        get_filter_bank: Returns the roto-reflected and permuted weights used in the forward pass.
         forward: Performs a forward pass through the layer.
     """
 
+    permute_indices: torch.Tensor
+
     def __init__(
         self,
         in_channels: int,
@@ -383,6 +513,7 @@ class RotoReflectionEquivariantConv(nn.Module):
         padding: int = 0,
         bias: bool = True,
         device: str = "cuda",
+        rotation_backend: str = "auto",
     ):
         """
         Initializes the RotoReflectionEquivariantConv instance.
@@ -396,6 +527,8 @@ class RotoReflectionEquivariantConv(nn.Module):
             padding (int, optional): The padding of the convolution. Defaults to 0.
             bias (bool, optional): Whether to include a bias term. Defaults to True.
             device (str, optional): The device to run the layer on. Defaults to "cuda".
+            rotation_backend (str, optional): How to rotate the filters, one of "auto", "exact" or "interpolate".
+                With "auto", the filters of C2 and C4 (and D2 and D4) are rotated with torch.rot90. Defaults to "auto".
         """
         super().__init__()
         num_group_elements: int = 2 * num_rotations
@@ -416,37 +549,36 @@ class RotoReflectionEquivariantConv(nn.Module):
         self.padding = padding
         self.num_rotations = num_rotations
         self.kernel_size = kernel_size
+        self.rotation_backend = rotation_backend
         self.num_group_elements = num_group_elements
-        indices = (
-            torch.arange(num_rotations)
-            .view((1, 1, num_rotations, 1, 1))
-            .repeat(
-                num_rotations, out_channels * in_channels, 1, kernel_size, kernel_size
-            )
-        )
-        self.permute_indices_along_group = (
-            indices - torch.arange(num_rotations)[:, None, None, None, None]
+        # (num_group_elements x num_group_elements) permutation of the group axis for each
+        # roto-reflection of the filters, broadcast over the channels and the kernel
+        indices = torch.arange(num_rotations, device=device)
+        permute_indices_along_group = (
+            indices[None, :] - indices[:, None]
         ) % num_rotations
-        self.permute_indices_along_group_inverse = (
-            indices + torch.arange(num_rotations)[:, None, None, None, None]
+        permute_indices_along_group_inverse = (
+            indices[None, :] + indices[:, None]
         ) % num_rotations
-        self.permute_indices_upper_half = torch.cat(
+        permute_indices_upper_half = torch.cat(
             [
-                self.permute_indices_along_group,
-                self.permute_indices_along_group_inverse + num_rotations,
+                permute_indices_along_group,
+                permute_indices_along_group_inverse + num_rotations,
             ],
-            dim=2,
+            dim=1,
         )
-        self.permute_indices_lower_half = torch.cat(
+        permute_indices_lower_half = torch.cat(
             [
-                self.permute_indices_along_group_inverse + num_rotations,
-                self.permute_indices_along_group,
+                permute_indices_along_group_inverse + num_rotations,
+                permute_indices_along_group,
             ],
-            dim=2,
+            dim=1,
+        )
+        self.register_buffer(
+            "permute_indices",
+            torch.cat([permute_indices_upper_half, permute_indices_lower_half], dim=0),
+            persistent=False,
         )
-        self.permute_indices = torch.cat(
-            [self.permute_indices_upper_half, self.permute_indices_lower_half], dim=0
-        ).to(device)
         self.angle_list = torch.cat(
             [
                 torch.linspace(
@@ -471,15 +603,14 @@ class RotoReflectionEquivariantConv(nn.Module):
         Returns:
             torch.Tensor: The weights after rotation, reflection, and permutation.
         """
-        weights = (
-            weights.flatten(0, 1)
-            .unsqueeze(0)
-            .repeat(self.num_group_elements, 1, 1, 1, 1)
-        )
         # shape (num_group_elements, out_channels * in_channels, num_group_elements, kernel_size, kernel_size)
-        permuted_weights = torch.gather(weights, 2, self.permute_indices)
-        rotated_permuted_weights = K.geometry.rotate(
-            permuted_weights.flatten(1, 2), self.angle_list
+        permuted_weights = weights.flatten(0, 1)[:, self.permute_indices]
+        permuted_weights = permuted_weights.transpose(0, 1)
+        rotated_permuted_weights = rotate_images(
+            permuted_weights.flatten(1, 2),
+            self.angle_list,
+            self.num_rotations,
+            self.rotation_backend,
         )
         rotoreflected_permuted_weights = torch.cat(
             [
@@ -506,6 +637,15 @@ class RotoReflectionEquivariantConv(nn.Module):
         )
         return rotoreflected_permuted_weights
 
+    def get_filter_bank(self) -> torch.Tensor:
+        """
+        Returns the roto-reflected and permuted weights used in the forward pass.
+
+        Returns:
+            torch.Tensor: The roto-reflected and permuted weights.
+        """
+        return self.get_rotoreflected_permuted_weights(self.weights, self.num_rotations)
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
         Performs a forward pass through the layer.
@@ -519,9 +659,7 @@ class RotoReflectionEquivariantConv(nn.Module):
         batch_size = x.shape[0]
         x = x.flatten(1, 2)
         # shape (batch_size, in_channels * num_group_elements, height, width)
-        rotoreflected_permuted_weights = self.get_rotoreflected_permuted_weights(
-            self.weights, self.num_rotations
-        )
+        rotoreflected_permuted_weights = self.get_cached_filter_bank()
         # shape (out_channels * num_group_elements, in_channels * num_group_elements, kernel_size, kernel_size)
         x = F.conv2d(
             x, rotoreflected_permuted_weights, stride=self.stride, padding=self.padding
@@ -1,10 +1,199 @@
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import kornia as K
 import torch
 from torchvision import transforms
 
 
+# "interpolate" always warps with K.geometry.rotate, "exact" permutes pixels whenever
+# the group allows it, and "auto" does the latter unless the angles require a gradient
+ROTATION_BACKENDS = ("auto", "exact", "interpolate")
+
+
+def supports_exact_rotations(num_rotations: int, height: int, width: int) -> bool:
+    """
+    Checks whether the rotations of a cyclic (or dihedral) group are pixel permutations of the images.
+
+    This is the case for C1, C2 and C4 (and D1, D2 and D4) acting on square images.
+
+    Args:
+        num_rotations (int): The number of rotations in the group.
+        height (int): The height of the images.
+        width (int): The width of the images.
+
+    Returns:
+        bool: Whether the rotations can be applied with torch.rot90.
+    """
+    return num_rotations in (1, 2, 4) and height == width
+
+
+def use_exact_rotations(
+    x: torch.Tensor,
+    num_rotations: int,
+    backend: str = "auto",
+    angles: Optional[torch.Tensor] = None,
+) -> bool:
+    """
+    Decides whether the rotations of the images should permute pixels instead of interpolating.
+
+    Args:
+        x (torch.Tensor): The images to rotate.
+        num_rotations (int): The number of rotations in the group.
+        backend (str, optional): One of "auto", "exact" or "interpolate". Defaults to "auto".
+        angles (Optional[torch.Tensor], optional): The rotation angles, if they are not constant. Defaults to None.
+
+    Returns:
+        bool: Whether to use the exact (rot90/flip) path.
+    """
+    if backend not in ROTATION_BACKENDS:
+        raise ValueError(f"rotation backend must be one of {ROTATION_BACKENDS}")
+    if backend == "interpolate" or not supports_exact_rotations(
+        num_rotations, x.shape[-2], x.shape[-1]
+    ):
+        return False
+    if backend == "exact" or angles is None:
+        return True
+    # permuting pixels is not differentiable with respect to the angles
+    return not (torch.is_grad_enabled() and angles.requires_grad)
+
+
+def get_rot90_permutations(
+    size: int, device: Optional[torch.device] = None
+) -> torch.Tensor:
+    """
+    Returns the pixel permutations of the rotations by multiples of 90 degrees of square images, with and without a horizontal flip.
+
+    Args:
+        size (int): The height (and width) of the images.
+        device (Optional[torch.device], optional): The device of the permutations. Defaults to None.
+
+    Returns:
+        torch.Tensor: The permutations of shape (8, size * size). Row `4 * reflect + steps` holds, for every
+            pixel of `torch.rot90(x.flip(-1) if reflect else x, steps)`, the flattened index of the pixel of x it comes from.
+    """
+    pixel_indices = torch.arange(size * size, device=device).view(size, size)
+    return torch.stack(
+        [
+            torch.rot90(indices, steps, dims=(0, 1))
+            for indices in (pixel_indices, pixel_indices.flip(-1))
+            for steps in range(4)
+        ]
+    ).flatten(1)
+
+
+def rot90_images(
+    x: torch.Tensor, angles: torch.Tensor, reflect: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """
+    Rotates each image counter-clockwise by its angle, after an optional horizontal flip, by permuting its pixels.
+
+    This matches K.geometry.rotate (and K.geometry.hflip) without any interpolation, but only for angles that are
+    multiples of 90 degrees and square images. The whole batch, identities included, goes through a single gather,
+    so the call never waits on the device to decide which images to transform.
+
+    Args:
+        x (torch.Tensor): The images of shape (batch_size, channels, size, size).
+        angles (torch.Tensor): The rotation angle in degrees for each image.
+        reflect (Optional[torch.Tensor], optional): The reflection indicator for each image. Defaults to None.
+
+    Returns:
+        torch.Tensor: The transformed images.
+    """
+    transform_ids = torch.round(angles.detach().reshape(-1) / 90.0).long() % 4
+    if reflect is not None:
+        transform_ids = transform_ids + 4 * (reflect.detach().reshape(-1) > 0.5).long()
+
+    batch_size, channels = x.shape[:2]
+    permutations = get_rot90_permutations(x.shape[-1], x.device)[transform_ids]
+    x_out = x.flatten(-2).gather(
+        -1, permutations[:, None, :].expand(batch_size, channels, -1)
+    )
+    return x_out.reshape(x.shape)
+
+
+def get_affine_grid(theta: torch.Tensor, size: List[int]) -> torch.Tensor:
+    """
+    Builds the sampling grids of a batch of affine maps, like `F.affine_grid` with `align_corners=True`.
+
+    The grids are a matrix product with a constant base grid, which exports to ONNX at any opset
+    (the AffineGrid operator only exists from opset 20).
+
+    Args:
+        theta (torch.Tensor): The affine maps of shape (batch_size, 2, 3).
+        size (List[int]): The size (batch_size, channels, height, width) of the output images.
+
+    Returns:
+        torch.Tensor: The sampling grids of shape (batch_size, height, width, 2).
+    """
+    height, width = size[-2], size[-1]
+    base_x = torch.linspace(-1.0, 1.0, width, dtype=theta.dtype, device=theta.device)
+    base_y = torch.linspace(-1.0, 1.0, height, dtype=theta.dtype, device=theta.device)
+    base_grid = torch.stack(
+        [
+            base_x.expand(height, width),
+            base_y[:, None].expand(height, width),
+            torch.ones_like(base_x).expand(height, width),
+        ],
+        dim=-1,
+    )  # (height, width, 3)
+    grid = torch.matmul(base_grid.reshape(1, -1, 3), theta.transpose(1, 2))
+    return grid.reshape(-1, height, width, 2)
+
+
+def rotate_images(
+    x: torch.Tensor, angles: torch.Tensor, num_rotations: int, backend: str = "auto"
+) -> torch.Tensor:
+    """
+    Rotates each image counter-clockwise by its angle, choosing between pixel permutations and interpolation.
+
+    Args:
+        x (torch.Tensor): The images of shape (batch_size, channels, height, width).
+        angles (torch.Tensor): The rotation angle in degrees for each image.
+        num_rotations (int): The number of rotations in the group the angles belong to.
+        backend (str, optional): One of "auto", "exact" or "interpolate". Defaults to "auto".
+
+    Returns:
+        torch.Tensor: The rotated images.
+    """
+    if use_exact_rotations(x, num_rotations, backend, angles):
+        return rot90_images(x, angles)
+    return K.geometry.rotate(x, angles)
+
+
+def rotate_and_reflect_images(
+    x: torch.Tensor,
+    angles: torch.Tensor,
+    num_rotations: int,
+    reflect: Optional[torch.Tensor] = None,
+    backend: str = "auto",
+) -> torch.Tensor:
+    """
+    Rotates each image counter-clockwise by its angle, then flips it horizontally if its reflection indicator is set.
+
+    Args:
+        x (torch.Tensor): The images of shape (batch_size, channels, height, width).
+        angles (torch.Tensor): The rotation angle in degrees for each image.
+        num_rotations (int): The number of rotations in the group the angles belong to.
+        reflect (Optional[torch.Tensor], optional): The reflection indicator for each image. Defaults to None.
+        backend (str, optional): One of "auto", "exact" or "interpolate". Defaults to "auto".
+
+    Returns:
+        torch.Tensor: The transformed images.
+    """
+    if use_exact_rotations(x, num_rotations, backend, angles):
+        if reflect is None:
+            return rot90_images(x, angles)
+        # flipping after a rotation is the same as flipping before the opposite rotation
+        is_reflected = reflect.detach() > 0.5
+        return rot90_images(x, torch.where(is_reflected, -angles, angles), reflect)
+
+    x = K.geometry.rotate(x, angles)
+    if reflect is None:
+        return x
+    reflect_indicator = reflect[:, None, None, None]
+    return (1 - reflect_indicator) * x + reflect_indicator * K.geometry.hflip(x)
+
+
 def roll_by_gather(feature_map: torch.Tensor, shifts: torch.Tensor) -> torch.Tensor:
     """
     Shifts the feature map along the group dimension by the specified shifts.
@@ -34,38 +223,42 @@ def get_action_on_image_features(
     group_info_dict: dict,
     group_element_dict: dict,
     induced_rep_type: str = "regular",
+    rotation_backend: str = "auto",
 ) -> torch.Tensor:
     """
     Applies a group action to the feature map.
 
+    The feature map is rotated counter-clockwise by the angle of the group element and then flipped horizontally
+    if the group element has a reflection, which undoes the warp of the image canonicalizers.
+
     Args:
         feature_map (torch.Tensor): The input feature map.
         group_info_dict (dict): A dictionary containing information about the group.
-        group_element_dict (dict): A dictionary containing the group elements.
+        group_element_dict (dict): The group element of each feature map, with the rotation angles in degrees as "rotation" and optionally the reflection indicators as "reflection".
         induced_rep_type (str, optional): The type of induced representation. Defaults to "regular".
+        rotation_backend (str, optional): How to rotate the feature map, one of "auto", "exact" or "interpolate". Defaults to "auto".
 
     Returns:
         torch.Tensor: The feature map after the group action has been applied.
     """
-    num_rotations = group_info_dict["num_rotations"]
-    num_group = group_info_dict["num_group"]
+    # continuous groups have no number of rotations, so their action is always interpolated
+    num_rotations = group_info_dict.get("num_rotations", 0)
     assert len(feature_map.shape) == 4
     batch_size, C, H, W = feature_map.shape
+    angles = group_element_dict["rotation"].reshape(-1)
+    reflect = group_element_dict.get("reflection")
+    if reflect is not None:
+        reflect = reflect.reshape(-1)
     if induced_rep_type == "regular":
+        num_group = group_info_dict["num_group"]
         assert feature_map.shape[1] % num_group == 0
-        angles = group_element_dict["group"]["rotation"]
-        x_out = K.geometry.rotate(feature_map, angles)
-
-        if "reflection" in group_element_dict["group"]:
-            reflect_indicator = group_element_dict["group"]["reflection"]
-            x_out_reflected = K.geometry.hflip(x_out)
-            x_out = x_out * reflect_indicator[:, None, None, None] + x_out_reflected * (
-                1 - reflect_indicator[:, None, None, None]
-            )
+        x_out = rotate_and_reflect_images(
+            feature_map, angles, num_rotations, reflect, rotation_backend
+        )
 
         x_out = x_out.reshape(batch_size, C // num_group, num_group, H, W)
         shift = angles / 360.0 * num_rotations
-        if "reflection" in group_element_dict["group"]:
+        if reflect is not None:
             x_out = torch.cat(
                 [
                     roll_by_gather(x_out[:, :, :num_rotations], shift),
@@ -78,15 +271,9 @@ def get_action_on_image_features(
         x_out = x_out.reshape(batch_size, -1, H, W)
         return x_out
     elif induced_rep_type == "scalar":
-        angles = group_element_dict["group"][0]
-        x_out = K.geometry.rotate(feature_map, angles)
-        if "reflection" in group_element_dict["group"]:
-            reflect_indicator = group_element_dict["group"]["reflection"]
-            x_out_reflected = K.geometry.hflip(x_out)
-            x_out = x_out * reflect_indicator[:, None, None, None] + x_out_reflected * (
-                1 - reflect_indicator[:, None, None, None]
-            )
-        return x_out
+        return rotate_and_reflect_images(
+            feature_map, angles, num_rotations, reflect, rotation_backend
+        )
     elif induced_rep_type == "vector":
         # TODO: Implement the action for vector representation
         raise NotImplementedError("Action for vector representation is not implemented")
@@ -185,3 +372,79 @@ def rotate_boxes(boxes: torch.Tensor, angle: torch.Tensor, width: int) -> torch.
     rotated_boxes = torch.stack([x_min_rot, y_min_rot, x_max_rot, y_max_rot], dim=-1)
 
     return rotated_boxes
+
+
+def transform_targets(
+    targets: List[Dict[str, torch.Tensor]],
+    angles: torch.Tensor,
+    width: int,
+    reflect: Optional[torch.Tensor] = None,
+    num_rotations: Optional[int] = None,
+    backend: str = "auto",
+) -> List[Dict[str, torch.Tensor]]:
+    """
+    Flips (optionally) and rotates clockwise by its angle the boxes and masks of each image, all images at once.
+
+    Each image is transformed as with `flip_boxes`, `flip_masks`, `rotate_boxes(boxes, angle, width)` and
+    `rotate_masks(masks, -angle)`, but the boxes and masks of the whole batch are packed into flat tensors with
+    the index of their image, so that the boxes go through a single vectorized transform and the masks through a
+    single warp, without a loop over the images or a host sync. Rotations by multiples of 90 degrees of square
+    masks are a single pixel gather instead (see `use_exact_rotations` and `rot90_images`).
+
+    Args:
+        targets (List[Dict[str, torch.Tensor]]): The targets of each image, with "boxes" of shape (num_instances, 4)
+            and "masks" of shape (num_instances, height, width).
+        angles (torch.Tensor): The rotation angle in degrees for each image.
+        width (int): The width of the images.
+        reflect (Optional[torch.Tensor], optional): The reflection indicator for each image. Defaults to None.
+        num_rotations (Optional[int], optional): The number of rotations in the group the angles belong to.
+            Defaults to None, which always interpolates the masks.
+        backend (str, optional): One of "auto", "exact" or "interpolate". Defaults to "auto".
+
+    Returns:
+        List[Dict[str, torch.Tensor]]: The transformed targets. The input targets are left unchanged.
+    """
+    num_instances_per_image = [len(target["boxes"]) for target in targets]
+    num_instances = sum(num_instances_per_image)
+    if num_instances == 0:
+        return [dict(target) for target in targets]
+
+    boxes = torch.cat([target["boxes"] for target in targets])
+    masks = torch.cat([target["masks"] for target in targets])
+    batch_index = torch.repeat_interleave(
+        torch.arange(len(targets), device=boxes.device),
+        torch.tensor(num_instances_per_image, device=boxes.device),
+        output_size=num_instances,
+    )
+    # the targets are data, the transform does not need to be differentiable
+    instance_angles = angles.detach().reshape(-1).to(boxes.device)[batch_index]
+    is_reflected = None
+    if reflect is not None:
+        is_reflected = reflect.detach().reshape(-1).to(boxes.device)[batch_index] > 0.5
+
+    # boxes
+    if is_reflected is not None:
+        boxes = torch.where(
+            is_reflected[:, None], flip_boxes(boxes.clone(), width), boxes
+        )
+    boxes = rotate_boxes(boxes, instance_angles.to(boxes.dtype), width)
+
+    # masks
+    if num_rotations is not None and use_exact_rotations(masks, num_rotations, backend):
+        # a single gather permutes the pixels of every mask, identities included
+        masks = rot90_images(masks[:, None], -instance_angles, is_reflected)[:, 0]
+    else:
+        if is_reflected is not None:
+            masks = torch.where(is_reflected[:, None, None], masks.flip(-1), masks)
+        masks = K.geometry.rotate(
+            masks[:, None].float(), -instance_angles.float(), mode="nearest"
+        )[:, 0].to(masks.dtype)
+
+    return [
+        {**target, "boxes": target_boxes, "masks": target_masks}
+        for target, target_boxes, target_masks in zip(
+            targets,
+            boxes.split(num_instances_per_image),
+            masks.split(num_instances_per_image),
+        )
+    ]
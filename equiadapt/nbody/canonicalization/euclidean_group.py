@@ -2,7 +2,11 @@ from typing import Any, Dict, List, Optional, Tuple, Union
 
 import torch
 
-from equiadapt.common.basecanonicalization import ContinuousGroupCanonicalization
+from equiadapt.common.basecanonicalization import (
+    CanonicalizationResult,
+    ContinuousGroupCanonicalization,
+)
+from equiadapt.common.utils import orthonormalize
 
 
 class EuclideanGroupNBody(ContinuousGroupCanonicalization):
@@ -16,13 +20,23 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
     Attributes:
         canonicalization_info_dict (dict): A dictionary containing the group element information.
 
+    Methods:
+        get_groupelement_and_info: Get the group element information without storing anything on the module.
+        get_groupelement: Get the group element information.
+        apply_inverse_group_element: Apply the inverse of the group element to the locations and velocities.
+        canonicalize_stateless: Canonicalize the input data without storing anything on the module.
+        canonicalize_inference: Canonicalize the input data in a form that can be compiled.
+        canonicalize: Canonicalize the input data.
+        invert_canonicalization: Invert the canonicalization on the predicted locations.
+        modified_gram_schmidt: Apply the modified Gram-Schmidt process to the input vectors.
+
     """
 
     def __init__(
         self,
         canonicalization_network: torch.nn.Module,
     ) -> None:
-        super().__init__(canonicalization_network)
+        super().__init__(canonicalization_network, group_rep_dim=3)
 
     def forward(
         self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
@@ -40,7 +54,7 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
         """
         return self.canonicalize(x, None, **kwargs)
 
-    def get_groupelement(
+    def get_groupelement_and_info(  # type: ignore[override]
         self,
         nodes: torch.Tensor,
         loc: torch.Tensor,
@@ -48,9 +62,9 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
         vel: torch.Tensor,
         edge_attr: torch.Tensor,
         charges: torch.Tensor,
-    ) -> Dict[str, torch.Tensor]:
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
         """
-        Get the group element information.
+        Get the group element information without storing anything on the module.
 
         Args:
             nodes: Nodes data.
@@ -61,7 +75,8 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
             charges: Charges data.
 
         Returns:
-            A dictionary containing the group element information.
+            A dictionary containing the group element information and a dictionary
+            containing the canonicalization information.
 
         """
         group_element_dict: Dict[str, torch.Tensor] = {}
@@ -70,42 +85,68 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
         )
         rotation_matrix = self.modified_gram_schmidt(rotation_vectors)
 
-        # Check whether canonicalization_info_dict is already defined
-        if not hasattr(self, "canonicalization_info_dict"):
-            self.canonicalization_info_dict = {}
-
         group_element_dict["rotation_matrix"] = rotation_matrix
         group_element_dict["translation_vectors"] = translation_vectors
         group_element_dict["rotation_matrix_inverse"] = rotation_matrix.transpose(
             1, 2
         )  # Inverse of a rotation matrix is its transpose.
 
-        self.canonicalization_info_dict["group_element"] = group_element_dict
+        canonicalization_info = {
+            "group_element": group_element_dict,
+            "group_element_matrix_representation": rotation_matrix,
+        }
 
-        return group_element_dict
+        return group_element_dict, canonicalization_info
 
-    def canonicalize(
-        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
-    ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    def get_groupelement(  # type: ignore[override]
+        self,
+        nodes: torch.Tensor,
+        loc: torch.Tensor,
+        edges: torch.Tensor,
+        vel: torch.Tensor,
+        edge_attr: torch.Tensor,
+        charges: torch.Tensor,
+    ) -> Dict[str, torch.Tensor]:
         """
-        Canonicalize the input data.
+        Get the group element information.
 
         Args:
-            nodes: Node attributes.
-            targets: Target data.
-            **kwargs: Additional keyword arguments. Includes locs, edges, vel, edge_attr, and charges.
+            nodes: Nodes data.
+            loc: Location data.
+            edges: Edges data.
+            vel: Velocity data.
+            edge_attr: Edge attributes data.
+            charges: Charges data.
 
         Returns:
-            The canonicalized location and velocity.
+            A dictionary containing the group element information.
 
         """
-        self.device = x.device
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(
+            nodes, loc, edges, vel, edge_attr, charges
+        )
+        self.canonicalization_info_dict = canonicalization_info
 
-        loc, edges, vel, edge_attr, charges = kwargs.values()
+        return group_element_dict
 
-        group_element_dict = self.get_groupelement(
-            x, loc, edges, vel, edge_attr, charges
-        )
+    def apply_inverse_group_element(
+        self,
+        loc: torch.Tensor,
+        vel: torch.Tensor,
+        group_element_dict: Dict[str, torch.Tensor],
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Apply the inverse of the group element to the locations and velocities.
+
+        Args:
+            loc: Location data.
+            vel: Velocity data.
+            group_element_dict: The group element information.
+
+        Returns:
+            The canonicalized location and velocity.
+
+        """
         translation_vectors = group_element_dict["translation_vectors"]
         rotation_matrix_inverse = group_element_dict["rotation_matrix_inverse"]
 
@@ -123,13 +164,114 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
 
         return canonical_loc, canonical_vel
 
+    def canonicalize_stateless(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> CanonicalizationResult:
+        """
+        Canonicalize the input data without storing anything on the module.
+
+        Args:
+            nodes: Node attributes.
+            targets: Target data.
+            **kwargs: Additional keyword arguments. Includes locs, edges, vel, edge_attr, and charges.
+
+        Returns:
+            A CanonicalizationResult whose canonicalized_x is the tuple of canonicalized location and velocity.
+
+        """
+        loc, edges, vel, edge_attr, charges = (
+            kwargs[key] for key in ("loc", "edges", "vel", "edge_attr", "charges")
+        )
+
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(
+            x, loc, edges, vel, edge_attr, charges
+        )
+
+        return CanonicalizationResult(
+            canonicalized_x=self.apply_inverse_group_element(
+                loc, vel, group_element_dict
+            ),
+            group_element=group_element_dict,
+            canonicalization_info=canonicalization_info,
+            targets=targets,
+        )
+
+    def canonicalize_inference(  # type: ignore[override]
+        self,
+        nodes: torch.Tensor,
+        loc: torch.Tensor,
+        edges: torch.Tensor,
+        vel: torch.Tensor,
+        edge_attr: torch.Tensor,
+        charges: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Canonicalize the input data for inference without storing anything on the module.
+
+        Only tensors go in and out, so the canonicalization and the prediction network can be
+        captured by `torch.compile` as a single graph.
+
+        Args:
+            nodes: Nodes data.
+            loc: Location data.
+            edges: Edges data.
+            vel: Velocity data.
+            edge_attr: Edge attributes data.
+            charges: Charges data.
+
+        Returns:
+            The canonicalized location and velocity, the rotation matrices and the translation vectors.
+
+        """
+        group_element_dict, _ = self.get_groupelement_and_info(
+            nodes, loc, edges, vel, edge_attr, charges
+        )
+        canonical_loc, canonical_vel = self.apply_inverse_group_element(
+            loc, vel, group_element_dict
+        )
+        return (
+            canonical_loc,
+            canonical_vel,
+            group_element_dict["rotation_matrix"],
+            group_element_dict["translation_vectors"],
+        )
+
+    def canonicalize(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Canonicalize the input data.
+
+        Args:
+            nodes: Node attributes.
+            targets: Target data.
+            **kwargs: Additional keyword arguments. Includes locs, edges, vel, edge_attr, and charges.
+
+        Returns:
+            The canonicalized location and velocity.
+
+        """
+        self.device = x.device
+
+        loc, edges, vel, edge_attr, charges = (
+            kwargs[key] for key in ("loc", "edges", "vel", "edge_attr", "charges")
+        )
+
+        group_element_dict = self.get_groupelement(
+            x, loc, edges, vel, edge_attr, charges
+        )
+
+        return self.apply_inverse_group_element(loc, vel, group_element_dict)
+
     def invert_canonicalization(
         self, x_canonicalized_out: torch.Tensor, **kwargs: Any
     ) -> torch.Tensor:
         """This method takes as input the canonicalized output and returns the original output."""
-        rotation_matrix, translation_vectors, _ = self.canonicalization_info_dict[
-            "group_element"
-        ].values()
+        group_element_dict = self.get_canonicalization_info_dict(
+            kwargs.get("canonicalization_result")
+        )["group_element"]
+        rotation_matrix = group_element_dict["rotation_matrix"]
+        translation_vectors = group_element_dict["translation_vectors"]
         loc = (
             torch.bmm(x_canonicalized_out[:, None, :], rotation_matrix).squeeze()
             + translation_vectors
@@ -147,11 +289,4 @@ class EuclideanGroupNBody(ContinuousGroupCanonicalization):
             The orthonormalized vectors.
 
         """
-        v1 = vectors[:, 0]
-        v1 = v1 / torch.norm(v1, dim=1, keepdim=True)
-        v2 = vectors[:, 1] - torch.sum(vectors[:, 1] * v1, dim=1, keepdim=True) * v1
-        v2 = v2 / torch.norm(v2, dim=1, keepdim=True)
-        v3 = vectors[:, 2] - torch.sum(vectors[:, 2] * v1, dim=1, keepdim=True) * v1
-        v3 = v3 - torch.sum(v3 * v2, dim=1, keepdim=True) * v2
-        v3 = v3 / torch.norm(v3, dim=1, keepdim=True)
-        return torch.stack([v1, v2, v3], dim=1)
+        return orthonormalize(vectors, method="gram_schmidt")
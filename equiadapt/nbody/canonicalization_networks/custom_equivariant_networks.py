@@ -126,14 +126,16 @@ class VNDeepSets(nn.Module):
         Returns:
             Tuple[torch.Tensor, torch.Tensor]: The rotation vectors and translation vectors.
         """
+        # the particles of every system are stored contiguously
+        n_nodes = loc.shape[0] // self.batch_size
         batch_indices: torch.Tensor = torch.arange(
             self.batch_size, device=self.device
         ).reshape(-1, 1)
-        batch_indices = batch_indices.repeat(1, 5).reshape(-1)
+        batch_indices = batch_indices.repeat(1, n_nodes).reshape(-1)
         mean_loc: torch.Tensor = ts.scatter(
             loc, batch_indices, 0, reduce=self.layer_pooling
         )
-        mean_loc = mean_loc.repeat(5, 1, 1).transpose(0, 1).reshape(-1, 3)
+        mean_loc = mean_loc.repeat(n_nodes, 1, 1).transpose(0, 1).reshape(-1, 3)
         canonical_loc: torch.Tensor = loc - mean_loc
 
         if self.canon_feature == "p":
@@ -162,7 +164,7 @@ class VNDeepSets(nn.Module):
             x = ts.scatter(x, batch_indices, 0, reduce=self.final_pooling)
         output = self.output_layer(x)
 
-        output = output.repeat(5, 1, 1, 1).transpose(0, 1)
+        output = output.repeat(n_nodes, 1, 1, 1).transpose(0, 1)
         output = output.reshape(-1, 3, 4)
 
         rotation_vectors = output[:, :, :3]
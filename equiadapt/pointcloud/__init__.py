@@ -1,28 +1,34 @@
 """This package contains modules for the equiadapt pointcloud canonicalization."""
 
-from equiadapt.pointcloud import canonicalization, canonicalization_networks
-from equiadapt.pointcloud.canonicalization import (
-    ContinuousGroupPointcloudCanonicalization,
-    EquivariantPointcloudCanonicalization,
-    continuous_group,
-)
-from equiadapt.pointcloud.canonicalization_networks import (
-    EPS,
-    VNBatchNorm,
-    VNBilinear,
-    VNLeakyReLU,
-    VNLinear,
-    VNLinearLeakyReLU,
-    VNMaxPool,
-    VNSmall,
-    VNSoftplus,
-    VNStdFeature,
-    equivariant_networks,
-    get_graph_feature_cross,
-    knn,
-    mean_pool,
-    vector_neuron_layers,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.pointcloud import canonicalization, canonicalization_networks, utils
+    from equiadapt.pointcloud.canonicalization import (
+        ContinuousGroupPointcloudCanonicalization,
+        EquivariantPointcloudCanonicalization,
+        continuous_group,
+    )
+    from equiadapt.pointcloud.canonicalization_networks import (
+        EPS,
+        VNBatchNorm,
+        VNBilinear,
+        VNLeakyReLU,
+        VNLinear,
+        VNLinearLeakyReLU,
+        VNMaxPool,
+        VNSmall,
+        VNSoftplus,
+        VNStdFeature,
+        equivariant_networks,
+        get_graph_feature_cross,
+        knn,
+        mean_pool,
+        vector_neuron_layers,
+    )
+    from equiadapt.pointcloud.utils import knn_dense, knn_tiled, knn_voxel
 
 __all__ = [
     "ContinuousGroupPointcloudCanonicalization",
@@ -43,6 +49,38 @@ __all__ = [
     "equivariant_networks",
     "get_graph_feature_cross",
     "knn",
+    "knn_dense",
+    "knn_tiled",
+    "knn_voxel",
     "mean_pool",
+    "utils",
     "vector_neuron_layers",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=["canonicalization", "canonicalization_networks", "utils"],
+    attributes={
+        "ContinuousGroupPointcloudCanonicalization": "equiadapt.pointcloud.canonicalization",
+        "EquivariantPointcloudCanonicalization": "equiadapt.pointcloud.canonicalization",
+        "continuous_group": "equiadapt.pointcloud.canonicalization",
+        "EPS": "equiadapt.pointcloud.canonicalization_networks",
+        "VNBatchNorm": "equiadapt.pointcloud.canonicalization_networks",
+        "VNBilinear": "equiadapt.pointcloud.canonicalization_networks",
+        "VNLeakyReLU": "equiadapt.pointcloud.canonicalization_networks",
+        "VNLinear": "equiadapt.pointcloud.canonicalization_networks",
+        "VNLinearLeakyReLU": "equiadapt.pointcloud.canonicalization_networks",
+        "VNMaxPool": "equiadapt.pointcloud.canonicalization_networks",
+        "VNSmall": "equiadapt.pointcloud.canonicalization_networks",
+        "VNSoftplus": "equiadapt.pointcloud.canonicalization_networks",
+        "VNStdFeature": "equiadapt.pointcloud.canonicalization_networks",
+        "equivariant_networks": "equiadapt.pointcloud.canonicalization_networks",
+        "get_graph_feature_cross": "equiadapt.pointcloud.canonicalization_networks",
+        "knn": "equiadapt.pointcloud.canonicalization_networks",
+        "mean_pool": "equiadapt.pointcloud.canonicalization_networks",
+        "vector_neuron_layers": "equiadapt.pointcloud.canonicalization_networks",
+        "knn_dense": "equiadapt.pointcloud.utils",
+        "knn_tiled": "equiadapt.pointcloud.utils",
+        "knn_voxel": "equiadapt.pointcloud.utils",
+    },
+)
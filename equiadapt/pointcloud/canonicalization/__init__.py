@@ -1,11 +1,25 @@
 """This module contains the pointcloud canonicalization methods."""
 
-from equiadapt.pointcloud.canonicalization.continuous_group import (
-    ContinuousGroupPointcloudCanonicalization,
-    EquivariantPointcloudCanonicalization,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.pointcloud.canonicalization.continuous_group import (
+        ContinuousGroupPointcloudCanonicalization,
+        EquivariantPointcloudCanonicalization,
+    )
 
 __all__ = [
     "ContinuousGroupPointcloudCanonicalization",
     "EquivariantPointcloudCanonicalization",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=[],
+    attributes={
+        "ContinuousGroupPointcloudCanonicalization": "equiadapt.pointcloud.canonicalization.continuous_group",
+        "EquivariantPointcloudCanonicalization": "equiadapt.pointcloud.canonicalization.continuous_group",
+    },
+)
@@ -6,8 +6,12 @@ from typing import Any, Dict, List, Optional, Tuple, Union
 import torch
 from omegaconf import DictConfig
 
-from equiadapt.common.basecanonicalization import ContinuousGroupCanonicalization
+from equiadapt.common.basecanonicalization import (
+    CanonicalizationResult,
+    ContinuousGroupCanonicalization,
+)
 from equiadapt.common.utils import gram_schmidt
+from equiadapt.pointcloud.utils import subsample_points
 
 
 class ContinuousGroupPointcloudCanonicalization(ContinuousGroupCanonicalization):
@@ -22,8 +26,10 @@ class ContinuousGroupPointcloudCanonicalization(ContinuousGroupCanonicalization)
         device: The device on which the operations are performed.
 
     Methods:
-        get_groupelement: Maps the input point cloud to the group element.
+        get_groupelement_and_info: Maps the input point cloud to the group element without storing anything on the module.
+        apply_inverse_group_element: Applies the inverse of the group element to the point cloud.
         canonicalize: Returns the canonicalized point cloud.
+        canonicalize_stateless: Returns the canonicalized point cloud as a CanonicalizationResult.
     """
 
     def __init__(
@@ -31,22 +37,72 @@ class ContinuousGroupPointcloudCanonicalization(ContinuousGroupCanonicalization)
         canonicalization_network: torch.nn.Module,
         canonicalization_hyperparams: DictConfig,
     ):
-        super().__init__(canonicalization_network)
+        super().__init__(canonicalization_network, group_rep_dim=3)
 
-    def get_groupelement(self, x: torch.Tensor) -> dict:
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
         """
-        This method takes the input image and maps it to the group element.
+        This method takes the input point cloud and maps it to the group element without storing anything on the module.
 
         Args:
-            x (torch.Tensor): The input image.
+            x (torch.Tensor): The input point cloud.
 
         Returns:
-            dict: The group element.
+            Tuple[Dict[str, torch.Tensor], Dict[str, Any]]: The group element and the canonicalization information.
 
         Raises:
             NotImplementedError: If the method is not implemented.
         """
-        raise NotImplementedError("get_groupelement method is not implemented")
+        raise NotImplementedError("get_groupelement_and_info method is not implemented")
+
+    def apply_inverse_group_element(
+        self, x: torch.Tensor, group_element_dict: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        This method applies the inverse of the group element to the input point cloud.
+
+        Args:
+            x (torch.Tensor): The input point cloud.
+            group_element_dict (Dict[str, torch.Tensor]): The group element for each point cloud.
+
+        Returns:
+            torch.Tensor: The canonicalized point cloud.
+        """
+        rotation_matrices = group_element_dict["rotation"]
+
+        # get the inverse of the rotation matrices
+        rotation_matrix_inverse = rotation_matrices.transpose(1, 2)
+
+        # apply the inverse rotation matrices to the input point cloud
+        x_canonicalized = torch.bmm(
+            x.transpose(1, 2), rotation_matrix_inverse
+        ).transpose(1, 2)
+
+        return x_canonicalized
+
+    def canonicalize_stateless(
+        self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
+    ) -> CanonicalizationResult:
+        """
+        This method canonicalizes the point cloud without storing anything on the module.
+
+        Args:
+            x (torch.Tensor): The input point cloud.
+            targets (Optional[List]): The list of targets (optional).
+            **kwargs (Any): Additional keyword arguments.
+
+        Returns:
+            CanonicalizationResult: The canonicalized point cloud and the canonicalization information.
+        """
+        group_element_dict, canonicalization_info = self.get_groupelement_and_info(x)
+
+        return CanonicalizationResult(
+            canonicalized_x=self.apply_inverse_group_element(x, group_element_dict),
+            group_element=group_element_dict,
+            canonicalization_info=canonicalization_info,
+            targets=targets,
+        )
 
     def canonicalize(
         self, x: torch.Tensor, targets: Optional[List] = None, **kwargs: Any
@@ -68,17 +124,7 @@ class ContinuousGroupPointcloudCanonicalization(ContinuousGroupCanonicalization)
         # get the group element dictionary
         group_element_dict = self.get_groupelement(x)
 
-        rotation_matrices = group_element_dict["rotation"]
-
-        # get the inverse of the rotation matrices
-        rotation_matrix_inverse = rotation_matrices.transpose(1, 2)
-
-        # apply the inverse rotation matrices to the input point cloud
-        x_canonicalized = torch.bmm(
-            x.transpose(1, 2), rotation_matrix_inverse
-        ).transpose(1, 2)
-
-        return x_canonicalized
+        return self.apply_inverse_group_element(x, group_element_dict)
 
 
 class EquivariantPointcloudCanonicalization(ContinuousGroupPointcloudCanonicalization):
@@ -95,6 +141,20 @@ class EquivariantPointcloudCanonicalization(ContinuousGroupPointcloudCanonicaliz
         canonicalization_network (torch.nn.Module): The canonicalization network module.
         canonicalization_hyperparams (DictConfig): The hyperparameters for the canonicalization.
         canonicalization_info_dict (dict): A dictionary to store the canonicalization information.
+        share_knn_idx (bool): Whether to store the nearest neighbor indices computed by the canonicalization
+            network under "knn_idx" in the canonicalization information. Rotations preserve pairwise distances,
+            so downstream networks that accept an `idx` can reuse them on the canonicalized point cloud.
+        subsample_method (str): How the points fed to the canonicalization network are subsampled,
+            one of "none", "random", "fps" or "voxel".
+        num_subsampled_points (Optional[int]): The number of points fed to the canonicalization network.
+            The rotation it predicts is applied to the full point cloud.
+
+    Methods:
+        subsample: Subsamples the point cloud fed to the canonicalization network.
+        get_groupelement_and_info: Maps the input point cloud to the group element.
+        canonicalize_inference: Canonicalizes the point cloud in a form that can be compiled.
+        get_knn_idx: Returns the nearest neighbor indices shared by the canonicalization network.
+        get_subsampling_frame_agreement: Measures how close the frames predicted from subsampled point clouds are to the full ones.
     """
 
     def __init__(
@@ -103,32 +163,173 @@ class EquivariantPointcloudCanonicalization(ContinuousGroupPointcloudCanonicaliz
         canonicalization_hyperparams: DictConfig,
     ):
         super().__init__(canonicalization_network, canonicalization_hyperparams)
+        self.share_knn_idx = canonicalization_hyperparams.get("share_knn_idx", False)
+        self.subsample_method = canonicalization_hyperparams.get(
+            "subsample_method", "none"
+        )
+        self.num_subsampled_points = canonicalization_hyperparams.get(
+            "num_subsampled_points", None
+        )
+        if self.share_knn_idx and self.subsample_method != "none":
+            raise ValueError(
+                "share_knn_idx requires the canonicalization network to see every "
+                "point, set subsample_method to none"
+            )
+        # the canonicalization network looks for the n_knn nearest neighbors among the subsampled points
+        n_knn = getattr(canonicalization_network, "n_knn", None)
+        if (
+            self.subsample_method != "none"
+            and self.num_subsampled_points is not None
+            and n_knn is not None
+            and self.num_subsampled_points < n_knn
+        ):
+            raise ValueError(
+                f"num_subsampled_points ({self.num_subsampled_points}) must be at "
+                f"least the number of nearest neighbors n_knn ({n_knn})"
+            )
+
+    def subsample(
+        self,
+        x: torch.Tensor,
+        num_points: Optional[int] = None,
+        method: Optional[str] = None,
+    ) -> torch.Tensor:
+        """
+        This method subsamples the point cloud fed to the canonicalization network.
 
-    def get_groupelement(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        Args:
+            x (torch.Tensor): The input point cloud of shape (batch_size, 3, num_points).
+            num_points (Optional[int]): The number of points to keep. Defaults to `num_subsampled_points`.
+            method (Optional[str]): The subsampling method. Defaults to `subsample_method`.
+
+        Returns:
+            torch.Tensor: The subsampled point cloud of shape (batch_size, 3, num_points).
         """
-        This method takes the input image and maps it to the group element.
+        return subsample_points(
+            x,
+            self.num_subsampled_points if num_points is None else num_points,
+            self.subsample_method if method is None else method,
+        )
+
+    def get_groupelement_and_info(
+        self, x: torch.Tensor
+    ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
+        """
+        This method takes the input point cloud and maps it to the group element.
 
         Args:
             x (torch.Tensor): The input point cloud.
 
         Returns:
-            Dict[str, torch.Tensor]: A dictionary containing the group element.
+            Tuple[Dict[str, torch.Tensor], Dict[str, Any]]: A dictionary containing the group element
+            and a dictionary containing the canonicalization information.
         """
         group_element_dict = {}
+        canonicalization_info: Dict[str, Any] = {}
 
         # convert the group activations to one hot encoding of group element
         # this conversion is differentiable and will be used to select the group element
-        out_vectors = self.canonicalization_network(x)
-
-        # Check whether canonicalization_info_dict is already defined
-        if not hasattr(self, "canonicalization_info_dict"):
-            self.canonicalization_info_dict = {}
+        if self.share_knn_idx:
+            out_vectors, canonicalization_info["knn_idx"] = (
+                self.canonicalization_network(x, return_knn_idx=True)
+            )
+        else:
+            out_vectors = self.canonicalization_network(self.subsample(x))
 
         group_element_dict["rotation"] = gram_schmidt(out_vectors)
-        self.canonicalization_info_dict["group_element_matrix_representation"] = (
-            group_element_dict["rotation"]
+
+        canonicalization_info.update(
+            {
+                "group_element_matrix_representation": group_element_dict["rotation"],
+                "group_element": group_element_dict,
+            }
         )
 
-        self.canonicalization_info_dict["group_element"] = group_element_dict  # type: ignore
+        return group_element_dict, canonicalization_info
+
+    def canonicalize_inference(
+        self, x: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        This method canonicalizes the point cloud for inference without storing anything on the module.
+
+        Only tensors go in and out, so the canonicalization and the prediction network can be captured
+        by `torch.compile` as a single graph. The nearest neighbor indices are not shared, and the "voxel"
+        subsampling depends on the data, which breaks the graph.
+
+        Args:
+            x (torch.Tensor): The input point cloud of shape (batch_size, 3, num_points).
 
-        return group_element_dict
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: The canonicalized point cloud and the rotation matrices
+            of shape (batch_size, 3, 3).
+        """
+        out_vectors = self.canonicalization_network(self.subsample(x))
+        rotation_matrices = gram_schmidt(out_vectors)
+        return (
+            self.apply_inverse_group_element(x, {"rotation": rotation_matrices}),
+            rotation_matrices,
+        )
+
+    def get_knn_idx(
+        self, canonicalization_result: Optional[CanonicalizationResult] = None
+    ) -> Optional[torch.Tensor]:
+        """
+        This method returns the nearest neighbor indices computed by the canonicalization network.
+
+        The indices are computed on the input point cloud, but since the canonicalization is a rotation
+        they are also the nearest neighbors of the canonicalized point cloud.
+
+        Args:
+            canonicalization_result (Optional[CanonicalizationResult]): The result of `canonicalize_stateless`.
+                If None, the information stored by the last call to `canonicalize` is used.
+
+        Returns:
+            Optional[torch.Tensor]: The neighbor indices of shape (batch_size, num_points, k), nearest first,
+            or None if `share_knn_idx` is disabled.
+        """
+        if not self.share_knn_idx:
+            return None
+        return self.get_canonicalization_info_dict(canonicalization_result)["knn_idx"]
+
+    @torch.no_grad()
+    def get_subsampling_frame_agreement(
+        self,
+        x: torch.Tensor,
+        num_points_list: List[int],
+        method: Optional[str] = None,
+        threshold_degrees: float = 5.0,
+    ) -> Dict[int, Dict[str, float]]:
+        """
+        This method measures how close the frames predicted from subsampled point clouds are to the frames predicted from every point.
+
+        It is meant to pick the smallest `num_subsampled_points` that still agrees with the full point cloud.
+
+        Args:
+            x (torch.Tensor): The input point cloud of shape (batch_size, 3, num_points).
+            num_points_list (List[int]): The numbers of subsampled points to evaluate.
+            method (Optional[str]): The subsampling method. Defaults to `subsample_method`, or "fps" if it is "none".
+            threshold_degrees (float): The angle below which two frames agree. Defaults to 5 degrees.
+
+        Returns:
+            Dict[int, Dict[str, float]]: For every number of subsampled points, the mean and maximum angle
+            (in degrees) between the subsampled and full frames, and the fraction of frames that agree.
+        """
+        if method is None:
+            method = "fps" if self.subsample_method == "none" else self.subsample_method
+        full_rotation = gram_schmidt(self.canonicalization_network(x))
+
+        frame_agreement = {}
+        for num_points in num_points_list:
+            rotation = gram_schmidt(
+                self.canonicalization_network(self.subsample(x, num_points, method))
+            )
+            # angle of the relative rotation, from its trace
+            cos_angle = ((rotation * full_rotation).sum(dim=(1, 2)) - 1) / 2
+            angles = torch.rad2deg(torch.acos(cos_angle.clamp(-1.0, 1.0)))
+            frame_agreement[num_points] = {
+                "mean_angle": angles.mean().item(),
+                "max_angle": angles.max().item(),
+                "agreement": (angles < threshold_degrees).float().mean().item(),
+            }
+        return frame_agreement
@@ -1,26 +1,31 @@
 """This package contains equivariant modules and networks for the equiadapt pointcloud canonicalization."""
 
-from equiadapt.pointcloud.canonicalization_networks import (
-    equivariant_networks,
-    vector_neuron_layers,
-)
-from equiadapt.pointcloud.canonicalization_networks.equivariant_networks import (
-    VNSmall,
-    get_graph_feature_cross,
-    knn,
-)
-from equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers import (
-    EPS,
-    VNBatchNorm,
-    VNBilinear,
-    VNLeakyReLU,
-    VNLinear,
-    VNLinearLeakyReLU,
-    VNMaxPool,
-    VNSoftplus,
-    VNStdFeature,
-    mean_pool,
-)
+from typing import TYPE_CHECKING
+
+from equiadapt.common.lazy_imports import attach
+
+if TYPE_CHECKING:
+    from equiadapt.pointcloud.canonicalization_networks import (
+        equivariant_networks,
+        vector_neuron_layers,
+    )
+    from equiadapt.pointcloud.canonicalization_networks.equivariant_networks import (
+        VNSmall,
+        get_graph_feature_cross,
+        knn,
+    )
+    from equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers import (
+        EPS,
+        VNBatchNorm,
+        VNBilinear,
+        VNLeakyReLU,
+        VNLinear,
+        VNLinearLeakyReLU,
+        VNMaxPool,
+        VNSoftplus,
+        VNStdFeature,
+        mean_pool,
+    )
 
 __all__ = [
     "EPS",
@@ -39,3 +44,23 @@ __all__ = [
     "vector_neuron_layers",
     "mean_pool",
 ]
+
+__getattr__, __dir__ = attach(
+    __name__,
+    submodules=["equivariant_networks", "vector_neuron_layers"],
+    attributes={
+        "VNSmall": "equiadapt.pointcloud.canonicalization_networks.equivariant_networks",
+        "get_graph_feature_cross": "equiadapt.pointcloud.canonicalization_networks.equivariant_networks",
+        "knn": "equiadapt.pointcloud.canonicalization_networks.equivariant_networks",
+        "EPS": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNBatchNorm": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNBilinear": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNLeakyReLU": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNLinear": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNLinearLeakyReLU": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNMaxPool": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNSoftplus": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "VNStdFeature": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+        "mean_pool": "equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers",
+    },
+)
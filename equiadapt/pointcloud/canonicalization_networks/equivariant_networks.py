@@ -1,36 +1,17 @@
-from typing import Optional
+from typing import Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
 from omegaconf import DictConfig
 
+from equiadapt.common.utils import is_compiling
 from equiadapt.pointcloud.canonicalization_networks.vector_neuron_layers import (
     VNBatchNorm,
     VNLinearLeakyReLU,
     VNMaxPool,
     mean_pool,
 )
-
-
-def knn(x: torch.Tensor, k: int) -> torch.Tensor:
-    """
-    Performs k-nearest neighbors search on a given set of points.
-
-    Args:
-        x (torch.Tensor): The input tensor representing a set of points.
-            Shape: (batch_size, num_points, num_dimensions).
-        k (int): The number of nearest neighbors to find.
-
-    Returns:
-        torch.Tensor: The indices of the k nearest neighbors for each point in x.
-            Shape: (batch_size, num_points, k).
-    """
-    inner = -2 * torch.matmul(x.transpose(2, 1), x)
-    xx = torch.sum(x**2, dim=1, keepdim=True)
-    pairwise_distance = -xx - inner - xx.transpose(2, 1)
-
-    idx = pairwise_distance.topk(k=k, dim=-1)[1]  # (batch_size, num_points, k)
-    return idx
+from equiadapt.pointcloud.utils import cross_product, knn
 
 
 def get_graph_feature_cross(
@@ -66,14 +47,27 @@ def get_graph_feature_cross(
     x = x.transpose(2, 1).contiguous()
     feature = x.view(batch_size * num_points, -1)[idx, :]
     feature = feature.view(batch_size, num_points, k, num_dims, 3)
-    x = x.view(batch_size, num_points, 1, num_dims, 3).repeat(1, 1, k, 1, 1)
-    cross = torch.cross(feature, x, dim=-1)
+    # the center points are broadcast over the neighbors instead of being repeated k times
+    x = x.view(batch_size, num_points, 1, num_dims, 3)
+
+    if is_compiling() or (torch.is_grad_enabled() and x.requires_grad):
+        # out= arguments do not support autograd, and break the graph when compiling
+        x = x.expand(-1, -1, k, -1, -1)
+        if torch.onnx.is_in_onnx_export():
+            cross = cross_product(feature, x)
+        else:
+            cross = torch.cross(feature, x, dim=-1)
+        feature = torch.cat((feature - x, x, cross), dim=3)
+        return feature.permute(0, 3, 4, 1, 2).contiguous()
 
-    feature = (
-        torch.cat((feature - x, x, cross), dim=3).permute(0, 3, 4, 1, 2).contiguous()
-    )
+    # write the three parts of the edge features directly into the output layout
+    feature_out = feature.new_empty((batch_size, num_dims * 3, 3, num_points, k))
+    edge_feature = feature_out.permute(0, 3, 4, 1, 2)
+    torch.sub(feature, x, out=edge_feature[:, :, :, :num_dims])
+    edge_feature[:, :, :, num_dims : 2 * num_dims].copy_(x)
+    torch.linalg.cross(feature, x, dim=-1, out=edge_feature[:, :, :, 2 * num_dims :])
 
-    return feature
+    return feature_out
 
 
 class VNSmall(torch.nn.Module):
@@ -85,6 +79,7 @@ class VNSmall(torch.nn.Module):
 
     Attributes:
         n_knn (int): Number of nearest neighbors to consider.
+        knn_backend (str): Backend of the nearest neighbor search, one of "auto", "dense", "tiled" or "voxel".
         pooling (str): Pooling type to use, either "max" or "mean".
         conv_pos (VNLinearLeakyReLU): Convolutional layer for positional encoding.
         conv1 (VNLinearLeakyReLU): First convolutional layer.
@@ -95,6 +90,7 @@ class VNSmall(torch.nn.Module):
 
     Methods:
         __init__: Initializes the VNSmall network.
+        get_knn_idx: Computes the nearest neighbor indices of the input point cloud.
         forward: Forward pass of the VNSmall network.
 
     """
@@ -111,6 +107,7 @@ class VNSmall(torch.nn.Module):
         """
         super().__init__()
         self.n_knn = hyperparams.n_knn
+        self.knn_backend = hyperparams.get("knn_backend", "auto")
         self.pooling = hyperparams.pooling
         self.conv_pos = VNLinearLeakyReLU(3, 64 // 3, dim=5, negative_slope=0.0)
         self.conv1 = VNLinearLeakyReLU(64 // 3, 64 // 3, dim=4, negative_slope=0.0)
@@ -125,21 +122,42 @@ class VNSmall(torch.nn.Module):
         else:
             raise ValueError(f"Pooling type {self.pooling} not supported")
 
-    def forward(self, point_cloud: torch.Tensor) -> torch.Tensor:
+    def get_knn_idx(self, point_cloud: torch.Tensor) -> torch.Tensor:
+        """
+        Computes the indices of the `n_knn` nearest neighbors of every point.
+
+        Args:
+            point_cloud (torch.Tensor): Input point cloud tensor of shape (batch_size, 3, num_points).
+
+        Returns:
+            torch.Tensor: The neighbor indices of shape (batch_size, num_points, n_knn), nearest first.
+        """
+        return knn(point_cloud, k=self.n_knn, backend=self.knn_backend)
+
+    def forward(
+        self,
+        point_cloud: torch.Tensor,
+        idx: Optional[torch.Tensor] = None,
+        return_knn_idx: bool = False,
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         """
         Forward pass of the VNSmall network.
 
         For every pointcloud in the batch, the network outputs three vectors that transform equivariantly with respect to SO3 group.
 
         Args:
-            point_cloud (torch.Tensor): Input point cloud tensor of shape (batch_size, num_points, 3).
+            point_cloud (torch.Tensor): Input point cloud tensor of shape (batch_size, 3, num_points).
+            idx (torch.Tensor, optional): Precomputed nearest neighbor indices. Defaults to None.
+            return_knn_idx (bool, optional): Whether to also return the nearest neighbor indices. Defaults to False.
 
         Returns:
-            torch.Tensor: Output tensor of shape (batch_size, 3, 3).
+            Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]: Output tensor of shape (batch_size, 3, 3),
+            followed by the nearest neighbor indices of shape (batch_size, num_points, n_knn) if `return_knn_idx` is True.
 
         """
-        point_cloud = point_cloud.unsqueeze(1)
-        feat = get_graph_feature_cross(point_cloud, k=self.n_knn)
+        if idx is None:
+            idx = self.get_knn_idx(point_cloud)
+        feat = get_graph_feature_cross(point_cloud.unsqueeze(1), k=self.n_knn, idx=idx)
         out = self.conv_pos(feat)
         out = self.pool(out)
 
@@ -147,4 +165,7 @@ class VNSmall(torch.nn.Module):
         out = self.conv2(out)
         out = self.dropout(out)
 
-        return out.mean(dim=-1)[:, :3]
+        out = out.mean(dim=-1)[:, :3]
+        if return_knn_idx:
+            return out, idx
+        return out
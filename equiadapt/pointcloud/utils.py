@@ -0,0 +1,397 @@
+import itertools
+from typing import Optional
+
+import torch
+
+# "dense" materializes the full pairwise distance matrix, "tiled" computes it one block
+# of query points at a time and "voxel" only compares points in neighboring voxels of a
+# grid (approximate). "auto" picks "dense" when it fits in the memory budget and "tiled"
+# otherwise, so that it is always exact
+KNN_BACKENDS = ("auto", "dense", "tiled", "voxel")
+
+# maximum number of pairwise distances (or voxel candidates) held in memory at once
+KNN_MAX_TILE_ELEMENTS = 2**24
+
+
+def knn_dense(x: torch.Tensor, k: int) -> torch.Tensor:
+    """
+    Performs exact k-nearest neighbors search by computing all the pairwise distances at once.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        k (int): The number of nearest neighbors to find.
+
+    Returns:
+        torch.Tensor: The indices of the k nearest neighbors, nearest first, of shape (batch_size, num_points, k).
+    """
+    inner = -2 * torch.matmul(x.transpose(2, 1), x)
+    xx = torch.sum(x**2, dim=1, keepdim=True)
+    pairwise_distance = -xx - inner - xx.transpose(2, 1)
+
+    idx = pairwise_distance.topk(k=k, dim=-1)[1]  # (batch_size, num_points, k)
+    return idx
+
+
+def knn_tiled(
+    x: torch.Tensor, k: int, max_tile_elements: int = KNN_MAX_TILE_ELEMENTS
+) -> torch.Tensor:
+    """
+    Performs exact k-nearest neighbors search one block of query points at a time.
+
+    The blocks are sized so that at most `max_tile_elements` pairwise distances exist at once,
+    which bounds the memory to O(max_tile_elements) instead of O(num_points ** 2).
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        k (int): The number of nearest neighbors to find.
+        max_tile_elements (int, optional): The maximum number of pairwise distances per block. Defaults to 2 ** 24.
+
+    Returns:
+        torch.Tensor: The indices of the k nearest neighbors, nearest first, of shape (batch_size, num_points, k).
+    """
+    batch_size, _, num_points = x.shape
+    tile_size = max(1, max_tile_elements // (batch_size * num_points))
+
+    xx = torch.sum(x**2, dim=1, keepdim=True)  # (batch_size, 1, num_points)
+    idx = torch.empty((batch_size, num_points, k), dtype=torch.long, device=x.device)
+    for start in range(0, num_points, tile_size):
+        end = min(start + tile_size, num_points)
+        inner = -2 * torch.matmul(x[:, :, start:end].transpose(2, 1), x)
+        pairwise_distance = -xx - inner - xx[:, :, start:end].transpose(2, 1)
+        idx[:, start:end] = pairwise_distance.topk(k=k, dim=-1)[1]
+    return idx
+
+
+def estimate_voxel_size(
+    x: torch.Tensor,
+    k: int,
+    num_samples: int = 256,
+    max_tile_elements: int = KNN_MAX_TILE_ELEMENTS,
+) -> torch.Tensor:
+    """
+    Estimates a voxel size such that the k nearest neighbors of a point usually lie in the neighboring voxels.
+
+    It is the median distance to the k-th nearest neighbor of `num_samples` evenly strided points of each point cloud.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        k (int): The number of nearest neighbors to find.
+        num_samples (int, optional): The number of points used for the estimate. Defaults to 256.
+        max_tile_elements (int, optional): The maximum number of pairwise distances per block. Defaults to 2 ** 24.
+
+    Returns:
+        torch.Tensor: The voxel size of each point cloud, of shape (batch_size,).
+    """
+    batch_size, _, num_points = x.shape
+    samples = torch.linspace(
+        0, num_points - 1, min(num_samples, num_points), device=x.device
+    ).long()
+    tile_size = max(1, max_tile_elements // (batch_size * num_points))
+
+    kth_distances = []
+    for start in range(0, samples.shape[0], tile_size):
+        queries = x[:, :, samples[start : start + tile_size]]
+        distances = torch.cdist(queries.transpose(2, 1), x.transpose(2, 1))
+        kth_distances.append(distances.topk(k=k, dim=-1, largest=False)[0][..., -1])
+    return torch.cat(kth_distances, dim=1).median(dim=1)[0]
+
+
+def knn_voxel(
+    x: torch.Tensor,
+    k: int,
+    voxel_size: Optional[float] = None,
+    max_points_per_voxel: Optional[int] = None,
+    max_tile_elements: int = KNN_MAX_TILE_ELEMENTS,
+) -> torch.Tensor:
+    """
+    Performs approximate k-nearest neighbors search with a voxel hash grid.
+
+    The points are hashed into voxels of side `voxel_size` and every point is only compared with
+    (at most `max_points_per_voxel` of) the points of its own and adjacent voxels. Neighbors further away
+    than one voxel, or dropped from crowded voxels, are missed. Points with fewer than k candidates are padded
+    with their own index, so the indices are always valid.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points), with num_dims <= 3.
+        k (int): The number of nearest neighbors to find.
+        voxel_size (Optional[float], optional): The side of the voxels. Defaults to None, in which case it is
+            estimated for each point cloud with `estimate_voxel_size`.
+        max_points_per_voxel (Optional[int], optional): The maximum number of candidates taken from each voxel.
+            Defaults to None, in which case 2 * k is used.
+        max_tile_elements (int, optional): The maximum number of candidates per block of query points. Defaults to 2 ** 24.
+
+    Returns:
+        torch.Tensor: The indices of the k nearest neighbors, nearest first, of shape (batch_size, num_points, k).
+
+    Raises:
+        ValueError: If the points have more than 3 dimensions or there are fewer than k candidates per point.
+    """
+    batch_size, num_dims, num_points = x.shape
+    if num_dims > 3:
+        raise ValueError(
+            "the voxel knn backend only supports points with up to 3 dimensions"
+        )
+    if max_points_per_voxel is None:
+        max_points_per_voxel = 2 * k
+
+    points = x.transpose(2, 1).reshape(batch_size * num_points, num_dims)
+    if voxel_size is None:
+        voxel_sizes = estimate_voxel_size(x, k, max_tile_elements=max_tile_elements)
+    else:
+        voxel_sizes = torch.full((batch_size,), voxel_size, device=x.device)
+    voxel_sizes = voxel_sizes.clamp_min(torch.finfo(x.dtype).eps).to(x.dtype)
+
+    # integer voxel coordinates, shifted by one so that the adjacent voxels of every
+    # point are in the grid
+    mins = x.amin(dim=2, keepdim=True)
+    coords = ((x - mins) / voxel_sizes.view(-1, 1, 1)).floor().long() + 1
+    coords = coords.transpose(2, 1).reshape(batch_size * num_points, num_dims)
+    grid_shape = coords.amax(dim=0) + 2
+    strides = torch.ones(num_dims, dtype=torch.long, device=x.device)
+    for dim in range(num_dims - 2, -1, -1):
+        strides[dim] = strides[dim + 1] * grid_shape[dim + 1]
+    batch_offsets = torch.arange(batch_size, device=x.device).repeat_interleave(
+        num_points
+    ) * (strides[0] * grid_shape[0])
+    keys = (coords * strides).sum(dim=1) + batch_offsets
+
+    # points sorted by voxel, with the first position and the number of points of
+    # every occupied voxel
+    sorted_keys, order = keys.sort(stable=True)
+    voxel_keys, voxel_counts = torch.unique_consecutive(sorted_keys, return_counts=True)
+    voxel_starts = voxel_counts.cumsum(dim=0) - voxel_counts
+
+    neighbor_offsets = (
+        torch.tensor(
+            list(itertools.product((-1, 0, 1), repeat=num_dims)), device=x.device
+        )
+        * strides
+    ).sum(dim=1)
+    slots = torch.arange(max_points_per_voxel, device=x.device)
+    num_candidates = neighbor_offsets.shape[0] * max_points_per_voxel
+    if num_candidates < k:
+        raise ValueError(
+            f"max_points_per_voxel={max_points_per_voxel} gives fewer than k={k} candidates"
+        )
+    tile_size = max(1, max_tile_elements // (num_candidates * num_dims))
+
+    idx = torch.empty((batch_size * num_points, k), dtype=torch.long, device=x.device)
+    for start in range(0, batch_size * num_points, tile_size):
+        queries = torch.arange(
+            start, min(start + tile_size, batch_size * num_points), device=x.device
+        )
+        neighbor_keys = keys[queries, None] + neighbor_offsets
+        positions = torch.searchsorted(voxel_keys, neighbor_keys).clamp_max(
+            voxel_keys.shape[0] - 1
+        )
+        counts = torch.where(
+            voxel_keys[positions] == neighbor_keys, voxel_counts[positions], 0
+        )
+        valid = slots < counts.unsqueeze(-1)
+        candidates = order[
+            (voxel_starts[positions].unsqueeze(-1) + slots).clamp_max(
+                order.shape[0] - 1
+            )
+        ]
+        candidates = torch.where(valid, candidates, queries.view(-1, 1, 1)).flatten(1)
+        valid = valid.flatten(1)
+
+        distances = (points[candidates] - points[queries].unsqueeze(1)).pow(2).sum(-1)
+        distances = torch.where(valid, -distances, -float("inf"))
+        idx[queries] = candidates.gather(1, distances.topk(k=k, dim=-1)[1])
+
+    idx = idx.view(batch_size, num_points, k)
+    return idx - torch.arange(batch_size, device=x.device).view(-1, 1, 1) * num_points
+
+
+@torch.no_grad()
+def knn(
+    x: torch.Tensor,
+    k: int,
+    backend: str = "auto",
+    max_tile_elements: int = KNN_MAX_TILE_ELEMENTS,
+    voxel_size: Optional[float] = None,
+    max_points_per_voxel: Optional[int] = None,
+) -> torch.Tensor:
+    """
+    Performs k-nearest neighbors search on a given set of points with the chosen backend.
+
+    All the backends return the same index format, so the result can be passed as `idx` to the graph feature functions.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        k (int): The number of nearest neighbors to find.
+        backend (str, optional): One of "auto", "dense", "tiled" or "voxel". Defaults to "auto".
+        max_tile_elements (int, optional): The memory budget of the "tiled" and "voxel" backends, in elements,
+            and the largest distance matrix "auto" computes densely. Defaults to 2 ** 24.
+        voxel_size (Optional[float], optional): The voxel side of the "voxel" backend. Defaults to None.
+        max_points_per_voxel (Optional[int], optional): The candidates per voxel of the "voxel" backend. Defaults to None.
+
+    Returns:
+        torch.Tensor: The indices of the k nearest neighbors, nearest first, of shape (batch_size, num_points, k).
+
+    Raises:
+        ValueError: If the backend is not supported.
+    """
+    if backend not in KNN_BACKENDS:
+        raise ValueError(f"knn backend must be one of {KNN_BACKENDS}")
+    if backend == "auto":
+        backend = (
+            "dense" if x.shape[0] * x.shape[2] ** 2 <= max_tile_elements else "tiled"
+        )
+
+    if backend == "dense":
+        return knn_dense(x, k)
+    if backend == "tiled":
+        return knn_tiled(x, k, max_tile_elements=max_tile_elements)
+    return knn_voxel(
+        x,
+        k,
+        voxel_size=voxel_size,
+        max_points_per_voxel=max_points_per_voxel,
+        max_tile_elements=max_tile_elements,
+    )
+
+
+def cross_product(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+    """
+    Computes the cross product of 3D vectors along the last dimension with elementwise operations.
+
+    It matches `torch.cross(a, b, dim=-1)`, which has no ONNX operator.
+
+    Args:
+        a (torch.Tensor): The first vectors of shape (..., 3).
+        b (torch.Tensor): The second vectors, broadcastable with a.
+
+    Returns:
+        torch.Tensor: The cross products of shape (..., 3).
+    """
+    a_x, a_y, a_z = a.unbind(dim=-1)
+    b_x, b_y, b_z = b.unbind(dim=-1)
+    return torch.stack(
+        [a_y * b_z - a_z * b_y, a_z * b_x - a_x * b_z, a_x * b_y - a_y * b_x], dim=-1
+    )
+
+
+# "none" keeps every point, "random" draws points uniformly without replacement,
+# "fps" runs farthest point sampling from the first point and "voxel" keeps one point
+# per occupied voxel of a grid. "random" and "fps" commute with rotations, "voxel" does
+# not since the grid is axis aligned
+SUBSAMPLE_METHODS = ("none", "random", "fps", "voxel")
+
+
+def random_sampling(x: torch.Tensor, num_samples: int) -> torch.Tensor:
+    """
+    Draws points uniformly at random without replacement.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        num_samples (int): The number of points to keep.
+
+    Returns:
+        torch.Tensor: The indices of the kept points, of shape (batch_size, num_samples).
+    """
+    batch_size, _, num_points = x.shape
+    scores = torch.rand((batch_size, num_points), device=x.device)
+    return scores.argsort(dim=1)[:, :num_samples]
+
+
+def farthest_point_sampling(x: torch.Tensor, num_samples: int) -> torch.Tensor:
+    """
+    Iteratively picks the point farthest from the points picked so far, starting from the first point.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        num_samples (int): The number of points to keep.
+
+    Returns:
+        torch.Tensor: The indices of the kept points, of shape (batch_size, num_samples).
+    """
+    batch_size, _, num_points = x.shape
+    idx = torch.zeros((batch_size, num_samples), dtype=torch.long, device=x.device)
+    distances = torch.full(
+        (batch_size, num_points), float("inf"), dtype=x.dtype, device=x.device
+    )
+    farthest = torch.zeros(batch_size, dtype=torch.long, device=x.device)
+    for i in range(num_samples):
+        idx[:, i] = farthest
+        centroid = x.gather(2, farthest.view(-1, 1, 1).expand(-1, x.shape[1], 1))
+        distances = torch.minimum(distances, (x - centroid).pow(2).sum(dim=1))
+        farthest = distances.argmax(dim=1)
+    return idx
+
+
+def voxel_grid_sampling(x: torch.Tensor, num_samples: int) -> torch.Tensor:
+    """
+    Keeps the first point of every occupied voxel of a grid with about `num_samples` voxels in the bounding box.
+
+    If there are more occupied voxels than `num_samples`, evenly strided voxels are kept.
+    If there are fewer, the remaining points are filled with the first points of the point cloud
+    that were not kept yet.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        num_samples (int): The number of points to keep.
+
+    Returns:
+        torch.Tensor: The indices of the kept points, of shape (batch_size, num_samples).
+    """
+    batch_size, num_dims, num_points = x.shape
+    mins = x.amin(dim=2, keepdim=True)
+    extents = (x.amax(dim=2, keepdim=True) - mins).clamp_min(torch.finfo(x.dtype).eps)
+    voxel_sizes = (extents.prod(dim=1, keepdim=True) / num_samples) ** (1 / num_dims)
+    coords = ((x - mins) / voxel_sizes).floor().long()
+
+    point_indices = torch.arange(num_points, device=x.device)
+    idx = []
+    for coord in coords:
+        # first point of every occupied voxel, in the order of the points
+        _, voxels = torch.unique(coord, dim=1, return_inverse=True)
+        representatives = torch.full(
+            (int(voxels.max()) + 1,), num_points, device=x.device
+        ).scatter_reduce(0, voxels, point_indices, reduce="amin")
+        representatives = representatives.sort()[0]
+        if representatives.shape[0] >= num_samples:
+            strides = torch.linspace(
+                0, representatives.shape[0] - 1, num_samples, device=x.device
+            )
+            idx.append(representatives[strides.long()])
+        else:
+            is_kept = torch.zeros(num_points, dtype=torch.bool, device=x.device)
+            is_kept[representatives] = True
+            others = point_indices[~is_kept][: num_samples - representatives.shape[0]]
+            idx.append(torch.cat((representatives, others)))
+    return torch.stack(idx)
+
+
+def subsample_points(
+    x: torch.Tensor, num_samples: Optional[int], method: str = "none"
+) -> torch.Tensor:
+    """
+    Subsamples every point cloud of the batch to `num_samples` points.
+
+    Args:
+        x (torch.Tensor): The input points of shape (batch_size, num_dims, num_points).
+        num_samples (Optional[int]): The number of points to keep. If None or not smaller than
+            the number of points, the point clouds are returned unchanged.
+        method (str, optional): One of "none", "random", "fps" or "voxel". Defaults to "none".
+
+    Returns:
+        torch.Tensor: The subsampled points of shape (batch_size, num_dims, num_samples).
+
+    Raises:
+        ValueError: If the method is not supported.
+    """
+    if method not in SUBSAMPLE_METHODS:
+        raise ValueError(f"subsample method must be one of {SUBSAMPLE_METHODS}")
+    if method == "none" or num_samples is None or num_samples >= x.shape[2]:
+        return x
+
+    sampling_functions = {
+        "random": random_sampling,
+        "fps": farthest_point_sampling,
+        "voxel": voxel_grid_sampling,
+    }
+    with torch.no_grad():
+        idx = sampling_functions[method](x, num_samples)
+    return x.gather(2, idx.unsqueeze(1).expand(-1, x.shape[1], -1))
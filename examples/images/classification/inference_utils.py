@@ -1,8 +1,11 @@
 import math
+from typing import Dict, List, Tuple
 
 import torch
+import torch.nn.functional as F
 from omegaconf import DictConfig
-from torchvision import transforms
+
+from equiadapt.images.utils import get_rot90_permutations, use_exact_rotations
 
 
 def get_inference_method(
@@ -92,30 +95,129 @@ class GroupInference(VanillaInference):
             if self.group_type == "rotation"
             else 2 * self.num_rotations
         )
-        self.pad = transforms.Pad(math.ceil(in_shape[-2] * 0.4), padding_mode="edge")
-        self.crop = transforms.CenterCrop((in_shape[-2], in_shape[-1]))
-
-    def get_group_element_wise_logits(self, x: torch.Tensor):
-        logits_dict = {}
-        degrees = torch.linspace(0, 360, self.num_rotations + 1)[:-1]
-        for rot, degree in enumerate(degrees):
-
-            x_pad = self.pad(x)
-            x_rot = transforms.functional.rotate(x_pad, degree.item())
-            x_rot = self.crop(x_rot)
-
-            logits_dict[rot] = self.forward(x_rot)
-
+        self.pad_size = math.ceil(in_shape[-2] * 0.4)
+        self.out_shape = (in_shape[-2], in_shape[-1])
+        self.rotation_backend = inference_hyperparams.get("rotation_backend", "auto")
+        # maximum number of transformed images in a forward pass, null runs the whole orbit at once
+        self.orbit_batch_size = inference_hyperparams.get("orbit_batch_size", None)
+        self.orbit_grids: Dict[Tuple[int, int, torch.device], torch.Tensor] = {}
+
+    def get_orbit_grid(
+        self, height: int, width: int, device: torch.device
+    ) -> torch.Tensor:
+        # sampling grid of every group element, (num_group_elements, out_height, out_width, 2):
+        # padding by pad_size, maybe flipping, rotating by degree and center cropping to out_shape
+        # folded into a single affine map, with border sampling in place of the edge padding
+        key = (height, width, device)
+        if key in self.orbit_grids:
+            return self.orbit_grids[key]
+
+        out_height, out_width = self.out_shape
+        radians = torch.deg2rad(
+            torch.linspace(0, 360, self.num_rotations + 1, dtype=torch.float64)[:-1]
+        )
+        cos_a, sin_a = torch.cos(radians), torch.sin(radians)
+
+        # location in the input image sampled by each output pixel, in pixel coordinates
+        # centered on the image, i.e. the inverse of the counter-clockwise rotation
+        linear = torch.stack(
+            [torch.stack([cos_a, -sin_a], dim=-1), torch.stack([sin_a, cos_a], dim=-1)],
+            dim=-2,
+        )  # (num_rotations, 2, 2)
         if self.group_type == "roto-reflection":
-            # Rotate the reflected images and get the logits
-            for rot, degree in enumerate(degrees):
+            # the horizontal flip happens before the rotation, so it flips the sampled x coordinate
+            reflect = torch.tensor([[-1.0], [1.0]], dtype=torch.float64)
+            linear = torch.cat([linear, reflect * linear], dim=0)
+
+        # offset of the center of the crop with respect to the center of the input image
+        pad = self.pad_size
+        crop_left = int(round((width + 2 * pad - out_width) / 2.0)) - pad
+        crop_top = int(round((height + 2 * pad - out_height) / 2.0)) - pad
+        offset = torch.tensor(
+            [
+                crop_left + (out_width - width) / 2,
+                crop_top + (out_height - height) / 2,
+            ],
+            dtype=torch.float64,
+        )
 
-                x_pad = self.pad(x)
-                x_reflect = transforms.functional.hflip(x_pad)
-                x_rotoreflect = transforms.functional.rotate(x_reflect, degree.item())
-                x_rotoreflect = self.crop(x_rotoreflect)
+        # move from pixel coordinates to the normalized coordinates of grid_sample
+        in_scale = torch.tensor(
+            [(width - 1) / 2, (height - 1) / 2], dtype=torch.float64
+        )
+        out_scale = torch.tensor(
+            [(out_width - 1) / 2, (out_height - 1) / 2], dtype=torch.float64
+        )
+        thetas = torch.cat(
+            [
+                linear * out_scale / in_scale[:, None],
+                (linear @ offset / in_scale)[..., None],
+            ],
+            dim=-1,
+        )  # (num_group_elements, 2, 3)
+
+        grid = F.affine_grid(
+            thetas,
+            [self.num_group_elements, 1, out_height, out_width],
+            align_corners=True,
+        )
+        self.orbit_grids[key] = grid.float().to(device)
+        return self.orbit_grids[key]
+
+    def get_orbit(self, x: torch.Tensor, group_elements: List[int]) -> torch.Tensor:
+        # transforms the images by each of the group elements with a single warp (or gather),
+        # group-major: the images transformed by group_elements[i] are the i-th block of the batch
+        batch_size, channels, height, width = x.shape
+        num_elements = len(group_elements)
+
+        if use_exact_rotations(x, self.num_rotations, self.rotation_backend):
+            # flipping (for roto-reflections) and then rotating by multiples of 90 degrees
+            # only permutes the pixels, so there is nothing to pad, interpolate or crop
+            transform_ids = [
+                4 * (element // self.num_rotations)
+                + (4 * (element % self.num_rotations) // self.num_rotations)
+                for element in group_elements
+            ]
+            permutations = get_rot90_permutations(height, x.device)[transform_ids]
+            x_orbit = x.flatten(-2)[..., permutations.flatten()]
+            out_height, out_width = height, width
+        else:
+            grid = self.get_orbit_grid(height, width, x.device)[group_elements]
+            out_height, out_width = grid.shape[1:3]
+            # stack the grids along the height to warp every group element at once,
+            # with nearest sampling as transforms.functional.rotate
+            x_orbit = F.grid_sample(
+                x,
+                grid.reshape(1, -1, out_width, 2)
+                .to(x.dtype)
+                .expand(batch_size, -1, -1, -1),
+                mode="nearest",
+                padding_mode="border",
+                align_corners=True,
+            )
+        return (
+            x_orbit.reshape(batch_size, channels, num_elements, out_height, out_width)
+            .permute(2, 0, 1, 3, 4)
+            .reshape(-1, channels, out_height, out_width)
+        )
 
-                logits_dict[rot + len(degrees)] = self.forward(x_rotoreflect)
+    def get_group_element_wise_logits(self, x: torch.Tensor):
+        # run the orbit through the model in chunks of whole group elements, each chunk
+        # holding at most orbit_batch_size images (but at least one group element)
+        batch_size = x.shape[0]
+        chunk_size = (
+            self.num_group_elements
+            if self.orbit_batch_size is None
+            else max(1, self.orbit_batch_size // batch_size)
+        )
+
+        logits_dict = {}
+        for start in range(0, self.num_group_elements, chunk_size):
+            group_elements = list(
+                range(start, min(start + chunk_size, self.num_group_elements))
+            )
+            logits = self.forward(self.get_orbit(x, group_elements))
+            logits_dict.update(zip(group_elements, logits.split(batch_size)))
 
         return logits_dict
 
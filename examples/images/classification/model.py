@@ -1,10 +1,16 @@
 import pytorch_lightning as pl
 import torch
 from inference_utils import get_inference_method
-from model_utils import get_dataset_specific_info, get_prediction_network
+from model_utils import (
+    PredictionNetwork,
+    get_dataset_specific_info,
+    get_prediction_network,
+)
 from omegaconf import DictConfig
+from orbit_cache import OrbitFeatureCache
 from torch.optim.lr_scheduler import MultiStepLR
 
+from equiadapt import DiscreteGroupImageCanonicalization
 from examples.images.common.utils import get_canonicalization_network, get_canonicalizer
 
 
@@ -54,10 +60,100 @@ class ImageClassifierPipeline(pl.LightningModule):
 
         self.max_epochs = hyperparams.experiment.training.num_epochs
 
+        if hyperparams.experiment.get("instrumentation", False):
+            self.canonicalizer.enable_instrumentation(self.prediction_network)
+
+        # features of the frozen encoder for the orbit of every training sample
+        self.orbit_feature_cache = None
+        if hyperparams.prediction.get("orbit_feature_cache", None):
+            if not (
+                hyperparams.prediction.freeze_pretrained_encoder
+                and isinstance(self.prediction_network, PredictionNetwork)
+                and isinstance(self.canonicalizer, DiscreteGroupImageCanonicalization)
+            ):
+                raise ValueError(
+                    "The orbit feature cache needs a frozen encoder with a linear head "
+                    "and a discrete group canonicalization"
+                )
+            if hyperparams.dataset.augment:
+                # random transforms give a sample different features at every epoch
+                raise ValueError(
+                    "The orbit feature cache needs deterministic training transforms, "
+                    "set dataset.augment=0"
+                )
+            # what the cached features depend on, checked against the cache directory
+            prediction = hyperparams.prediction
+            orbit_feature_cache_metadata = {
+                "architecture": prediction.prediction_network_architecture,
+                "use_pretrained": int(prediction.use_pretrained),
+                "dataset_name": hyperparams.dataset.dataset_name,
+                "augment": int(hyperparams.dataset.augment),
+                "image_shape": list(self.image_shape),
+                "group_type": self.canonicalizer.group_type,
+                "num_group": self.canonicalizer.num_group,
+            }
+            self.orbit_feature_cache = OrbitFeatureCache(
+                prediction.orbit_feature_cache,
+                self.canonicalizer.num_group,
+                self.prediction_network.predictor.in_features,
+                dtype=prediction.get("orbit_feature_cache_dtype", "float16"),
+                metadata=orbit_feature_cache_metadata,
+            )
+
         self.save_hyperparameters()
 
+    def on_fit_start(self) -> None:
+        if self.orbit_feature_cache is not None:
+            num_samples = self.trainer.datamodule.num_train_samples
+            # the first process creates the memory-mapped files, the others open them
+            if self.trainer.is_global_zero:
+                self.orbit_feature_cache.open(num_samples)
+            self.trainer.strategy.barrier()
+            if not self.trainer.is_global_zero:
+                self.orbit_feature_cache.open(num_samples, create=False)
+
+    @torch.no_grad()
+    def compute_orbit_features(self, x: torch.Tensor) -> torch.Tensor:
+        # features of x canonicalized by every group element, (batch_size, num_group, feature_dim)
+        encoder = self.prediction_network.encoder
+        was_training = encoder.training
+        # the cached features must not depend on the batch (e.g. batch norm statistics)
+        encoder.eval()
+
+        batch_size = x.shape[0]
+        angles = self.canonicalizer.group_element_angles
+        reflections = self.canonicalizer.group_element_reflections
+        orbit_features = []
+        for group_element in range(self.canonicalizer.num_group):
+            group_element_dict = {"rotation": angles[group_element].expand(batch_size)}
+            if self.canonicalizer.group_type == "roto-reflection":
+                group_element_dict["reflection"] = reflections[group_element].expand(
+                    batch_size
+                )
+            x_canonicalized = self.canonicalizer.warp_images(x, group_element_dict)
+            orbit_features.append(self.prediction_network.get_features(x_canonicalized))
+
+        encoder.train(was_training)
+        return torch.stack(orbit_features, dim=1)
+
+    def get_orbit_features(
+        self, x: torch.Tensor, indices: torch.Tensor
+    ) -> torch.Tensor:
+        # cached features of the orbit of every sample, computed when it is first seen
+        orbit_features, is_filled = self.orbit_feature_cache.get(indices)
+        orbit_features = orbit_features.to(device=x.device, dtype=x.dtype)
+        if not is_filled.all():
+            missing = (~is_filled).nonzero()[:, 0]
+            missing_features = self.compute_orbit_features(x[missing.to(x.device)])
+            orbit_features[missing.to(x.device)] = missing_features
+            self.orbit_feature_cache.put(indices.cpu()[missing], missing_features)
+        return orbit_features
+
     def training_step(self, batch: torch.Tensor):
-        x, y = batch
+        if self.orbit_feature_cache is not None:
+            x, y, indices = batch
+        else:
+            x, y = batch
         batch_size, num_channels, height, width = x.shape
 
         # assert that the input is in the right shape
@@ -66,9 +162,22 @@ class ImageClassifierPipeline(pl.LightningModule):
         training_metrics = {}
         loss = 0.0
 
-        # canonicalize the input data
-        # For the vanilla model, the canonicalization is the identity transformation
-        x_canonicalized = self.canonicalizer(x)
+        if self.orbit_feature_cache is not None:
+            # only the group element is needed, the features of the canonicalized images are cached
+            group_activations, canonicalization_info = (
+                self.canonicalizer.get_group_activations_and_info(x)
+            )
+            canonicalization_info["group_activations"] = group_activations
+            self.canonicalizer.canonicalization_info_dict = canonicalization_info
+            group_element_onehot = (
+                self.canonicalizer.groupactivations_to_groupelementonehot(
+                    group_activations
+                )
+            )
+        else:
+            # canonicalize the input data
+            # For the vanilla model, the canonicalization is the identity transformation
+            x_canonicalized = self.canonicalizer(x)
 
         # add group contrast loss while using optmization based canonicalization method
         if "opt" in self.hyperparams.canonicalization_type:
@@ -90,8 +199,17 @@ class ImageClassifierPipeline(pl.LightningModule):
 
         # calculate the task loss which is the cross-entropy loss for classification
         if self.hyperparams.experiment.training.loss.task_weight:
-            # Forward pass through the prediction network as you'll normally do
-            logits = self.prediction_network(x_canonicalized)
+            if self.orbit_feature_cache is not None:
+                # the (straight-through) one-hot encoding selects the features of the predicted
+                # group element, and the gradient flows to the canonicalizer through its soft weights
+                orbit_features = self.get_orbit_features(x, indices)
+                features = torch.einsum(
+                    "bg,bgd->bd", group_element_onehot, orbit_features
+                )
+                logits = self.prediction_network.predictor(features)
+            else:
+                # Forward pass through the prediction network as you'll normally do
+                logits = self.prediction_network(x_canonicalized)
 
             task_loss = self.loss(logits, y)
             loss += self.hyperparams.experiment.training.loss.task_weight * task_loss
@@ -182,6 +300,20 @@ class ImageClassifierPipeline(pl.LightningModule):
 
         return test_metrics
 
+    def on_train_epoch_end(self) -> None:
+        self.log_instrumentation_metrics()
+        if self.orbit_feature_cache is not None:
+            self.orbit_feature_cache.flush()
+
+    def on_test_epoch_end(self) -> None:
+        self.log_instrumentation_metrics()
+
+    def log_instrumentation_metrics(self) -> None:
+        # time and memory of every stage of the canonicalization pipeline since the last call
+        if self.canonicalizer.instrumentation is not None:
+            self.log_dict(self.canonicalizer.instrumentation.get_metrics())
+            self.canonicalizer.instrumentation.reset()
+
     def configure_optimizers(self):
         if (
             "resnet" in self.hyperparams.prediction.prediction_network_architecture
@@ -9,10 +9,12 @@ class PredictionNetwork(nn.Module):
         self.encoder = encoder
         self.predictor = nn.Linear(feature_dim, num_classes)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def get_features(self, x: torch.Tensor) -> torch.Tensor:
         reps = self.encoder(x)
-        reps = reps.view(x.shape[0], -1)
-        return self.predictor(reps)
+        return reps.view(x.shape[0], -1)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.predictor(self.get_features(x))
 
 
 def get_dataset_specific_info(dataset_name: str) -> tuple:
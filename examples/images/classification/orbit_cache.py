@@ -0,0 +1,95 @@
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+class OrbitFeatureCache:
+    """
+    Memory-mapped features of a frozen encoder for every (sample index, group element) pair.
+
+    With a discrete canonicalizer, a canonicalized image is one of the |G| transformed copies of the input,
+    so the features of the whole orbit of a sample can be computed once and gathered with the predicted
+    group element afterwards. The features of a sample are written the first time it is seen, for every
+    group element at once, in `features.npy` of shape (num_samples, num_group, feature_dim) and marked as
+    filled in `filled.npy`. The files are shared by the processes of a node.
+
+    The cache is only valid if the encoder is frozen and the training transforms of a sample are deterministic.
+    What the features depend on (encoder, dataset, transforms, group) is stored in `metadata.json`, and a
+    cache written with different metadata is refused instead of silently reused.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_group: int,
+        feature_dim: int,
+        dtype: str = "float16",
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.path = path
+        self.num_group = num_group
+        self.feature_dim = feature_dim
+        self.dtype = np.dtype(dtype)
+        # round trip through json so that it compares equal to the stored metadata
+        self.metadata = json.loads(json.dumps(metadata or {}))
+        self.features = None
+        self.filled = None
+
+    def open(self, num_samples: int, create: bool = True) -> None:
+        # the process that creates the files must be done before the others open them
+        shape = (num_samples, self.num_group, self.feature_dim)
+        features_path = os.path.join(self.path, "features.npy")
+        filled_path = os.path.join(self.path, "filled.npy")
+        metadata_path = os.path.join(self.path, "metadata.json")
+        if not os.path.exists(features_path):
+            if not create:
+                raise FileNotFoundError(f"{features_path} does not exist")
+            os.makedirs(self.path, exist_ok=True)
+            with open(metadata_path, "w") as f:
+                json.dump(self.metadata, f, indent=2, sort_keys=True)
+            np.lib.format.open_memmap(
+                features_path, mode="w+", dtype=self.dtype, shape=shape
+            )
+            np.lib.format.open_memmap(
+                filled_path, mode="w+", dtype=np.bool_, shape=(num_samples,)
+            )
+
+        if not os.path.exists(metadata_path):
+            raise ValueError(
+                f"The cache in {self.path} has no metadata.json, delete the directory"
+            )
+        with open(metadata_path) as f:
+            stored_metadata = json.load(f)
+        if stored_metadata != self.metadata:
+            raise ValueError(
+                f"The cache in {self.path} was written with {stored_metadata}, "
+                f"expected {self.metadata}, delete the directory or use another one"
+            )
+
+        self.features = np.load(features_path, mmap_mode="r+")
+        self.filled = np.load(filled_path, mmap_mode="r+")
+        if self.features.shape != shape or self.features.dtype != self.dtype:
+            raise ValueError(
+                f"The cache in {self.path} holds features of shape {self.features.shape} "
+                f"and type {self.features.dtype}, expected {shape} and {self.dtype}"
+            )
+
+    def get(self, indices: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        # features of shape (batch_size, num_group, feature_dim), and whether they were filled
+        indices = indices.cpu().numpy()
+        features = torch.from_numpy(np.asarray(self.features[indices]))
+        return features, torch.from_numpy(np.asarray(self.filled[indices]))
+
+    def put(self, indices: torch.Tensor, features: torch.Tensor) -> None:
+        indices = indices.cpu().numpy()
+        self.features[indices] = features.detach().cpu().numpy().astype(self.dtype)
+        # mark the samples as filled only once their features are written
+        self.filled[indices] = True
+
+    def flush(self) -> None:
+        if self.features is not None:
+            self.features.flush()
+            self.filled.flush()
@@ -1,5 +1,6 @@
 from .cifar_data import CIFAR10DataModule, CIFAR100DataModule
 from .imagenet_data import ImageNetDataModule
+from .indexed_data import IndexedDataset, IndexedTrainDataModule
 from .rotated_mnist_data import RotatedMNISTDataModule
 from .stl10_data import STL10DataModule
 
@@ -7,6 +8,8 @@ __all__ = [
     "CIFAR10DataModule",
     "CIFAR100DataModule",
     "ImageNetDataModule",
+    "IndexedDataset",
+    "IndexedTrainDataModule",
     "RotatedMNISTDataModule",
     "STL10DataModule",
 ]
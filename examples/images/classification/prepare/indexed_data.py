@@ -0,0 +1,46 @@
+import pytorch_lightning as pl
+from torch.utils.data import Dataset
+
+
+class IndexedDataset(Dataset):
+    """Returns the index of every sample along with the sample."""
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return (*self.dataset[index], index)
+
+
+class IndexedTrainDataModule(pl.LightningDataModule):
+    """Wraps a data module so that its training batches end with the indices of their samples."""
+
+    def __init__(self, data_module: pl.LightningDataModule):
+        super().__init__()
+        self.data_module = data_module
+
+    @property
+    def num_train_samples(self) -> int:
+        return len(self.data_module.train_dataset)
+
+    def prepare_data(self):
+        self.data_module.prepare_data()
+
+    def setup(self, stage=None):
+        self.data_module.setup(stage)
+        if stage == "fit" or stage is None:
+            self.data_module.train_dataset = IndexedDataset(
+                self.data_module.train_dataset
+            )
+
+    def train_dataloader(self):
+        return self.data_module.train_dataloader()
+
+    def val_dataloader(self):
+        return self.data_module.val_dataloader()
+
+    def test_dataloader(self):
+        return self.data_module.test_dataloader()
@@ -8,6 +8,7 @@ from prepare import (
     CIFAR10DataModule,
     CIFAR100DataModule,
     ImageNetDataModule,
+    IndexedTrainDataModule,
     RotatedMNISTDataModule,
     STL10DataModule,
 )
@@ -18,6 +19,9 @@ def get_model_data_and_callbacks(hyperparams: DictConfig) -> tuple:
 
     # get image data
     image_data = get_image_data(hyperparams.dataset)
+    if hyperparams.prediction.get("orbit_feature_cache", None):
+        # the cached encoder features are looked up by the index of the training samples
+        image_data = IndexedTrainDataModule(image_data)
 
     # checkpoint callbacks
     callbacks = get_callbacks(hyperparams)
@@ -0,0 +1,123 @@
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+
+class SAMEmbeddingStore:
+    """
+    Disk-backed SAM image embeddings for every (COCO image id, group element) pair.
+
+    With a frozen image encoder and a discrete canonicalizer, a canonicalized image is one of the |G|
+    transformed copies of the input, so the embeddings of the whole orbit of an image can be computed once,
+    either offline (`experiment.run_mode=build_embedding_store`) or the first time the image is seen.
+    The embeddings are stored in float16 in memory-mapped shards `shard_<k>.npy` of shape
+    (shard_size, num_group, *embedding_shape), the image of every row in `image_ids.npy` and whether
+    it is filled in `filled.npy`. Rows are read back as views of the mapped files, without a copy.
+
+    The store is only valid if the image encoder is frozen and the training transforms are deterministic.
+    What the embeddings depend on (model, checkpoint, dataset, transforms, group) is stored in
+    `metadata.json`, and a store written with different metadata is refused instead of silently reused.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_group: int,
+        embedding_shape: Sequence[int],
+        shard_size: int = 1024,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.path = path
+        self.num_group = num_group
+        self.embedding_shape = tuple(embedding_shape)
+        self.shard_size = shard_size
+        # round trip through json so that it compares equal to the stored metadata
+        self.metadata = json.loads(json.dumps(metadata or {}))
+        self.rows = {}
+        self.shards = []
+        self.filled = None
+
+    def open(self, image_ids: List[int], create: bool = True) -> None:
+        # the process that creates the files must be done before the others open them
+        image_ids_path = os.path.join(self.path, "image_ids.npy")
+        filled_path = os.path.join(self.path, "filled.npy")
+        metadata_path = os.path.join(self.path, "metadata.json")
+        num_shards = math.ceil(len(image_ids) / self.shard_size)
+        shard_shape = (self.shard_size, self.num_group, *self.embedding_shape)
+        if not os.path.exists(image_ids_path):
+            if not create:
+                raise FileNotFoundError(f"{image_ids_path} does not exist")
+            os.makedirs(self.path, exist_ok=True)
+            with open(metadata_path, "w") as f:
+                json.dump(self.metadata, f, indent=2, sort_keys=True)
+            # the shards are sparse files until their rows are written
+            for shard in range(num_shards):
+                np.lib.format.open_memmap(
+                    self.get_shard_path(shard),
+                    mode="w+",
+                    dtype=np.float16,
+                    shape=shard_shape,
+                )
+            np.lib.format.open_memmap(
+                filled_path, mode="w+", dtype=np.bool_, shape=(len(image_ids),)
+            )
+            np.save(image_ids_path, np.asarray(image_ids, dtype=np.int64))
+
+        if not os.path.exists(metadata_path):
+            raise ValueError(
+                f"The store in {self.path} has no metadata.json, delete the directory"
+            )
+        with open(metadata_path) as f:
+            stored_metadata = json.load(f)
+        if stored_metadata != self.metadata:
+            raise ValueError(
+                f"The store in {self.path} was written with {stored_metadata}, "
+                f"expected {self.metadata}, delete the directory or use another one"
+            )
+        stored_image_ids = np.load(image_ids_path)
+        if not np.array_equal(stored_image_ids, np.asarray(image_ids)):
+            raise ValueError(f"The store in {self.path} holds other images")
+        self.rows = {int(image_id): row for row, image_id in enumerate(image_ids)}
+        self.shards = [
+            np.load(self.get_shard_path(shard), mmap_mode="r+")
+            for shard in range(num_shards)
+        ]
+        if self.shards and self.shards[0].shape != shard_shape:
+            raise ValueError(
+                f"The store in {self.path} holds embeddings of shape "
+                f"{self.shards[0].shape[1:]}, expected {shard_shape[1:]}"
+            )
+        self.filled = np.load(filled_path, mmap_mode="r+")
+
+    def get_shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, f"shard_{shard}.npy")
+
+    def get(self, image_ids: List[int]) -> Tuple[List[torch.Tensor], torch.Tensor]:
+        # the embeddings of the orbit of every image, (num_group, *embedding_shape),
+        # as views of the mapped shards, and whether they were filled
+        rows = [self.rows[int(image_id)] for image_id in image_ids]
+        embeddings = [
+            torch.from_numpy(self.shards[row // self.shard_size][row % self.shard_size])
+            for row in rows
+        ]
+        return embeddings, torch.from_numpy(self.filled[rows])
+
+    def put(self, image_ids: List[int], embeddings: torch.Tensor) -> None:
+        embeddings = embeddings.detach().to(torch.float16).cpu().numpy()
+        for image_id, image_embeddings in zip(image_ids, embeddings):
+            row = self.rows[int(image_id)]
+            self.shards[row // self.shard_size][row % self.shard_size] = (
+                image_embeddings
+            )
+            # mark the image as filled only once its embeddings are written
+            self.filled[row] = True
+
+    def flush(self) -> None:
+        for shard in self.shards:
+            shard.flush()
+        if self.filled is not None:
+            self.filled.flush()
@@ -1,13 +1,53 @@
-import copy
 import math
-from typing import Tuple, Union
+from typing import Dict, List, Tuple, Union
 
 import torch
 from omegaconf import DictConfig
 from torchmetrics.detection.mean_ap import MeanAveragePrecision
 from torchvision import transforms
 
-from equiadapt.images.utils import flip_boxes, flip_masks, rotate_boxes, rotate_masks
+from equiadapt.images.utils import transform_targets, use_exact_rotations
+
+MAP_KEYS = (
+    "map",
+    "map_small",
+    "map_medium",
+    "map_large",
+    "map_50",
+    "map_75",
+    "mar_1",
+    "mar_10",
+    "mar_100",
+    "mar_small",
+    "mar_medium",
+    "mar_large",
+)
+
+
+def get_map_metric() -> MeanAveragePrecision:
+    # accumulates the predictions and targets of a whole epoch (torchmetrics keeps the
+    # masks run-length encoded) and only runs the COCO matching when computed
+    return MeanAveragePrecision(iou_type="segm")
+
+
+def update_map_metric(
+    map_metric: MeanAveragePrecision, outputs: List[dict], targets: List[dict]
+) -> None:
+    map_metric.update(
+        [
+            dict(
+                boxes=output["boxes"],
+                labels=output["labels"],
+                scores=output["scores"],
+                masks=output["masks"],
+            )
+            for output in outputs
+        ],
+        [
+            dict(boxes=target["boxes"], labels=target["labels"], masks=target["masks"])
+            for target in targets
+        ],
+    )
 
 
 class VanillaInference:
@@ -16,6 +56,14 @@ class VanillaInference:
     ) -> None:
         self.canonicalizer = canonicalizer
         self.prediction_network = prediction_network
+        self.num_group_elements = 1
+
+    def get_map_metrics(self) -> torch.nn.ModuleList:
+        # one epoch-level accumulator per group element, to be registered on the LightningModule
+        # so that they follow its device and are synced across processes when computed
+        return torch.nn.ModuleList(
+            [get_map_metric() for _ in range(self.num_group_elements)]
+        )
 
     def forward(
         self, x: torch.Tensor, targets: torch.Tensor
@@ -30,30 +78,20 @@ class VanillaInference:
         # For uniformity, we will ensure the prediction network returns both losses and predictions irrespective of the model
         return self.prediction_network(x_canonicalized, targets_canonicalized)
 
-    def get_inference_metrics(self, x: torch.Tensor, targets: torch.Tensor) -> dict:
+    def update_inference_metrics(
+        self,
+        map_metrics: torch.nn.ModuleList,
+        x: torch.Tensor,
+        targets: torch.Tensor,
+    ) -> None:
         # Forward pass through the prediction network
         _, _, _, outputs = self.forward(x, targets)
+        update_map_metric(map_metrics[0], outputs, targets)
 
-        _map = MeanAveragePrecision(iou_type="segm")
-        targets = [
-            dict(boxes=target["boxes"], labels=target["labels"], masks=target["masks"])
-            for target in targets
-        ]
-        outputs = [
-            dict(
-                boxes=output["boxes"],
-                labels=output["labels"],
-                scores=output["scores"],
-                masks=output["masks"],
-            )
-            for output in outputs
-        ]
-        _map.update(outputs, targets)
-        _map_dict = _map.compute()
-
-        metrics = {"test/map": _map_dict["map"]}
-
-        return metrics
+    def compute_inference_metrics(
+        self, map_metrics: torch.nn.ModuleList
+    ) -> Dict[str, torch.Tensor]:
+        return {"test/map": map_metrics[0].compute()["map"]}
 
 
 class GroupInference(VanillaInference):
@@ -75,146 +113,80 @@ class GroupInference(VanillaInference):
         )
         self.pad = transforms.Pad(math.ceil(in_shape[-2] * 0.4), padding_mode="edge")
         self.crop = transforms.CenterCrop((in_shape[-2], in_shape[-1]))
-
-    def get_group_element_wise_maps(
-        self, images: torch.Tensor, targets: torch.Tensor
-    ) -> dict:
-        map_dict = dict()
-        image_width = images[0].shape[1]
+        self.rotation_backend = inference_hyperparams.get("rotation_backend", "auto")
+
+    def apply_group_element(
+        self, images: torch.Tensor, degree: float, reflect: bool = False
+    ) -> torch.Tensor:
+        if use_exact_rotations(images, self.num_rotations, self.rotation_backend):
+            # rotations by multiples of 90 degrees only permute the pixels,
+            # so there is nothing to pad, interpolate or crop
+            if reflect:
+                images = images.flip(-1)
+            steps = round(degree / 90) % 4
+            return torch.rot90(images, steps, dims=(-2, -1)) if steps else images
+
+        images = self.pad(images)
+        if reflect:
+            images = transforms.functional.hflip(images)
+        images = transforms.functional.rotate(images, degree)
+        return self.crop(images)
+
+    def update_group_element_wise_maps(
+        self,
+        map_metrics: torch.nn.ModuleList,
+        images: torch.Tensor,
+        targets: torch.Tensor,
+    ) -> None:
+        batch_size, _, _, image_width = images.shape
 
         degrees = torch.linspace(0, 360, self.num_rotations + 1)[:-1]
-        for rot, degree in enumerate(degrees):
-
-            targets_transformed = copy.deepcopy(targets)
+        for element in range(self.num_group_elements):
+            degree = degrees[element % self.num_rotations]
+            reflect = element >= self.num_rotations
 
             # apply group element on images
-            images_pad = self.pad(images)
-            images_rot = transforms.functional.rotate(images_pad, degree.item())
-            images_rot = self.crop(images_rot)
-
-            # apply group element on bounding boxes and masks
-            for t in range(len(targets_transformed)):
-                targets_transformed[t]["boxes"] = rotate_boxes(
-                    targets_transformed[t]["boxes"], -degree, image_width
-                )
-                targets_transformed[t]["masks"] = rotate_masks(
-                    targets_transformed[t]["masks"], degree.item()
-                )
+            images_transformed = self.apply_group_element(
+                images, degree.item(), reflect=reflect
+            )
+
+            # apply the same group element (maybe flipping, then rotating counter-clockwise
+            # by degree) on the bounding boxes and masks of the whole batch at once
+            targets_transformed = transform_targets(
+                targets,
+                -degree.expand(batch_size),
+                image_width,
+                reflect=torch.ones(batch_size) if reflect else None,
+                num_rotations=self.num_rotations,
+                backend=self.rotation_backend,
+            )
 
             # get predictions for the transformed images
-            _, _, _, outputs = self.forward(images_rot, targets_transformed)
-
-            Map = MeanAveragePrecision(iou_type="segm")
-            targets = [
-                dict(
-                    boxes=target["boxes"],
-                    labels=target["labels"],
-                    masks=target["masks"],
-                )
-                for target in targets
-            ]
-            outputs = [
-                dict(
-                    boxes=output["boxes"],
-                    labels=output["labels"],
-                    scores=output["scores"],
-                    masks=output["masks"],
-                )
-                for output in outputs
-            ]
-            Map.update(outputs, targets)
-
-            map_dict[rot] = Map.compute()
-
-        if self.group_type == "roto-reflection":
-            # Rotate the reflected images and get the logits
-            for rot, degree in enumerate(degrees):
-
-                images_pad = self.pad(images)
-                images_reflect = transforms.functional.hflip(images_pad)
-                images_rotoreflect = transforms.functional.rotate(
-                    images_reflect, degree.item()
-                )
-                images_rotoreflect = self.crop(images_rotoreflect)
-
-                # apply group element on bounding boxes and masks
-                for t in range(len(targets_transformed)):
-                    targets_transformed[t]["boxes"] = rotate_boxes(
-                        targets_transformed[t]["boxes"], -degree, image_width
-                    )
-                    targets_transformed[t]["boxes"] = flip_boxes(
-                        targets_transformed[t]["boxes"], image_width
-                    )
-
-                    targets_transformed[t]["masks"] = rotate_masks(
-                        targets_transformed[t]["masks"], degree
-                    )
-                    targets_transformed[t]["masks"] = flip_masks(
-                        targets_transformed[t]["masks"]
-                    )
-
-                # get predictions for the transformed images
-                _, _, _, outputs = self.forward(images_rotoreflect, targets_transformed)
-
-                Map = MeanAveragePrecision(iou_type="segm")
-                targets = [
-                    dict(
-                        boxes=target["boxes"],
-                        labels=target["labels"],
-                        masks=target["masks"],
-                    )
-                    for target in targets
-                ]
-                outputs = [
-                    dict(
-                        boxes=output["boxes"],
-                        labels=output["labels"],
-                        scores=output["scores"],
-                        masks=output["masks"],
-                    )
-                    for output in outputs
-                ]
-                Map.update(outputs, targets)
-
-                map_dict[rot + len(degrees)] = Map.compute()
-
-        return map_dict
-
-    def get_inference_metrics(
-        self, images: torch.Tensor, targets: torch.Tensor
-    ) -> dict:
+            _, _, _, outputs = self.forward(images_transformed, targets_transformed)
+
+            update_map_metric(map_metrics[element], outputs, targets)
+
+    def update_inference_metrics(
+        self,
+        map_metrics: torch.nn.ModuleList,
+        images: torch.Tensor,
+        targets: torch.Tensor,
+    ) -> None:
+        self.update_group_element_wise_maps(map_metrics, images, targets)
+
+    def compute_inference_metrics(
+        self, map_metrics: torch.nn.ModuleList
+    ) -> Dict[str, torch.Tensor]:
         metrics = {}
 
-        map_dict = self.get_group_element_wise_maps(images, targets)
+        # the COCO matching runs once per group element, on the predictions of the whole epoch
+        map_dict = {i: map_metrics[i].compute() for i in range(self.num_group_elements)}
 
-        # Use list comprehension to calculate accuracy for each group element
         for i in range(self.num_group_elements):
             metrics.update(
                 {
-                    f"test/map_group_element_{i}": max(map_dict[i]["map"], 0.0),
-                    f"test/map_small_group_element_{i}": max(
-                        map_dict[i]["map_small"], 0.0
-                    ),
-                    f"test/map_medium_group_element_{i}": max(
-                        map_dict[i]["map_medium"], 0.0
-                    ),
-                    f"test/map_large_group_element_{i}": max(
-                        map_dict[i]["map_large"], 0.0
-                    ),
-                    f"test/map_50_group_element_{i}": max(map_dict[i]["map_50"], 0.0),
-                    f"test/map_75_group_element_{i}": max(map_dict[i]["map_75"], 0.0),
-                    f"test/mar_1_group_element_{i}": max(map_dict[i]["mar_1"], 0.0),
-                    f"test/mar_10_group_element_{i}": max(map_dict[i]["mar_10"], 0.0),
-                    f"test/mar_100_group_element_{i}": max(map_dict[i]["mar_100"], 0.0),
-                    f"test/mar_small_group_element_{i}": max(
-                        map_dict[i]["mar_small"], 0.0
-                    ),
-                    f"test/mar_medium_group_element_{i}": max(
-                        map_dict[i]["mar_medium"], 0.0
-                    ),
-                    f"test/mar_large_group_element_{i}": max(
-                        map_dict[i]["mar_large"], 0.0
-                    ),
+                    f"test/{key}_group_element_{i}": max(map_dict[i][key], 0.0)
+                    for key in MAP_KEYS
                 }
             )
 
@@ -223,12 +195,6 @@ class GroupInference(VanillaInference):
         )
 
         metrics.update({"test/group_map": torch.mean(map_per_group_element)})
-        metrics.update(
-            {
-                f"test/map_group_element_{i}": max(map_per_group_element[i], 0.0)
-                for i in range(self.num_group_elements)
-            }
-        )
 
         # Calculate the overall map
         metrics.update({"test/map": max(map_dict[0]["map"], 0.0)})
@@ -1,11 +1,18 @@
 import pytorch_lightning as pl
 import torch
-from inference_utils import get_inference_method
+from embedding_store import SAMEmbeddingStore
+from inference_utils import (
+    MAP_KEYS,
+    get_inference_method,
+    get_map_metric,
+    update_map_metric,
+)
 from model_utils import calc_iou, get_dataset_specific_info, get_prediction_network
 from omegaconf import DictConfig
 from torch.optim.lr_scheduler import MultiStepLR
-from torchmetrics.detection.mean_ap import MeanAveragePrecision
 
+from equiadapt import DiscreteGroupImageCanonicalization
+from equiadapt.images.utils import transform_targets
 from examples.images.common.utils import get_canonicalization_network, get_canonicalizer
 
 
@@ -51,10 +58,116 @@ class ImageSegmentationPipeline(pl.LightningModule):
             self.image_shape,
         )
 
+        # epoch-level mAP accumulators, computed once at the end of the epoch
+        self.val_map = get_map_metric()
+        self.test_maps = self.inference_method.get_map_metrics()
+
         self.max_epochs = hyperparams.experiment.training.num_epochs
 
+        # SAM image embeddings of the orbit of every training image
+        self.embedding_store = None
+        if hyperparams.prediction.get("embedding_store", None):
+            if not (
+                hyperparams.prediction.freeze_encoder
+                and hyperparams.prediction.prediction_network_architecture == "sam"
+                and isinstance(self.canonicalizer, DiscreteGroupImageCanonicalization)
+            ):
+                raise ValueError(
+                    "The embedding store needs a frozen Segment-Anything model "
+                    "and a discrete group canonicalization"
+                )
+            if hyperparams.dataset.augment == "flip":
+                raise ValueError(
+                    "The embedding store needs deterministic training transforms, "
+                    "set dataset.augment to something other than flip"
+                )
+            prompt_encoder = self.prediction_network.model.prompt_encoder
+            # what the stored embeddings depend on, checked against the store directory
+            prediction = hyperparams.prediction
+            embedding_store_metadata = {
+                "architecture": prediction.prediction_network_architecture,
+                "architecture_type": prediction.prediction_network_architecture_type,
+                "pretrained_ckpt_path": prediction.pretrained_ckpt_path,
+                "dataset_name": hyperparams.dataset.dataset_name,
+                "augment": hyperparams.dataset.augment,
+                "img_size": hyperparams.dataset.img_size,
+                "group_type": self.canonicalizer.group_type,
+                "num_group": self.canonicalizer.num_group,
+            }
+            self.embedding_store = SAMEmbeddingStore(
+                prediction.embedding_store,
+                self.canonicalizer.num_group,
+                (prompt_encoder.embed_dim, *prompt_encoder.image_embedding_size),
+                shard_size=prediction.get("embedding_store_shard_size", 1024),
+                metadata=embedding_store_metadata,
+            )
+
         self.save_hyperparameters()
 
+    def open_embedding_store(self) -> None:
+        image_ids = self.trainer.datamodule.train_dataset.image_ids
+        # the first process creates the memory-mapped files, the others open them
+        if self.trainer.is_global_zero:
+            self.embedding_store.open(image_ids)
+        self.trainer.strategy.barrier()
+        if not self.trainer.is_global_zero:
+            self.embedding_store.open(image_ids, create=False)
+
+    def on_fit_start(self) -> None:
+        if self.embedding_store is not None:
+            self.open_embedding_store()
+
+    @torch.no_grad()
+    def compute_orbit_embeddings(self, x: torch.Tensor) -> torch.Tensor:
+        # embeddings of x canonicalized by every group element, (batch_size, num_group, *embedding_shape)
+        batch_size = x.shape[0]
+        angles = self.canonicalizer.group_element_angles
+        reflections = self.canonicalizer.group_element_reflections
+        orbit_embeddings = []
+        for group_element in range(self.canonicalizer.num_group):
+            group_element_dict = {"rotation": angles[group_element].expand(batch_size)}
+            if self.canonicalizer.group_type == "roto-reflection":
+                group_element_dict["reflection"] = reflections[group_element].expand(
+                    batch_size
+                )
+            x_canonicalized = self.canonicalizer.warp_images(x, group_element_dict)
+            orbit_embeddings.append(
+                self.prediction_network.model.image_encoder(x_canonicalized)
+            )
+        return torch.stack(orbit_embeddings, dim=1)
+
+    def get_orbit_embeddings(self, x: torch.Tensor, image_ids: list) -> torch.Tensor:
+        # stored embeddings of the orbit of every image, computed when it is first seen
+        embeddings, is_filled = self.embedding_store.get(image_ids)
+        if not is_filled.all():
+            missing = (~is_filled).nonzero()[:, 0].tolist()
+            missing_embeddings = self.compute_orbit_embeddings(x[missing])
+            self.embedding_store.put(
+                [image_ids[i] for i in missing], missing_embeddings
+            )
+            for i, missing_embedding in zip(missing, missing_embeddings):
+                embeddings[i] = missing_embedding
+        return torch.stack(
+            [embedding.to(x.device, non_blocking=True) for embedding in embeddings]
+        ).to(x.dtype)
+
+    def canonicalize_targets(
+        self, targets: list, group_element_onehot: torch.Tensor, width: int
+    ) -> list:
+        # the targets transformed by the predicted group elements, as in canonicalize
+        group_elements = group_element_onehot.detach().argmax(dim=-1)
+        reflect = None
+        if self.canonicalizer.group_type == "roto-reflection":
+            reflect = self.canonicalizer.group_element_reflections[group_elements]
+        return transform_targets(
+            targets,
+            self.canonicalizer.group_element_angles[group_elements],
+            width,
+            reflect=reflect,
+            num_rotations=self.canonicalizer.num_rotations,
+            backend=self.canonicalizer.rotation_backend,
+        )
+
     def apply_loss(
         self,
         loss_dict: dict,
@@ -116,9 +229,25 @@ class ImageSegmentationPipeline(pl.LightningModule):
         training_metrics = {}
         loss = 0.0
 
-        # canonicalize the input data
-        # For the vanilla model, the canonicalization is the identity transformation
-        x_canonicalized, targets_canonicalized = self.canonicalizer(x, targets)
+        if self.embedding_store is not None:
+            # only the group element is needed, the embeddings of the canonicalized images are stored
+            group_activations, canonicalization_info = (
+                self.canonicalizer.get_group_activations_and_info(x)
+            )
+            canonicalization_info["group_activations"] = group_activations
+            self.canonicalizer.canonicalization_info_dict = canonicalization_info
+            group_element_onehot = (
+                self.canonicalizer.groupactivations_to_groupelementonehot(
+                    group_activations
+                )
+            )
+            targets_canonicalized = self.canonicalize_targets(
+                targets, group_element_onehot, width
+            )
+        else:
+            # canonicalize the input data
+            # For the vanilla model, the canonicalization is the identity transformation
+            x_canonicalized, targets_canonicalized = self.canonicalizer(x, targets)
 
         # add group contrast loss while using optmization based canonicalization method
         if "opt" in self.hyperparams.canonicalization_type:
@@ -140,9 +269,24 @@ class ImageSegmentationPipeline(pl.LightningModule):
             # Finetuning maskrcnn model will return the losses which can be used to fine tune the model
             # Meanwhile, Segment-Anything (SAM) can return boxes, ious, masks predictions
             # For uniformity, we will ensure the prediction network returns both losses and predictions irrespective of the model
-            loss_dict, pred_masks, iou_predictions, _ = self.prediction_network(
-                x_canonicalized, targets_canonicalized
-            )
+            if self.embedding_store is not None:
+                # the (straight-through) one-hot encoding selects the embeddings of the predicted
+                # group element, and the gradient flows to the canonicalizer through its soft weights
+                orbit_embeddings = self.get_orbit_embeddings(
+                    x, [int(target["image_id"]) for target in targets]
+                )
+                image_embeddings = torch.einsum(
+                    "bg,bg...->b...", group_element_onehot, orbit_embeddings
+                )
+                loss_dict, pred_masks, iou_predictions, _ = (
+                    self.prediction_network.forward_embeddings(
+                        image_embeddings, targets_canonicalized, (height, width)
+                    )
+                )
+            else:
+                loss_dict, pred_masks, iou_predictions, _ = self.prediction_network(
+                    x_canonicalized, targets_canonicalized
+                )
 
             # no requirement to invert canonicalization for the loss calculation
             # since we will compute the loss w.r.t canonicalized targets (to align with the loss computation in maskrcnn)
@@ -181,6 +325,10 @@ class ImageSegmentationPipeline(pl.LightningModule):
         assert not torch.isnan(loss), "Loss is NaN"
         return {"loss": loss}
 
+    def on_train_epoch_end(self) -> None:
+        if self.embedding_store is not None:
+            self.embedding_store.flush()
+
     def validation_step(self, batch: torch.Tensor):
         x, targets = batch
         x = torch.stack(x)
@@ -203,52 +351,32 @@ class ImageSegmentationPipeline(pl.LightningModule):
             x_canonicalized, targets_canonicalized
         )
 
-        _map = MeanAveragePrecision(iou_type="segm")
-        targets = [
-            dict(boxes=target["boxes"], labels=target["labels"], masks=target["masks"])
-            for target in targets
-        ]
-        outputs = [
-            dict(
-                boxes=output["boxes"],
-                labels=output["labels"],
-                scores=output["scores"],
-                masks=output["masks"],
-            )
-            for output in outputs
-        ]
-        _map.update(outputs, targets)
-        _map_dict = _map.compute()
-
-        validation_metrics.update(
-            {
-                "val/map": _map_dict["map"],
-                "val/map_small": _map_dict["map_small"],
-                "val/map_medium": _map_dict["map_medium"],
-                "val/map_large": _map_dict["map_large"],
-                "val/map_50": _map_dict["map_50"],
-                "val/map_75": _map_dict["map_75"],
-                "val/mar_1": _map_dict["mar_1"],
-                "val/mar_10": _map_dict["mar_10"],
-                "val/mar_100": _map_dict["mar_100"],
-                "val/mar_small": _map_dict["mar_small"],
-                "val/mar_medium": _map_dict["mar_medium"],
-                "val/mar_large": _map_dict["mar_large"],
-            }
-        )
+        # the mAP is computed over the whole validation set in on_validation_epoch_end
+        update_map_metric(self.val_map, outputs, targets)
 
         # Log the identity metric if the prior weight is non-zero
         if self.hyperparams.experiment.training.loss.prior_weight:
             metric_identity = self.canonicalizer.get_identity_metric()
             validation_metrics.update({"val/identity_metric": metric_identity})
 
+        if validation_metrics:
+            self.log_dict(
+                {
+                    key: value.to(self.device)
+                    for key, value in validation_metrics.items()
+                },
+                prog_bar=True,
+                sync_dist=True,
+            )
+
+    def on_validation_epoch_end(self):
+        # torchmetrics gathers the accumulated predictions of every process before computing
+        map_dict = self.val_map.compute()
         self.log_dict(
-            {key: value.to(self.device) for key, value in validation_metrics.items()},
+            {f"val/{key}": map_dict[key].to(self.device) for key in MAP_KEYS},
             prog_bar=True,
-            sync_dist=True,
         )
-
-        return {"map": _map_dict["map"]}
+        self.val_map.reset()
 
     def test_step(self, batch: torch.Tensor):
         images, targets = batch
@@ -258,16 +386,22 @@ class ImageSegmentationPipeline(pl.LightningModule):
         # assert that the input is in the right shape
         assert (num_channels, height, width) == self.image_shape
 
-        test_metrics = self.inference_method.get_inference_metrics(images, targets)
+        # the metrics are computed over the whole test set in on_test_epoch_end
+        self.inference_method.update_inference_metrics(self.test_maps, images, targets)
+
+    def on_test_epoch_end(self):
+        test_metrics = self.inference_method.compute_inference_metrics(self.test_maps)
 
         # Log the test metrics
         self.log_dict(
-            {key: value.to(self.device) for key, value in test_metrics.items()},
+            {
+                key: torch.as_tensor(value, device=self.device)
+                for key, value in test_metrics.items()
+            },
             prog_bar=True,
-            sync_dist=True,
         )
-
-        return test_metrics
+        for map_metric in self.test_maps:
+            map_metric.reset()
 
     def configure_optimizers(self):
         # using SGD optimizer and MultiStepLR scheduler
@@ -122,10 +122,25 @@ class SAMModel(nn.Module):
             images = torch.stack(images)
         _, _, H, W = images.shape
         image_embeddings = self.model.image_encoder(images)
+        return self.forward_embeddings(image_embeddings, targets, (H, W))
+
+    def forward_embeddings(
+        self,
+        image_embeddings: torch.Tensor,
+        targets: List[Dict[str, torch.Tensor]],
+        image_size: Tuple[int, int],
+    ) -> Tuple[
+        Optional[Dict[str, torch.Tensor]],
+        List[torch.Tensor],
+        List[torch.Tensor],
+        List[Dict[str, torch.Tensor]],
+    ]:
+        # prompt encoder and mask decoder on the (possibly cached) image embeddings
+        H, W = image_size
         pred_masks: List[torch.Tensor] = []
         ious: List[torch.Tensor] = []
         outputs: List[Dict[str, torch.Tensor]] = []
-        for _, embedding, target in zip(images, image_embeddings, targets):
+        for embedding, target in zip(image_embeddings, targets):
             bbox = target["boxes"]
 
             sparse_embeddings, dense_embeddings = self.model.prompt_encoder(
@@ -7,7 +7,12 @@ import torch
 import wandb
 from omegaconf import DictConfig, OmegaConf
 from pytorch_lightning.loggers import WandbLogger
-from train_utils import get_model_data_and_callbacks, get_trainer, load_envs
+from train_utils import (
+    build_embedding_store,
+    get_model_data_and_callbacks,
+    get_trainer,
+    load_envs,
+)
 
 
 def train_images(hyperparams: DictConfig) -> None:
@@ -101,6 +106,12 @@ def train_images(hyperparams: DictConfig) -> None:
     # get model, callbacks, and image data
     model, image_data, callbacks = get_model_data_and_callbacks(hyperparams)
 
+    if hyperparams.experiment.run_mode == "build_embedding_store":
+        if model.embedding_store is None:
+            raise ValueError("prediction.embedding_store must be set")
+        build_embedding_store(model, image_data, hyperparams.device)
+        return
+
     if hyperparams.canonicalization_type in (
         "group_equivariant",
         "opt_equivariant",
@@ -2,6 +2,7 @@ from typing import Optional
 
 import dotenv
 import pytorch_lightning as pl
+import torch
 from model import ImageSegmentationPipeline
 from omegaconf import DictConfig
 from prepare import COCODataModule
@@ -22,6 +23,28 @@ def get_model_data_and_callbacks(hyperparams: DictConfig) -> tuple:
     return model, image_data, callbacks
 
 
+@torch.no_grad()
+def build_embedding_store(
+    model: pl.LightningModule, image_data: pl.LightningDataModule, device: str
+) -> None:
+    # fill the embedding store of the model with the orbit of every training image
+    model.to(device)
+    model.eval()
+    image_data.setup("fit")
+    model.embedding_store.open(image_data.train_dataset.image_ids)
+    for x, targets in image_data.train_dataloader():
+        x = torch.stack(x).to(device)
+        image_ids = [int(target["image_id"]) for target in targets]
+        _, is_filled = model.embedding_store.get(image_ids)
+        missing = (~is_filled).nonzero()[:, 0].tolist()
+        if missing:
+            model.embedding_store.put(
+                [image_ids[i] for i in missing],
+                model.compute_orbit_embeddings(x[missing]),
+            )
+    model.embedding_store.flush()
+
+
 def get_model_pipeline(hyperparams: DictConfig) -> pl.LightningModule:
 
     if hyperparams.experiment.run_mode == "test":
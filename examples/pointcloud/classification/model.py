@@ -39,6 +39,9 @@ class PointcloudClassificationPipeline(pl.LightningModule):
             hyperparams.prediction,
         )
 
+        if hyperparams.experiment.get("instrumentation", False):
+            self.canonicalizer.enable_instrumentation(self.prediction_network)
+
         self.save_hyperparameters()
 
     def maybe_transform_points(
@@ -96,7 +99,10 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         # calculate the task loss which is the cross-entropy loss for classification
         if self.hyperparams.experiment.training.loss.task_weight:
             # Get the outputs from the prediction network
-            logits = self.prediction_network(canonicalized_points)
+            logits = self.prediction_network(
+                canonicalized_points,
+                idx=self.canonicalizer.get_canonicalization_info_dict().get("knn_idx"),
+            )
 
             # Get the task loss
             task_loss = self.get_loss(logits, targets)
@@ -151,7 +157,10 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         canonicalized_points = self.canonicalizer(points)
 
         # Get the outputs from the prediction network
-        logits = self.prediction_network(canonicalized_points)
+        logits = self.prediction_network(
+            canonicalized_points,
+            idx=self.canonicalizer.get_canonicalization_info_dict().get("knn_idx"),
+        )
 
         preds = logits.max(dim=1)[1]
 
@@ -194,7 +203,10 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         canonicalized_points = self.canonicalizer(points)
 
         # Get the outputs from the prediction network
-        logits = self.prediction_network(canonicalized_points)
+        logits = self.prediction_network(
+            canonicalized_points,
+            idx=self.canonicalizer.get_canonicalization_info_dict().get("knn_idx"),
+        )
 
         preds = logits.max(dim=1)[1]
 
@@ -208,6 +220,7 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         test_pred = np.concatenate(self.test_pred)
         test_acc = metrics.accuracy_score(test_true, test_pred)
         avg_per_class_acc = metrics.balanced_accuracy_score(test_true, test_pred)
+        self.log_instrumentation_metrics()
         self.log_dict(
             {
                 "test/acc": test_acc,
@@ -219,6 +232,15 @@ class PointcloudClassificationPipeline(pl.LightningModule):
 
         return {"test/acc": test_acc, "test/avg_per_class_acc": avg_per_class_acc}
 
+    def on_train_epoch_end(self) -> None:
+        self.log_instrumentation_metrics()
+
+    def log_instrumentation_metrics(self) -> None:
+        # time and memory of every stage of the canonicalization pipeline since the last call
+        if self.canonicalizer.instrumentation is not None:
+            self.log_dict(self.canonicalizer.instrumentation.get_metrics())
+            self.canonicalizer.instrumentation.reset()
+
     def get_loss(
         self,
         predictions: torch.Tensor,
@@ -6,14 +6,7 @@ import torch.nn.functional as F
 import torch.nn.init as init
 from omegaconf import DictConfig
 
-
-def knn(x: torch.Tensor, k: int) -> torch.Tensor:
-    inner = -2 * torch.matmul(x.transpose(2, 1), x)
-    xx = torch.sum(x**2, dim=1, keepdim=True)
-    pairwise_distance = -xx - inner - xx.transpose(2, 1)
-
-    idx = pairwise_distance.topk(k=k, dim=-1)[1]  # (batch_size, num_points, k)
-    return idx
+from equiadapt.pointcloud.utils import knn
 
 
 def get_graph_feature(
@@ -48,6 +41,18 @@ def get_graph_feature(
     return feature
 
 
+def select_knn_idx(idx: Optional[torch.Tensor], k: int) -> Optional[torch.Tensor]:
+    """
+    Keeps the k nearest neighbors of precomputed indices sorted nearest first.
+
+    Returns None when no indices are given or when they have fewer than k neighbors,
+    in which case the graph is recomputed by `get_graph_feature`.
+    """
+    if idx is None or idx.size(-1) < k:
+        return None
+    return idx[..., :k]
+
+
 class PointNet(nn.Module):
     def __init__(self, hyperparams: DictConfig):
         super().__init__()
@@ -66,7 +71,10 @@ class PointNet(nn.Module):
         self.dp1 = nn.Dropout()
         self.linear2 = nn.Linear(512, hyperparams.num_classes)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self, x: torch.Tensor, idx: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        # idx is accepted for interface parity with DGCNN, PointNet does not use a knn graph
         x = F.relu(self.bn1(self.conv1(x)))
         x = F.relu(self.bn2(self.conv2(x)))
         x = F.relu(self.bn3(self.conv3(x)))
@@ -123,10 +131,12 @@ class DGCNN(nn.Module):
         self.dp2 = nn.Dropout(p=hyperparams.dropout)
         self.linear3 = nn.Linear(256, hyperparams.num_classes)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self, x: torch.Tensor, idx: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
         batch_size = x.size(0)
         x = get_graph_feature(
-            x, k=self.k
+            x, k=self.k, idx=select_knn_idx(idx, self.k)
         )  # (batch_size, 3, num_points) -> (batch_size, 3*2, num_points, k)
         x = self.conv1(
             x
@@ -332,12 +342,15 @@ class DGCNN_partseg(nn.Module):
         )
         self.conv11 = nn.Conv1d(128, self.seg_num_all, kernel_size=1, bias=False)
 
-    def forward(self, x: torch.Tensor, l: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self, x: torch.Tensor, l: torch.Tensor, idx: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
         batch_size = x.size(0)
         num_points = x.size(2)
 
+        # only the graph of the input points can be shared, the transform net is not a rotation
         x0 = get_graph_feature(
-            x, k=self.k
+            x, k=self.k, idx=select_knn_idx(idx, self.k)
         )  # (batch_size, 3, num_points) -> (batch_size, 3*2, num_points, k)
         t = self.transform_net(x0)  # (batch_size, 3, 3)
         x = x.transpose(
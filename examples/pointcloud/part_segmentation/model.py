@@ -129,7 +129,11 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         # calculate the task loss which is the cross-entropy loss for classification
         if self.hyperparams.experiment.training.loss.task_weight:
             # Get the outputs from the prediction network
-            seg_pred = self.prediction_network(canonicalized_points, label_one_hot)
+            seg_pred = self.prediction_network(
+                canonicalized_points,
+                label_one_hot,
+                idx=self.canonicalizer.get_canonicalization_info_dict().get("knn_idx"),
+            )
             seg_pred = seg_pred.transpose(2, 1).contiguous()
 
             # Loss
@@ -191,7 +195,11 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         canonicalized_points = self.canonicalizer(points)
 
         # Get the outputs from the prediction network
-        seg_pred = self.prediction_network(canonicalized_points, label_one_hot)
+        seg_pred = self.prediction_network(
+            canonicalized_points,
+            label_one_hot,
+            idx=self.canonicalizer.get_canonicalization_info_dict().get("knn_idx"),
+        )
         seg_pred = seg_pred.transpose(2, 1).contiguous()
 
         pred = seg_pred.max(dim=2)[1]
@@ -251,7 +259,11 @@ class PointcloudClassificationPipeline(pl.LightningModule):
         canonicalized_points = self.canonicalizer(points)
 
         # Get the outputs from the prediction network
-        seg_pred = self.prediction_network(canonicalized_points, label_one_hot)
+        seg_pred = self.prediction_network(
+            canonicalized_points,
+            label_one_hot,
+            idx=self.canonicalizer.get_canonicalization_info_dict().get("knn_idx"),
+        )
         seg_pred = seg_pred.transpose(2, 1).contiguous()
 
         pred = seg_pred.max(dim=2)[1]
@@ -0,0 +1,42 @@
+import torch
+
+from equiadapt.common.basecanonicalization import (
+    CanonicalizationResult,
+    ContinuousGroupCanonicalization,
+    IdentityCanonicalization,
+)
+
+
+def test_identity_canonicalize_stateless() -> None:
+    """Test that the stateless identity canonicalization returns the input and stores nothing."""
+    canonicalizer = IdentityCanonicalization()
+    x = torch.randn(2, 3, 8, 8)
+
+    result = canonicalizer.canonicalize_stateless(x)
+
+    assert isinstance(result, CanonicalizationResult)
+    assert torch.equal(result.canonicalized_x, x)
+    assert result.group_element == {}
+    # the stateless call must not touch the module state
+    assert canonicalizer.canonicalization_info_dict == {}
+    assert canonicalizer.get_identity_metric(result) == 1.0
+
+
+def test_identity_matrix_buffer() -> None:
+    """Test that the identity matrix is a non-persistent buffer built at initialization."""
+    canonicalizer = ContinuousGroupCanonicalization(
+        torch.nn.Identity(), group_rep_dim=3
+    )
+    buffers = dict(canonicalizer.named_buffers())
+
+    # the constant is a non-persistent buffer: it moves with the module but is not saved
+    assert torch.equal(buffers["identity_matrix"], torch.eye(3))
+    assert "identity_matrix" not in canonicalizer.state_dict()
+
+    group_elements_rep = torch.randn(2, 3, 3, dtype=torch.float64)
+    assert canonicalizer.get_identity_matrix(group_elements_rep).dtype == torch.float64
+    # representations of another size get their own identity, nothing is registered
+    assert torch.equal(
+        canonicalizer.get_identity_matrix(torch.randn(2, 2, 2)), torch.eye(2)
+    )
+    assert dict(canonicalizer.named_buffers()).keys() == buffers.keys()
@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import pytest
+import torch
+from omegaconf import DictConfig
+
+from equiadapt import (
+    BaseCanonicalization,
+    EquivariantPointcloudCanonicalization,
+    OptimizedGroupEquivariantImageCanonicalization,
+    OptimizedSteerableImageCanonicalization,
+    VNSmall,
+    export_onnx,
+)
+
+ort = pytest.importorskip("onnxruntime")
+
+
+def get_canonicalizer(
+    name: str, vector_network: torch.nn.Module, discrete_init_args: dict
+) -> BaseCanonicalization:
+    """
+    Builds a small canonicalizer of each kind.
+
+    Args:
+        name (str): The kind of canonicalizer, "discrete", "steerable" or "pointcloud".
+        vector_network (torch.nn.Module): The placeholder network of the image canonicalizers.
+        discrete_init_args (dict): The initialization arguments of the discrete canonicalizer.
+
+    Returns:
+        BaseCanonicalization: The canonicalizer.
+    """
+    if name == "discrete":
+        return OptimizedGroupEquivariantImageCanonicalization(**discrete_init_args)
+    if name == "steerable":
+        return OptimizedSteerableImageCanonicalization(
+            canonicalization_network=vector_network,
+            canonicalization_hyperparams=DictConfig(
+                {
+                    "group_type": "roto-reflection",
+                    "input_crop_ratio": 0.9,
+                    "resize_shape": 28,
+                }
+            ),
+            in_shape=(1, 28, 28),
+        )
+    return EquivariantPointcloudCanonicalization(
+        canonicalization_network=VNSmall(DictConfig({"n_knn": 8, "pooling": "mean"})),
+        canonicalization_hyperparams=DictConfig({}),
+    )
+
+
+@pytest.mark.parametrize(
+    "name, input_shape, prediction_network, invert_canonicalization",
+    [
+        (
+            "discrete",
+            (1, 28, 28),
+            torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(28 * 28, 10)),
+            False,
+        ),
+        (
+            "steerable",
+            (1, 28, 28),
+            torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(28 * 28, 2)),
+            True,
+        ),
+        ("pointcloud", (3, 64), torch.nn.Conv1d(3, 3, 1), False),
+    ],
+)
+def test_export_onnx_matches_pytorch(
+    name: str,
+    input_shape: tuple,
+    prediction_network: torch.nn.Module,
+    invert_canonicalization: bool,
+    vector_network: torch.nn.Module,
+    discrete_init_args: dict,
+    tmp_path: Path,
+) -> None:
+    """
+    Test that the exported graph gives the same predictions and group elements as PyTorch.
+
+    Args:
+        name (str): The kind of canonicalizer.
+        input_shape (tuple): The shape of one input.
+        prediction_network (torch.nn.Module): The prediction network.
+        invert_canonicalization (bool): Whether to invert the canonicalization of the predictions.
+        vector_network (torch.nn.Module): The placeholder network of the image canonicalizers.
+        discrete_init_args (dict): The initialization arguments of the discrete canonicalizer.
+        tmp_path (Path): The temporary directory of the ONNX file.
+    """
+    torch.manual_seed(0)
+    canonicalizer = get_canonicalizer(name, vector_network, discrete_init_args)
+    path = tmp_path / f"{name}.onnx"
+    model = export_onnx(
+        canonicalizer,
+        prediction_network,
+        torch.randn(2, *input_shape),
+        path,
+        invert_canonicalization=invert_canonicalization,
+    )
+
+    # another batch size than the one used for tracing
+    x = torch.randn(3, *input_shape)
+    session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+    output, group_element = session.run(None, {"input": x.numpy()})
+    with torch.no_grad():
+        expected_output, expected_group_element = model(x)
+
+    assert torch.allclose(torch.from_numpy(output), expected_output, atol=1e-4)
+    assert torch.allclose(
+        torch.from_numpy(group_element).to(expected_group_element.dtype),
+        expected_group_element,
+        atol=1e-5,
+    )
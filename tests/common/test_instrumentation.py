@@ -0,0 +1,55 @@
+import csv
+from pathlib import Path
+
+import torch
+from omegaconf import DictConfig
+
+from equiadapt import EquivariantPointcloudCanonicalization, VNSmall
+
+
+def test_instrumentation_records_every_stage(tmp_path: Path) -> None:
+    """
+    Test that the stages of the canonicalization and the prediction network are instrumented, and restored when disabled.
+
+    Args:
+        tmp_path (Path): The temporary directory of the CSV file.
+    """
+    torch.manual_seed(0)
+    canonicalizer = EquivariantPointcloudCanonicalization(
+        canonicalization_network=VNSmall(DictConfig({"n_knn": 8, "pooling": "mean"})),
+        canonicalization_hyperparams=DictConfig({}),
+    ).eval()
+    prediction_network = torch.nn.Conv1d(3, 4, 1)
+    x = torch.randn(2, 3, 64)
+    with torch.no_grad():
+        expected = prediction_network(canonicalizer(x))
+
+    profiler = canonicalizer.enable_instrumentation(prediction_network)
+    with torch.no_grad():
+        for _ in range(2):
+            output = prediction_network(canonicalizer(x))
+    stats = profiler.to_dict()
+
+    assert torch.allclose(output, expected)
+    assert set(stats) == {
+        "canonicalization_network",
+        "group_element",
+        "warp",
+        "prediction_network",
+    }
+    assert all(stage_stats["count"] == 2 for stage_stats in stats.values())
+    # the group element stage includes the canonicalization network, its self time does not
+    assert stats["group_element"]["total_ms"] >= (
+        stats["canonicalization_network"]["total_ms"]
+    )
+    assert stats["group_element"]["self_ms"] <= stats["group_element"]["total_ms"]
+
+    profiler.to_csv(tmp_path / "stages.csv")
+    with open(tmp_path / "stages.csv") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row["stage"] for row in rows] == list(stats)
+
+    canonicalizer.disable_instrumentation()
+    assert canonicalizer.instrumentation is None
+    assert "forward" not in vars(prediction_network)
+    assert "apply_inverse_group_element" not in vars(canonicalizer)
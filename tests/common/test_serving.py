@@ -0,0 +1,89 @@
+import asyncio
+from typing import List
+
+import pytest
+import torch
+from omegaconf import DictConfig
+
+from equiadapt import (
+    CanonicalizedModel,
+    DynamicBatchingServer,
+    EquivariantPointcloudCanonicalization,
+    VNSmall,
+)
+
+
+def test_dynamic_batching_matches_single_inputs() -> None:
+    """Test that concurrent requests are batched and every caller gets the outputs of its own input."""
+    torch.manual_seed(0)
+    model = CanonicalizedModel(
+        EquivariantPointcloudCanonicalization(
+            canonicalization_network=VNSmall(
+                DictConfig({"n_knn": 8, "pooling": "mean"})
+            ),
+            canonicalization_hyperparams=DictConfig({}),
+        ),
+        torch.nn.Conv1d(3, 4, 1),
+    )
+    point_clouds = torch.randn(10, 3, 64)
+
+    async def client(server: DynamicBatchingServer) -> List[tuple]:
+        return await asyncio.gather(*(server.infer(x) for x in point_clouds))
+
+    async def serve() -> List[tuple]:
+        async with DynamicBatchingServer(
+            model, max_batch_size=4, max_wait_ms=50.0
+        ) as server:
+            results = await client(server)
+            metrics = server.get_metrics()
+        assert metrics["queue_depth"] == 0
+        assert metrics["num_requests"] == 10
+        assert metrics["batch_size_histogram"] == {2: 1, 4: 2}
+        assert 0 < metrics["latency_p50"] <= metrics["latency_p99"]
+        return results
+
+    results = asyncio.run(serve())
+
+    with torch.no_grad():
+        for x, (prediction, rotation) in zip(point_clouds, results):
+            expected_prediction, expected_rotation = model(x[None])
+            assert torch.allclose(prediction, expected_prediction[0], atol=1e-5)
+            assert torch.allclose(rotation, expected_rotation[0], atol=1e-5)
+
+
+def test_dynamic_batching_propagates_errors() -> None:
+    """Test that an error of the model is raised to the callers of the batch, and the server keeps serving."""
+
+    async def serve() -> torch.Tensor:
+        async with DynamicBatchingServer(torch.nn.Linear(3, 2)) as server:
+            with pytest.raises(RuntimeError):
+                await server.infer(torch.randn(4))
+            return await server.infer(torch.randn(3))
+
+    assert asyncio.run(serve()).shape == (2,)
+
+
+def test_dynamic_batching_serves_requests_arriving_around_the_deadline() -> None:
+    """Test that no request is lost when requests keep arriving while a batch waits or runs."""
+    torch.manual_seed(0)
+    model = torch.nn.Linear(3, 2)
+    inputs = torch.randn(50, 3)
+
+    async def delayed_infer(server: DynamicBatchingServer, i: int) -> torch.Tensor:
+        await asyncio.sleep(i * 0.0005)
+        return await server.infer(inputs[i])
+
+    async def serve() -> List[torch.Tensor]:
+        async with DynamicBatchingServer(
+            model, max_batch_size=4, max_wait_ms=1.0
+        ) as server:
+            # a lost request would never resolve, so the wait would time out
+            return await asyncio.wait_for(
+                asyncio.gather(*(delayed_infer(server, i) for i in range(50))),
+                timeout=10.0,
+            )
+
+    results = asyncio.run(serve())
+
+    with torch.no_grad():
+        assert torch.allclose(torch.stack(results), model(inputs), atol=1e-6)
@@ -1,6 +1,7 @@
+import pytest
 import torch
 
-from equiadapt.common.utils import gram_schmidt
+from equiadapt.common.utils import LieParameterization, gram_schmidt, orthonormalize
 
 
 def test_gram_schmidt() -> None:
@@ -10,3 +11,61 @@ def test_gram_schmidt() -> None:
     output = gram_schmidt(vectors)
 
     assert torch.allclose(output[0][0][0], torch.tensor(0.5740), atol=1e-4)
+
+
+@pytest.mark.parametrize("group_dim", [2, 3])
+def test_lie_parameterization_closed_form(group_dim: int) -> None:
+    """
+    Test that the closed form exponential maps match torch.matrix_exp.
+
+    Args:
+        group_dim (int): The dimension of the rotations.
+    """
+    torch.manual_seed(0)
+    lie_parameterization = LieParameterization("SOn", group_dim)
+    num_params = group_dim * (group_dim - 1) // 2
+    params = torch.cat([torch.randn(4, num_params), torch.zeros(1, num_params)])
+    params = params.double()
+    son_bases = lie_parameterization.get_son_bases().double()
+
+    expected = torch.matrix_exp(torch.einsum("bs,sij->bij", params, son_bases))
+
+    rep = lie_parameterization.get_group_rep(params)
+    assert rep.dtype == params.dtype
+    assert torch.allclose(rep, expected)
+
+    sen_rep = LieParameterization("SEn", group_dim).get_group_rep(
+        torch.cat([params, torch.ones(5, group_dim).double()], dim=1)
+    )
+    assert torch.allclose(sen_rep[:, :group_dim, :group_dim], expected)
+    assert torch.equal(sen_rep[:, group_dim, group_dim], torch.ones(5).double())
+    assert torch.equal(
+        sen_rep[:, :group_dim, group_dim], torch.ones(5, group_dim).double()
+    )
+
+
+@pytest.mark.parametrize("method", ["gram_schmidt", "qr", "svd"])
+@pytest.mark.parametrize("shape", [(4, 2, 2), (4, 3, 3), (4, 3, 5)])
+def test_orthonormalize(method: str, shape: tuple) -> None:
+    """
+    Test that every orthonormalization method returns orthonormal frames, in SO(n) when asked.
+
+    Args:
+        method (str): The orthonormalization method.
+        shape (tuple): The shape of the batch of vectors.
+    """
+    torch.manual_seed(0)
+    vectors = torch.randn(shape, dtype=torch.float64)
+
+    output = orthonormalize(vectors, method=method, special=True)
+
+    identity = torch.eye(shape[1], dtype=torch.float64).expand(shape[0], -1, -1)
+    assert torch.allclose(output @ output.transpose(1, 2), identity)
+    if shape[1] == shape[2]:
+        assert torch.allclose(torch.linalg.det(output), torch.ones(shape[0]).double())
+    if method != "svd":
+        first_vectors = vectors[:, 0] / vectors[:, 0].norm(dim=-1, keepdim=True)
+        assert torch.allclose(output[:, 0], first_vectors)
+        assert torch.allclose(
+            output, orthonormalize(vectors, method="gram_schmidt", special=True)
+        )
@@ -1,10 +1,61 @@
 """
-    Dummy conftest.py for equiadapt.
+    Shared fixtures of the equiadapt tests.
 
-    If you don't know what this is for, just leave it empty.
     Read more about conftest.py under:
     - https://docs.pytest.org/en/stable/fixture.html
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
-# import pytest
+import pytest
+import torch
+from omegaconf import DictConfig
+
+
+class VectorNetwork(torch.nn.Module):
+    """Placeholder canonicalization network exposing `out_vector_size`."""
+
+    out_vector_size = 4
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """Returns a fixed size vector for each image."""
+        return x.flatten(1)[:, : self.out_vector_size]
+
+
+@pytest.fixture
+def vector_network() -> torch.nn.Module:
+    """
+    Fixture that returns a placeholder network for the optimized image canonicalizers.
+
+    Returns:
+        torch.nn.Module: A network returning the first values of each image as its output vector.
+    """
+    return VectorNetwork()
+
+
+@pytest.fixture
+def discrete_init_args(vector_network: torch.nn.Module) -> dict:
+    """
+    Initialize the arguments of a small OptimizedGroupEquivariantImageCanonicalization.
+
+    Args:
+        vector_network (torch.nn.Module): The placeholder canonicalization network.
+
+    Returns:
+        dict: The initialization arguments of a canonicalizer for the roto-reflections of 28x28 grayscale images.
+    """
+    canonicalization_hyperparams = DictConfig(
+        {
+            "beta": 1.0,
+            "group_type": "roto-reflection",
+            "num_rotations": 4,
+            "artifact_err_wt": 0.0,
+            "input_crop_ratio": 0.8,
+            "resize_shape": 32,
+            "learn_ref_vec": False,
+        }
+    )
+    return {
+        "canonicalization_network": vector_network,
+        "canonicalization_hyperparams": canonicalization_hyperparams,
+        "in_shape": (1, 28, 28),
+    }
@@ -1,11 +1,15 @@
 from typing import Generator
 from unittest.mock import Mock, patch
 
+import kornia as K
 import pytest
 import torch
 from omegaconf import DictConfig
 
-from equiadapt import ContinuousGroupImageCanonicalization
+from equiadapt import (
+    ContinuousGroupImageCanonicalization,
+    OptimizedSteerableImageCanonicalization,
+)
 
 
 @pytest.fixture
@@ -119,3 +123,158 @@ def canonicalization_instance() -> (
         },
     ):
         yield instance
+
+
+def test_apply_inverse_group_element_matches_warp_affine(
+    sample_input: torch.Tensor, init_args: dict
+) -> None:
+    """
+    Test that the single resampling of `apply_inverse_group_element` matches reflecting, padding, warping and cropping.
+
+    Args:
+        sample_input (torch.Tensor): A batch with one color image.
+        init_args (dict): The initialization arguments for the ContinuousGroupImageCanonicalization class.
+    """
+    cgic = ContinuousGroupImageCanonicalization(**init_args)
+    angle = torch.tensor(0.3)
+    rotation = torch.stack(
+        [
+            torch.stack([torch.cos(angle), -torch.sin(angle)]),
+            torch.stack([torch.sin(angle), torch.cos(angle)]),
+        ]
+    ).unsqueeze(0)
+    reflection = torch.ones(1, 1, 1, 1)
+
+    # reference: reflect, pad, apply the inverse rotation with warp_affine and crop
+    x = K.geometry.hflip(sample_input)
+    x = cgic.pad(x)
+    inverse_rotation = rotation.clone()
+    inverse_rotation[:, [0, 1], [1, 0]] *= -1
+    alpha, beta = inverse_rotation[:, 0, 0], inverse_rotation[:, 0, 1]
+    cx, cy = x.shape[-2] // 2, x.shape[-1] // 2
+    affine_part = torch.stack(
+        [(1 - alpha) * cx - beta * cy, beta * cx + (1 - alpha) * cy], dim=1
+    )
+    affine_matrices = torch.cat([inverse_rotation, affine_part.unsqueeze(-1)], dim=-1)
+    x = K.geometry.warp_affine(x, affine_matrices, dsize=(x.shape[-2], x.shape[-1]))
+    expected = cgic.crop(x)
+
+    canonicalized = cgic.apply_inverse_group_element(
+        sample_input, {"rotation": rotation, "reflection": reflection}
+    )
+
+    assert canonicalized.shape == expected.shape
+    assert torch.allclose(canonicalized, expected, atol=1e-4)
+
+
+def test_canonicalize_inference_compiles_without_graph_breaks() -> None:
+    """Test that `canonicalize_inference` and a prediction network are captured as a single graph."""
+    canonicalizer = OptimizedSteerableImageCanonicalization(
+        canonicalization_network=torch.nn.Sequential(
+            torch.nn.Flatten(), torch.nn.Linear(28 * 28, 4)
+        ),
+        canonicalization_hyperparams=DictConfig(
+            {
+                "group_type": "roto-reflection",
+                "input_crop_ratio": 0.9,
+                "resize_shape": 28,
+            }
+        ),
+        in_shape=(1, 28, 28),
+    ).eval()
+    prediction_network = torch.nn.Linear(28 * 28, 10)
+
+    def predict(x: torch.Tensor) -> tuple:
+        x_canonicalized, group_element = canonicalizer.canonicalize_inference(x)
+        return prediction_network(x_canonicalized.flatten(1)), group_element
+
+    torch.manual_seed(0)
+    x = torch.rand(4, 1, 28, 28)
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(predict)(x)
+
+    assert explanation.graph_break_count == 0
+    result = canonicalizer.canonicalize_stateless(x)
+    x_canonicalized, group_element = canonicalizer.canonicalize_inference(x)
+    assert torch.allclose(x_canonicalized, result.canonicalized_x, atol=1e-6)
+    assert torch.allclose(group_element, result.group_element_matrix_representation)
+
+
+def test_identity_short_circuit_only_warps_other_images(
+    sample_input: torch.Tensor, init_args: dict
+) -> None:
+    """
+    Test that with `identity_short_circuit` only the images whose group element is not the identity are warped.
+
+    Args:
+        sample_input (torch.Tensor): A batch with one color image.
+        init_args (dict): The initialization arguments for the ContinuousGroupImageCanonicalization class.
+    """
+    x = torch.cat([sample_input, sample_input.flip(-1)])
+    group_element_dict = {
+        "rotation": torch.stack(
+            [torch.eye(2), torch.tensor([[0.0, -1.0], [1.0, 0.0]])]
+        ),
+        "reflection": torch.zeros(2, 1, 1, 1),
+    }
+    expected = (
+        ContinuousGroupImageCanonicalization(**init_args)
+        .eval()
+        .apply_inverse_group_element(x, group_element_dict)
+    )
+
+    init_args["canonicalization_hyperparams"].identity_short_circuit = True
+    cgic = ContinuousGroupImageCanonicalization(**init_args).eval()
+    with patch.object(cgic, "warp_images", wraps=cgic.warp_images) as warp_images:
+        canonicalized = cgic.apply_inverse_group_element(x, group_element_dict)
+
+    assert warp_images.call_count == 1
+    assert warp_images.call_args.args[0].shape[0] == 1
+    assert torch.allclose(canonicalized, expected, atol=1e-5)
+
+    def get_groupelement_and_info(x: torch.Tensor) -> tuple:
+        return group_element_dict, {"group_element": group_element_dict}
+
+    # the stateless path returns the mask, only the stateful path counts it
+    with patch.object(cgic, "get_groupelement_and_info", get_groupelement_and_info):
+        result = cgic.canonicalize_stateless(x)
+        assert cgic.get_identity_short_circuit_rate() is None
+
+        cgic.canonicalize(x)
+
+    assert torch.equal(
+        result.canonicalization_info["identity_mask"], torch.tensor([True, False])
+    )
+    assert cgic.get_identity_short_circuit_rate() == 0.5
+
+
+@pytest.mark.parametrize("identity_short_circuit", [False, True])
+def test_invert_canonicalization_rotates_by_the_matrix_angle(
+    init_args: dict, identity_short_circuit: bool
+) -> None:
+    """
+    Test that inverting the canonicalization of scalar feature maps rotates them by the angle of the rotation matrix.
+
+    Args:
+        init_args (dict): The initialization arguments for the ContinuousGroupImageCanonicalization class.
+        identity_short_circuit (bool): Whether the images with the identity group element skip the inversion.
+    """
+    init_args["canonicalization_hyperparams"].identity_short_circuit = (
+        identity_short_circuit
+    )
+    cgic = ContinuousGroupImageCanonicalization(**init_args).eval()
+    group_element_dict = {
+        "rotation": torch.stack(
+            [torch.eye(2), torch.tensor([[0.0, -1.0], [1.0, 0.0]])]
+        ),
+        "reflection": torch.tensor([0.0, 1.0]).reshape(2, 1, 1, 1),
+    }
+    cgic.canonicalization_info_dict = {"group_element": group_element_dict}
+    feature_map = torch.rand(2, 1, 32, 32)
+
+    inverted = cgic.invert_canonicalization(feature_map, induced_rep_type="scalar")
+
+    # the canonicalization rotates the (maybe reflected) images by the opposite angle
+    rotated = K.geometry.rotate(feature_map[1:], torch.tensor([-90.0]))
+    assert torch.allclose(inverted[0], feature_map[0], atol=1e-5)
+    assert torch.allclose(inverted[1:], K.geometry.hflip(rotated), atol=1e-5)
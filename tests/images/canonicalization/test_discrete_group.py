@@ -0,0 +1,189 @@
+from unittest.mock import patch
+
+import kornia as K
+import pytest
+import torch
+
+from equiadapt import OptimizedGroupEquivariantImageCanonicalization
+from equiadapt.images.canonicalization.discrete_group import (
+    MAX_CACHED_GROUP_AUGMENT_GRIDS,
+)
+
+
+def reference_group_augment(
+    canonicalizer: OptimizedGroupEquivariantImageCanonicalization, x: torch.Tensor
+) -> torch.Tensor:
+    """Pads, rotates, maybe reflects and crops each group element one at a time."""
+    degrees = torch.linspace(0, 360, canonicalizer.num_rotations + 1)[:-1]
+    x_augmented_list = []
+    for reflect in (False, True)[: canonicalizer.num_group // len(degrees)]:
+        for degree in degrees:
+            x_rot = canonicalizer.pad_group_augment(x)
+            x_rot = K.geometry.rotate(x_rot, -degree)
+            if reflect:
+                x_rot = K.geometry.hflip(x_rot)
+            x_augmented_list.append(canonicalizer.crop_group_augment(x_rot))
+    return torch.cat(x_augmented_list, dim=0)
+
+
+@pytest.mark.parametrize("rotation_backend", ["auto", "interpolate"])
+@pytest.mark.parametrize("group_type", ["rotation", "roto-reflection"])
+@pytest.mark.parametrize("in_shape", [(3, 40, 40), (1, 28, 28)])
+def test_group_augment_matches_reference(
+    discrete_init_args: dict, group_type: str, in_shape: tuple, rotation_backend: str
+) -> None:
+    """
+    Test that the single warp (or pixel permutation) in `group_augment` matches the per-element augmentation.
+
+    Args:
+        discrete_init_args (dict): The initialization arguments of the canonicalizer.
+        group_type (str): The type of group, either rotation or roto-reflection.
+        in_shape (tuple): The shape of the input images.
+        rotation_backend (str): The backend used to rotate the images.
+    """
+    discrete_init_args["canonicalization_hyperparams"].group_type = group_type
+    discrete_init_args["canonicalization_hyperparams"].rotation_backend = (
+        rotation_backend
+    )
+    discrete_init_args["in_shape"] = in_shape
+    canonicalizer = OptimizedGroupEquivariantImageCanonicalization(**discrete_init_args)
+    torch.manual_seed(0)
+    x = torch.rand((2, in_shape[0], 32, 32) if in_shape[0] == 3 else (2, *in_shape))
+
+    x_augmented = canonicalizer.group_augment(x)
+
+    assert x_augmented.shape == (canonicalizer.num_group * 2, *x.shape[1:])
+    x_reference = reference_group_augment(canonicalizer, x)
+    assert torch.allclose(x_augmented, x_reference, atol=1e-4)
+
+    degrees = torch.linspace(0, 360, canonicalizer.num_rotations + 1)[:-1]
+    x_rotated = canonicalizer.rotate_and_maybe_reflect(x, degrees)
+    if group_type == "roto-reflection":
+        x_rotated += canonicalizer.rotate_and_maybe_reflect(x, degrees, reflect=True)
+    assert torch.allclose(torch.cat(x_rotated, dim=0), x_reference, atol=1e-4)
+
+
+@pytest.mark.parametrize("group_type", ["rotation", "roto-reflection"])
+def test_canonicalize_inference_compiles_without_graph_breaks(
+    discrete_init_args: dict, group_type: str
+) -> None:
+    """
+    Test that `canonicalize_inference` and a prediction network are captured as a single graph.
+
+    Args:
+        discrete_init_args (dict): The initialization arguments of the canonicalizer.
+        group_type (str): The type of group, either rotation or roto-reflection.
+    """
+    discrete_init_args["canonicalization_hyperparams"].group_type = group_type
+    canonicalizer = OptimizedGroupEquivariantImageCanonicalization(
+        **discrete_init_args
+    ).eval()
+    prediction_network = torch.nn.Linear(28 * 28, 10)
+
+    def predict(x: torch.Tensor) -> tuple:
+        x_canonicalized, group_element = canonicalizer.canonicalize_inference(x)
+        return prediction_network(x_canonicalized.flatten(1)), group_element
+
+    torch.manual_seed(0)
+    x = torch.rand(2, 1, 28, 28)
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(predict)(x)
+
+    assert explanation.graph_break_count == 0
+    result = canonicalizer.canonicalize_stateless(x)
+    x_canonicalized, group_element = canonicalizer.canonicalize_inference(x)
+    assert torch.equal(x_canonicalized, result.canonicalized_x)
+    assert torch.equal(group_element, result.group_activations.argmax(dim=-1))
+
+
+def test_prior_regularization_loss_is_cross_entropy_to_identity(
+    discrete_init_args: dict,
+) -> None:
+    """
+    Test that the prior regularization loss is the cross entropy with the identity as target.
+
+    Args:
+        discrete_init_args (dict): The initialization arguments of the canonicalizer.
+    """
+    canonicalizer = OptimizedGroupEquivariantImageCanonicalization(**discrete_init_args)
+    torch.manual_seed(0)
+    result = canonicalizer.canonicalize_stateless(torch.rand(3, 1, 28, 28))
+    group_activations = result.canonicalization_info["group_activations"]
+
+    expected = torch.nn.functional.cross_entropy(
+        group_activations, torch.zeros(3, dtype=torch.long)
+    )
+    assert torch.allclose(
+        canonicalizer.get_prior_regularization_loss(result), expected
+    )
+
+
+def test_group_augment_grid_cache_is_bounded(discrete_init_args: dict) -> None:
+    """
+    Test that the grids of other input sizes are cached in a bounded cache, not as buffers.
+
+    Args:
+        discrete_init_args (dict): The initialization arguments of the canonicalizer.
+    """
+    discrete_init_args["canonicalization_hyperparams"].group_type = "rotation"
+    discrete_init_args["in_shape"] = (3, 40, 40)
+    canonicalizer = OptimizedGroupEquivariantImageCanonicalization(**discrete_init_args)
+    buffers = dict(canonicalizer.named_buffers()).keys()
+
+    cache = canonicalizer.group_augment_grid_cache
+    for size in range(34, 36 + MAX_CACHED_GROUP_AUGMENT_GRIDS):
+        canonicalizer.group_augment(torch.rand(1, 3, size, size))
+        assert 0 < len(cache) <= MAX_CACHED_GROUP_AUGMENT_GRIDS
+
+    assert dict(canonicalizer.named_buffers()).keys() == buffers
+    assert not any(key.startswith("group_augment_grid_") for key in buffers)
+
+
+@pytest.mark.parametrize("identity_short_circuit", [False, True])
+def test_invert_canonicalization_undoes_canonicalize(
+    discrete_init_args: dict, identity_short_circuit: bool
+) -> None:
+    """
+    Test that inverting the canonicalization of scalar feature maps gives back the input images.
+
+    Args:
+        discrete_init_args (dict): The initialization arguments of the canonicalizer.
+        identity_short_circuit (bool): Whether the images with the identity group element skip the inversion.
+    """
+    canonicalization_hyperparams = discrete_init_args["canonicalization_hyperparams"]
+    canonicalization_hyperparams.rotation_backend = "exact"
+    canonicalization_hyperparams.identity_short_circuit = identity_short_circuit
+    canonicalizer = OptimizedGroupEquivariantImageCanonicalization(
+        **discrete_init_args
+    ).eval()
+    group_element_dict = {
+        "rotation": torch.tensor([0.0, 90.0, 270.0]),
+        "reflection": torch.tensor([0.0, 0.0, 1.0]),
+    }
+
+    def get_groupelement_and_info(x: torch.Tensor) -> tuple:
+        return group_element_dict, {"group_element": group_element_dict}
+
+    torch.manual_seed(0)
+    x = torch.rand(3, 1, 28, 28)
+    with patch.object(
+        canonicalizer, "get_groupelement_and_info", get_groupelement_and_info
+    ):
+        x_canonicalized = canonicalizer.canonicalize(x)
+        result = canonicalizer.canonicalize_stateless(x)
+
+    assert not torch.equal(x_canonicalized[1:], x[1:])
+    assert torch.equal(
+        canonicalizer.invert_canonicalization(
+            x_canonicalized, induced_rep_type="scalar"
+        ),
+        x,
+    )
+    assert torch.equal(
+        canonicalizer.invert_canonicalization(
+            result.canonicalized_x,
+            induced_rep_type="scalar",
+            canonicalization_result=result,
+        ),
+        x,
+    )
@@ -0,0 +1,41 @@
+import torch
+
+from equiadapt import RotationEquivariantConv, RotoReflectionEquivariantConv
+
+
+def test_filter_bank_cache() -> None:
+    """Test that the filter bank is cached in eval mode and rebuilt when the weights change."""
+    layer = RotationEquivariantConv(2, 3, kernel_size=3, device="cpu")
+    layer.eval()
+
+    with torch.no_grad():
+        filter_bank = layer.get_cached_filter_bank()
+        assert layer.get_cached_filter_bank() is filter_bank
+
+        # in-place updates of the weights invalidate the cache
+        layer.weights.mul_(2.0)
+        assert torch.allclose(layer.get_cached_filter_bank(), 2.0 * filter_bank)
+
+    # gradients are required, so the filter bank is rebuilt and not cached
+    assert layer.get_cached_filter_bank().requires_grad
+
+    layer.train()
+    assert layer.filter_bank_cache is None
+
+
+def test_group_permutation_indices() -> None:
+    """Test that the compact permutation indices match the per-element permutations of the group axis."""
+    num_rotations = 4
+    layer = RotoReflectionEquivariantConv(
+        2, 3, kernel_size=3, num_rotations=num_rotations, device="cpu"
+    )
+
+    # rotations shift the group axis cyclically, reflections also swap its two halves
+    shift = [[(j - i) % num_rotations for j in range(4)] for i in range(4)]
+    shift_inverse = [[(j + i) % num_rotations + 4 for j in range(4)] for i in range(4)]
+    expected = torch.tensor(
+        [a + b for a, b in zip(shift, shift_inverse)]
+        + [b + a for a, b in zip(shift, shift_inverse)]
+    )
+
+    assert torch.equal(layer.permute_indices, expected)
@@ -0,0 +1,121 @@
+import kornia as K
+import pytest
+import torch
+
+from equiadapt.images.utils import (
+    flip_boxes,
+    get_action_on_image_features,
+    rot90_images,
+    rotate_boxes,
+    rotate_images,
+    transform_targets,
+)
+
+
+def test_rot90_images_matches_interpolation() -> None:
+    """Test that the exact rot90/flip backend matches the interpolated rotation."""
+    torch.manual_seed(0)
+    x = torch.rand((8, 3, 16, 16))
+    angles = torch.tensor([0.0, 90.0, 180.0, 270.0] * 2)
+    reflect = torch.tensor([0.0] * 4 + [1.0] * 4)
+
+    reflect_indicator = reflect[:, None, None, None]
+    x_reflected = (1 - reflect_indicator) * x + reflect_indicator * K.geometry.hflip(x)
+    expected = K.geometry.rotate(x_reflected, angles)
+
+    assert torch.allclose(rot90_images(x, angles, reflect), expected, atol=1e-4)
+    assert torch.allclose(
+        rotate_images(x, angles, num_rotations=4),
+        K.geometry.rotate(x, angles),
+        atol=1e-4,
+    )
+
+
+def test_rot90_images_leaves_identities_unchanged() -> None:
+    """Test that the identity group element returns the images unchanged."""
+    x = torch.rand((2, 1, 8, 8))
+
+    assert torch.equal(rot90_images(x, torch.zeros(2), torch.zeros(2)), x)
+
+
+@pytest.mark.parametrize("induced_rep_type", ["regular", "scalar"])
+@pytest.mark.parametrize("num_group", [4, 8])
+def test_action_on_image_features_matches_interpolation(
+    induced_rep_type: str, num_group: int
+) -> None:
+    """
+    Test that the exact action on C4/D4 feature maps matches the interpolated one and undoes the canonicalization.
+
+    Args:
+        induced_rep_type (str): The type of induced representation.
+        num_group (int): The number of group elements, 4 for C4 and 8 for D4.
+    """
+    torch.manual_seed(0)
+    feature_map = torch.rand((8, 2 * num_group, 16, 16))
+    group_info_dict = {"num_rotations": 4, "num_group": num_group}
+    group_element_dict = {"rotation": torch.tensor([0.0, 90.0, 180.0, 270.0] * 2)}
+    if num_group == 8:
+        group_element_dict["reflection"] = torch.tensor([0.0] * 4 + [1.0] * 4)
+
+    x_out = {
+        backend: get_action_on_image_features(
+            feature_map,
+            group_info_dict,
+            group_element_dict,
+            induced_rep_type=induced_rep_type,
+            rotation_backend=backend,
+        )
+        for backend in ("exact", "interpolate")
+    }
+
+    assert torch.allclose(x_out["exact"], x_out["interpolate"], atol=1e-4)
+    if induced_rep_type == "scalar":
+        # the canonicalizers flip first, then rotate by the opposite angle
+        canonicalized = rot90_images(
+            feature_map,
+            -group_element_dict["rotation"],
+            group_element_dict.get("reflection"),
+        )
+        assert torch.equal(
+            get_action_on_image_features(
+                canonicalized,
+                group_info_dict,
+                group_element_dict,
+                induced_rep_type="scalar",
+                rotation_backend="exact",
+            ),
+            feature_map,
+        )
+
+
+def test_transform_targets_matches_per_image_transforms() -> None:
+    """Test that the vectorized target transform matches transforming every image on its own."""
+    torch.manual_seed(0)
+    num_instances = [2, 0, 3]
+    targets = [
+        {
+            "boxes": torch.rand(n, 4) * 8 + torch.tensor([0.0, 0.0, 8.0, 8.0]),
+            "masks": (torch.rand(n, 16, 16) > 0.5).to(torch.uint8),
+            "labels": torch.arange(n),
+        }
+        for n in num_instances
+    ]
+    angles = torch.tensor([90.0, 180.0, 270.0])
+    reflect = torch.tensor([1.0, 0.0, 1.0])
+
+    transformed = transform_targets(
+        targets, angles, 16, reflect=reflect, num_rotations=4
+    )
+
+    for target, transformed_target, angle, is_reflected in zip(
+        targets, transformed, angles, reflect
+    ):
+        boxes, masks = target["boxes"].clone(), target["masks"]
+        if is_reflected:
+            boxes, masks = flip_boxes(boxes, 16), masks.flip(-1)
+        expected_boxes = rotate_boxes(boxes, angle, 16)
+        expected_masks = torch.rot90(masks, -int(angle) // 90, dims=(-2, -1))
+
+        assert torch.allclose(transformed_target["boxes"], expected_boxes, atol=1e-4)
+        assert torch.equal(transformed_target["masks"], expected_masks)
+        assert transformed_target["labels"] is target["labels"]
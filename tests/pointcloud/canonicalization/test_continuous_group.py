@@ -0,0 +1,103 @@
+import pytest
+import torch
+from omegaconf import DictConfig
+
+from equiadapt.pointcloud.canonicalization.continuous_group import (
+    EquivariantPointcloudCanonicalization,
+)
+from equiadapt.pointcloud.canonicalization_networks import VNSmall
+from equiadapt.pointcloud.canonicalization_networks.equivariant_networks import knn
+
+
+def test_shared_knn_idx() -> None:
+    """Test that the shared knn indices are the nearest neighbors of the canonicalized point cloud."""
+    torch.manual_seed(0)
+    canonicalizer = EquivariantPointcloudCanonicalization(
+        canonicalization_network=VNSmall(DictConfig({"n_knn": 8, "pooling": "mean"})),
+        canonicalization_hyperparams=DictConfig({"share_knn_idx": True}),
+    ).eval()
+    x = torch.randn(2, 3, 64, dtype=torch.float64)
+    canonicalizer.double()
+
+    result = canonicalizer.canonicalize_stateless(x)
+    knn_idx = canonicalizer.get_knn_idx(result)
+
+    assert knn_idx is not None
+    assert knn_idx.shape == (2, 64, 8)
+    assert torch.equal(knn_idx, knn(result.canonicalized_x, k=8))
+    assert torch.allclose(
+        result.canonicalized_x, canonicalizer.canonicalize(x), atol=1e-10
+    )
+
+
+@pytest.mark.parametrize("subsample_method", ["random", "fps", "voxel"])
+def test_subsampled_canonicalization(subsample_method: str) -> None:
+    """
+    Test that the rotation predicted from the subsampled points is applied to the full point cloud.
+
+    Args:
+        subsample_method (str): The subsampling method.
+    """
+    torch.manual_seed(0)
+    canonicalizer = EquivariantPointcloudCanonicalization(
+        canonicalization_network=VNSmall(DictConfig({"n_knn": 8, "pooling": "mean"})),
+        canonicalization_hyperparams=DictConfig(
+            {"subsample_method": subsample_method, "num_subsampled_points": 32}
+        ),
+    ).eval()
+    x = torch.randn(2, 3, 128)
+
+    assert canonicalizer.subsample(x).shape == (2, 3, 32)
+
+    result = canonicalizer.canonicalize_stateless(x)
+    rotation = result.group_element["rotation"]
+
+    assert result.canonicalized_x.shape == x.shape
+    assert torch.allclose(
+        result.canonicalized_x,
+        torch.bmm(x.transpose(1, 2), rotation.transpose(1, 2)).transpose(1, 2),
+    )
+
+    frame_agreement = canonicalizer.get_subsampling_frame_agreement(x, [32, 127])
+    assert set(frame_agreement) == {32, 127}
+    for agreement in frame_agreement.values():
+        assert 0.0 <= agreement["mean_angle"] <= agreement["max_angle"] <= 180.0
+        assert 0.0 <= agreement["agreement"] <= 1.0
+
+
+def test_subsampling_requires_enough_points_for_knn() -> None:
+    """Test that subsampling fewer points than the nearest neighbors of the network is rejected."""
+    with pytest.raises(ValueError, match="n_knn"):
+        EquivariantPointcloudCanonicalization(
+            canonicalization_network=VNSmall(
+                DictConfig({"n_knn": 8, "pooling": "mean"})
+            ),
+            canonicalization_hyperparams=DictConfig(
+                {"subsample_method": "fps", "num_subsampled_points": 4}
+            ),
+        )
+
+
+def test_canonicalize_inference_compiles_without_graph_breaks() -> None:
+    """Test that `canonicalize_inference` and a prediction network are captured as a single graph."""
+    torch.manual_seed(0)
+    canonicalizer = EquivariantPointcloudCanonicalization(
+        canonicalization_network=VNSmall(DictConfig({"n_knn": 8, "pooling": "mean"})),
+        canonicalization_hyperparams=DictConfig({}),
+    ).eval()
+    prediction_network = torch.nn.Linear(3, 4)
+
+    def predict(x: torch.Tensor) -> tuple:
+        x_canonicalized, rotation = canonicalizer.canonicalize_inference(x)
+        return prediction_network(x_canonicalized.transpose(1, 2)), rotation
+
+    x = torch.randn(2, 3, 64)
+    torch._dynamo.reset()
+    with torch.no_grad():
+        explanation = torch._dynamo.explain(predict)(x)
+        result = canonicalizer.canonicalize_stateless(x)
+        x_canonicalized, rotation = canonicalizer.canonicalize_inference(x)
+
+    assert explanation.graph_break_count == 0
+    assert torch.allclose(x_canonicalized, result.canonicalized_x, atol=1e-6)
+    assert torch.allclose(rotation, result.group_element["rotation"], atol=1e-6)
@@ -0,0 +1,57 @@
+import pytest
+import torch
+
+from equiadapt.pointcloud.utils import knn
+
+
+def get_knn_distances(x: torch.Tensor, idx: torch.Tensor) -> torch.Tensor:
+    """Returns the distances from every point to its neighbors."""
+    points = x.transpose(2, 1)
+    neighbors = torch.gather(
+        points.unsqueeze(1).expand(-1, idx.shape[1], -1, -1),
+        2,
+        idx.unsqueeze(-1).expand(-1, -1, -1, points.shape[-1]),
+    )
+    return (neighbors - points.unsqueeze(2)).norm(dim=-1)
+
+
+@pytest.mark.parametrize("backend", ["tiled", "voxel"])
+def test_knn_backends_match_dense(backend: str) -> None:
+    """
+    Test that the tiled and voxel backends find the same neighbors as the dense backend.
+
+    The voxel size covers the whole point cloud so that the voxel backend is exact here.
+
+    Args:
+        backend (str): The backend of the nearest neighbor search.
+    """
+    torch.manual_seed(0)
+    x = torch.rand(2, 3, 300, dtype=torch.float64)
+    expected = knn(x, k=10, backend="dense")
+
+    idx = knn(
+        x,
+        k=10,
+        backend=backend,
+        max_tile_elements=1000,
+        voxel_size=1.0,
+        max_points_per_voxel=300,
+    )
+
+    assert idx.shape == expected.shape
+    assert torch.equal(idx[..., 0], torch.arange(300).expand(2, -1))
+    assert torch.allclose(get_knn_distances(x, idx), get_knn_distances(x, expected))
+
+
+def test_knn_voxel_estimated_voxel_size() -> None:
+    """Test that the voxel backend with the estimated voxel size returns valid, mostly exact neighbors."""
+    torch.manual_seed(0)
+    x = torch.rand(1, 3, 2000)
+    expected = knn(x, k=8, backend="dense")
+
+    idx = knn(x, k=8, backend="voxel")
+
+    assert idx.shape == expected.shape
+    assert idx.min() >= 0 and idx.max() < 2000
+    recall = (idx.unsqueeze(-1) == expected.unsqueeze(-2)).any(-1).float().mean()
+    assert recall > 0.9
@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+HEAVY_MODULES = ("e2cnn", "kornia", "torchvision", "omegaconf")
+
+# budget for the time spent in the equiadapt modules themselves, excluding their dependencies.
+# It is generous so that shared runners do not fail on noise, and can be set with EQUIADAPT_IMPORT_TIME_BUDGET_MS
+IMPORT_TIME_BUDGET_US = (
+    int(os.environ.get("EQUIADAPT_IMPORT_TIME_BUDGET_MS", "500")) * 1000
+)
+
+
+def get_import_times(statement: str) -> Dict[str, int]:
+    """
+    Runs a statement in a fresh interpreter with `-X importtime`.
+
+    Args:
+        statement (str): The statement to run.
+
+    Returns:
+        Dict[str, int]: The self import time in microseconds of every imported module.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, _, module = line[len("import time:") :].split("|")
+        import_times[module.strip()] = int(self_time)
+    return import_times
+
+
+def test_import_equiadapt_is_lazy() -> None:
+    """Test that importing the package does not import torch or any backend."""
+    import_times = get_import_times("import equiadapt")
+
+    for module in ("torch",) + HEAVY_MODULES:
+        assert module not in import_times
+
+
+@pytest.mark.parametrize(
+    "statement, allowed_modules",
+    [
+        ("import equiadapt", ()),
+        ("from equiadapt import gram_schmidt", ()),
+        ("from equiadapt import CanonicalizationResult", ()),
+        ("from equiadapt import EquivariantPointcloudCanonicalization", ("omegaconf",)),
+    ],
+)
+def test_entry_points_skip_heavy_backends(
+    statement: str, allowed_modules: tuple
+) -> None:
+    """
+    Test that the entry points only import the backends they need, within the import time budget.
+
+    Args:
+        statement (str): The import statement of the entry point.
+        allowed_modules (tuple): The heavy modules the entry point needs.
+    """
+    import_times = get_import_times(statement)
+
+    for module in HEAVY_MODULES:
+        if module not in allowed_modules:
+            assert module not in import_times
+
+    package_import_time = sum(
+        import_time
+        for module, import_time in import_times.items()
+        if module == "equiadapt" or module.startswith("equiadapt.")
+    )
+    assert package_import_time < IMPORT_TIME_BUDGET_US